@@ -4,7 +4,7 @@ API REST independiente del frontend.
 """
 from flask import Flask, send_from_directory
 from flask_cors import CORS
-from src.config import HOST, PORT, UPLOAD_DIR
+from src.config import HOST, PORT, UPLOAD_DIR, PDF_WARMUP, RENDER_WORKERS
 
 
 def create_app():
@@ -27,6 +27,27 @@ def create_app():
     from src.routes import api
     app.register_blueprint(api)
 
+    # Métricas Prometheus: latencia por ruta y GET /metrics
+    from src.metrics import init_app as init_metrics
+    init_metrics(app)
+
+    # Perfilado bajo demanda (solo con PROFILING_ENABLED=1)
+    from src.profiling import init_app as init_profiling
+    init_profiling(app)
+
+    # Levantar el pool de render (cada proceso se calienta solo); si se
+    # renderiza en el hilo, calentar WeasyPrint (fuentes + estilos) aquí
+    if RENDER_WORKERS > 0:
+        from src.render_pool import start
+        start()
+    elif PDF_WARMUP:
+        from src.pdf_service import warm_up
+        warm_up()
+
+    # Limpieza de uploads y PDFs en segundo plano (un barrido a la vez entre workers)
+    from src.janitor import start as start_janitor
+    start_janitor()
+
     # Servir imágenes subidas
     @app.route("/uploads/<filename>")
     def serve_upload(filename):
@@ -0,0 +1 @@
+# Benchmarks del backend (se ejecutan con: python -m bench.<modulo>)
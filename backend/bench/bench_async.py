@@ -0,0 +1,92 @@
+"""
+Benchmark del modo async de Gemini contra un servidor falso con latencia.
+- Levanta FakeGeminiServer (HTTP local, p. ej. 2 s por llamada) y apunta
+  el cliente real de google.genai a él con GEMINI_BASE_URL
+- sync: edit_section desde N hilos (como los hilos de un worker gthread)
+- async: edit_section_async para todas las llamadas a la vez en el loop
+  del proceso (aio_runner)
+- Reporta tiempo total, llamadas por segundo y máximo de llamadas
+  simultáneas que vio el servidor
+
+Uso:
+    python -m bench.bench_async [--calls 200] [--latency 2] [--threads 16]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .fake_gemini_server import FakeGeminiServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=2.0, help="segundos por llamada")
+    parser.add_argument("--threads", type=int, default=16, help="hilos del modo sync")
+    parser.add_argument("--output", help="archivo JSON de resultados (por defecto stdout)")
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(latency=args.latency).start()
+
+    # El entorno se fija antes de importar src: sin cuota ni reintentos,
+    # y techos de concurrencia que no limiten la medición
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="tareinador-bench-"))
+    os.environ["GEMINI_BASE_URL"] = server.url
+    os.environ["GEMINI_RPM"] = "0"
+    os.environ["GEMINI_RETRIES"] = "0"
+    os.environ["GEMINI_MAX_CONCURRENCY"] = str(args.threads)
+    os.environ["GEMINI_ASYNC_CONCURRENCY"] = str(args.calls)
+
+    from src import aio_runner
+    from src.gemini_service import edit_section, edit_section_async
+
+    content = "<h2>Sección</h2><p>Contenido a editar.</p>"
+
+    def sync_calls():
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            return list(pool.map(
+                lambda i: edit_section(content, f"Instrucción {i}"), range(args.calls)
+            ))
+
+    async def gather_calls():
+        return await asyncio.gather(*(
+            edit_section_async(content, f"Instrucción {i}") for i in range(args.calls)
+        ))
+
+    results = {}
+    for mode, run in (("sync", sync_calls), ("async", lambda: aio_runner.run(gather_calls()))):
+        server.reset()
+        t0 = time.perf_counter()
+        outputs = run()
+        elapsed = time.perf_counter() - t0
+        results[mode] = {
+            "seconds": round(elapsed, 2),
+            "calls_per_second": round(args.calls / elapsed, 1),
+            "peak_in_flight": server.peak_in_flight,
+            "errors": sum(1 for html in outputs if html.startswith("<p>Error al editar:")),
+        }
+    server.stop()
+
+    report = {
+        "python": sys.version.split()[0],
+        "calls": args.calls,
+        "latency_s": args.latency,
+        "sync_threads": args.threads,
+        "results": results,
+        "speedup": round(results["sync"]["seconds"] / results["async"]["seconds"], 1),
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark y corpus del parser de respuestas de Gemini.
+Compara el parser anterior (json.loads + regex codiciosa) con el parser
+tolerante de una sola pasada:
+- corpus/: respuestas mal formadas reales; expected.json indica cuántas
+  páginas se deben rescatar y cuántas descartar
+- respuestas sintéticas de n páginas: válidas, truncadas y sin cerrar
+Uso: python -m bench.bench_json_parser [--pages 50 200 800]
+Sale con código 1 si el corpus no da lo esperado.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from src.json_stream import parse_pages
+from .synthetic import make_document
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+
+
+# ─── Implementación anterior (referencia) ───
+
+def legacy_parse(raw):
+    cleaned = re.sub(r'^```(?:json)?\s*', '', raw)
+    cleaned = re.sub(r'\s*```$', '', cleaned)
+    try:
+        return json.loads(cleaned)
+    except json.JSONDecodeError:
+        pass
+    match = re.search(r'\{[\s\S]*\}', raw)
+    if match:
+        try:
+            return json.loads(match.group())
+        except json.JSONDecodeError:
+            pass
+    return None
+
+
+def _legacy_pages(raw):
+    parsed = legacy_parse(raw)
+    return len(parsed["pages"]) if parsed and "pages" in parsed else 0
+
+
+# ─── Medición ───
+
+def _timeit(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def check_corpus():
+    """Resultados por archivo del corpus; ok=False si no coincide con expected.json."""
+    with open(os.path.join(CORPUS_DIR, "expected.json")) as f:
+        expected = json.load(f)
+    results = []
+    for name in sorted(expected):
+        with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+            raw = f.read()
+        pages, parser = parse_pages(raw)
+        results.append({
+            "file": name,
+            "pages": len(pages),
+            "dropped": parser.dropped,
+            "repaired": parser.repaired,
+            "legacy_pages": _legacy_pages(raw),
+            "ok": {"pages": len(pages), "dropped": parser.dropped} == expected[name],
+        })
+    return results
+
+
+def run(sizes, repeat=5):
+    results = []
+    for n in sizes:
+        pages = [
+            {k: p[k] for k in ("type", "title", "content")}
+            for p in make_document(n)["pages"]
+        ]
+        valid = json.dumps({"pages": pages}, ensure_ascii=False, indent=2)
+        cases = {
+            "valid": valid,
+            "truncated": valid[: len(valid) * 9 // 10],
+            "unclosed": "{ " * (len(valid) // 200),
+        }
+        for case, raw in cases.items():
+            results.append({
+                "pages": n,
+                "case": case,
+                "bytes": len(raw),
+                "legacy_ms": _timeit(lambda: legacy_parse(raw), repeat),
+                "legacy_recovered": _legacy_pages(raw),
+                "salvage_ms": _timeit(lambda: parse_pages(raw), repeat),
+                "salvage_recovered": len(parse_pages(raw)[0]),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 200, 800])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    failures = 0
+    for r in check_corpus():
+        failures += not r["ok"]
+        print(
+            f"{r['file']:<30} páginas {r['pages']:>2} (antes {r['legacy_pages']:>2})"
+            f" | descartadas {r['dropped']} | reparadas {r['repaired']}"
+            f" | {'ok' if r['ok'] else 'DISTINTO'}"
+        )
+    print()
+    for r in run(args.pages, args.repeat):
+        print(
+            f"{r['pages']:>4} páginas {r['case']:<9} {r['bytes'] / 1024:8.0f} KB"
+            f" | anterior {r['legacy_ms']:9.2f} ms ({r['legacy_recovered']:>3} pág.)"
+            f" | tolerante {r['salvage_ms']:8.2f} ms ({r['salvage_recovered']:>3} pág.)"
+        )
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
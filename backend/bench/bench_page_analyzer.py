@@ -0,0 +1,131 @@
+"""
+Benchmark del estimador de páginas.
+Compara el parser anterior (html.parser.HTMLParser, sin memoria) con el
+tokenizer actual memorizado y el PageMap incremental.
+Uso: python -m bench.bench_page_analyzer [--pages 100 200 400]
+"""
+import argparse
+import re
+import time
+from html.parser import HTMLParser
+from src import page_analyzer
+from src.page_analyzer import (
+    ELEMENT_LINES, LINES_PER_PAGE, WORDS_PER_LINE, WORDS_PER_PAGE,
+    calculate_page_map, estimate_pages,
+)
+from .synthetic import make_document
+
+
+# ─── Implementación anterior (referencia) ───
+
+class _LegacyParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.total_lines = 0.0
+        self._current_text = []
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        self.total_lines += ELEMENT_LINES.get(tag.lower(), 0)
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+
+    def handle_data(self, data):
+        self._current_text.append(data)
+
+    def _flush_text(self):
+        if not self._current_text:
+            return
+        text = " ".join(self._current_text).strip()
+        self._current_text = []
+        if text:
+            self.total_lines += len(text.split()) / WORDS_PER_LINE
+
+
+def legacy_estimate_pages(html_content):
+    if not html_content:
+        return 1
+    parser = _LegacyParser()
+    try:
+        parser.feed(html_content)
+        parser._flush_text()
+    except Exception:
+        text = re.sub(r'<[^>]+>', ' ', html_content)
+        return max(1, round(len(text.split()) / WORDS_PER_PAGE))
+    return max(1, round(parser.total_lines / LINES_PER_PAGE))
+
+
+def legacy_page_map(doc):
+    current_page = 3
+    page_map = []
+    for page in doc["pages"]:
+        page_map.append({"title": page["title"], "start_page": current_page})
+        current_page += legacy_estimate_pages(page["content"])
+    return page_map
+
+
+# ─── Medición ───
+
+def _timeit(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def run(sizes, repeat=5):
+    results = []
+    for n in sizes:
+        doc = make_document(n)
+        contents = [p["content"] for p in doc["pages"]]
+
+        # Las estimaciones deben coincidir con el parser anterior
+        mismatches = sum(
+            legacy_estimate_pages(c) != page_analyzer._estimate_cached.__wrapped__(c)
+            for c in contents
+        )
+
+        def cold():
+            page_analyzer._estimate_cached.cache_clear()
+            for c in contents:
+                estimate_pages(c)
+
+        def edit_one():
+            doc["pages"][n // 2]["content"] += "<p>edición</p>"
+            calculate_page_map(doc)
+
+        calculate_page_map(doc)  # calentar PageMap
+        results.append({
+            "pages": n,
+            "mismatches": mismatches,
+            "legacy_estimate_ms": _timeit(lambda: [legacy_estimate_pages(c) for c in contents], repeat),
+            "tokenizer_cold_ms": _timeit(cold, repeat),
+            "legacy_page_map_ms": _timeit(lambda: legacy_page_map(doc), repeat),
+            "page_map_after_edit_ms": _timeit(edit_one, repeat),
+            "page_map_unchanged_ms": _timeit(lambda: calculate_page_map(doc), repeat),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[100, 200, 400])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for r in run(args.pages, args.repeat):
+        print(
+            f"{r['pages']:>4} páginas | HTMLParser {r['legacy_estimate_ms']:8.2f} ms"
+            f" | tokenizer {r['tokenizer_cold_ms']:7.2f} ms"
+            f" | page_map anterior {r['legacy_page_map_ms']:8.2f} ms"
+            f" | tras editar 1 {r['page_map_after_edit_ms']:6.2f} ms"
+            f" | sin cambios {r['page_map_unchanged_ms']:6.2f} ms"
+            f" | diferencias {r['mismatches']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
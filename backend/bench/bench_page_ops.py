@@ -0,0 +1,74 @@
+"""
+Corpus y benchmark de las operaciones de página en lote (page_ops).
+- corpus/page_ops.json: ediciones "patch" con posiciones en unidades
+  UTF-16 (como las calcula el frontend en JS), con acentos y caracteres
+  fuera del BMP; "error": true si la edición debe rechazarse
+- Tiempo de un lote de patches sobre documentos sintéticos de n páginas
+Uso: python -m bench.bench_page_ops [--pages 50 200 800]
+Sale con código 1 si el corpus no da lo esperado.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from src.page_ops import InvalidOperation, apply_ops, content_hash
+from .synthetic import make_document
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "corpus", "page_ops.json")
+
+
+def check_corpus():
+    """Resultado por caso del corpus; ok=False si no coincide con lo esperado."""
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        cases = json.load(f)
+    results = []
+    for case in cases:
+        pages = [{"type": "contenido", "title": "Caso", "content": case["content"], "images": []}]
+        ops = [{
+            "op": "patch", "index": 0, "edits": case["edits"],
+            "base_hash": content_hash(case["content"]),
+        }]
+        try:
+            content = apply_ops(pages, ops)[0][0]["content"]
+        except InvalidOperation:
+            content = None
+        ok = content is None if case.get("error") else content == case["expected"]
+        results.append({"name": case["name"], "content": content, "ok": ok})
+    return results
+
+
+def run(sizes, repeat=5):
+    results = []
+    for n in sizes:
+        pages = make_document(n)["pages"]
+        # Un patch por página: reemplaza los primeros 10 caracteres del contenido
+        ops = [{"op": "patch", "index": i, "edits": [[0, 10, "<p>Nuevo</p>"]]}
+               for i in range(min(n, 500))]
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            apply_ops(pages, ops)
+            best = min(best, time.perf_counter() - t0)
+        results.append({"pages": n, "ops": len(ops), "ms": best * 1000})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 200, 800])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    failures = 0
+    for r in check_corpus():
+        failures += not r["ok"]
+        print(f"{r['name']:<30} {'ok' if r['ok'] else 'DISTINTO'} | {r['content']!r}")
+    print()
+    for r in run(args.pages, args.repeat):
+        print(f"{r['pages']:>4} páginas | {r['ops']:>3} patches | {r['ms']:8.2f} ms")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
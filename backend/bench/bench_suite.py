@@ -0,0 +1,255 @@
+"""
+Suite de benchmarks del pipeline completo.
+- Etapas: estimate_pages, calculate_page_map, build_document_html,
+  generate_pdf y las rutas Flask (test client)
+- Documentos sintéticos de 1 a 200 páginas (tablas, listas, imágenes)
+- Gemini se reemplaza por FakeGeminiClient: no hay llamadas de red
+- Resultados en JSON (tiempo mínimo y pico de memoria por etapa) y
+  comparación con thresholds.json: sale con código 1 si algo empeora
+
+Uso:
+    python -m bench.bench_suite [--pages 1 10 50 200] [--output resultados.json]
+    python -m bench.bench_suite --update-thresholds   # fija umbrales = medición x 3
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# El entorno se fija antes de importar src: datos en un directorio temporal
+# y render en el mismo proceso para medir el pipeline y no el pool
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="tareinador-bench-"))
+os.environ.setdefault("RENDER_WORKERS", "0")
+
+from src import gemini_service, page_analyzer, pdf_service  # noqa: E402
+from src.config import UPLOAD_DIR  # noqa: E402
+from src.page_analyzer import calculate_page_map, estimate_pages  # noqa: E402
+from src.pdf_service import build_document_html, generate_pdf  # noqa: E402
+from .fake_gemini import FakeGeminiClient  # noqa: E402
+from .synthetic import make_document  # noqa: E402
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(__file__), "thresholds.json")
+THRESHOLD_FACTOR = 3.0
+
+
+def _ensure_figure():
+    """La imagen que usan los documentos sintéticos."""
+    path = os.path.join(UPLOAD_DIR, "figura.png")
+    if not os.path.exists(path):
+        from PIL import Image
+        Image.new("RGB", (800, 500), (70, 110, 160)).save(path)
+
+
+def _measure(fn, repeat, setup=None):
+    """Mejor tiempo en ms de repeat corridas y pico de memoria (KB) de una más."""
+    best = float("inf")
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"ms": round(best * 1000, 3), "peak_kb": round(peak / 1024, 1)}
+
+
+# ─── Etapas ───
+
+def bench_analyzer(doc, repeat):
+    contents = [p["content"] for p in doc["pages"]]
+    counter = iter(range(10 ** 9))
+
+    def fresh_doc():
+        doc["id"] = f"{doc['id'].split(':')[0]}:{next(counter)}"
+
+    def edit_one():
+        doc["pages"][len(contents) // 2]["content"] += "<p>edición</p>"
+        calculate_page_map(doc)
+
+    return {
+        "estimate_pages": _measure(
+            lambda: [estimate_pages(c) for c in contents], repeat,
+            setup=page_analyzer._estimate_cached.cache_clear,
+        ),
+        "calculate_page_map": _measure(
+            lambda: calculate_page_map(doc), repeat,
+            setup=lambda: (page_analyzer._estimate_cached.cache_clear(), fresh_doc()),
+        ),
+        "calculate_page_map_edit": _measure(edit_one, repeat),
+    }
+
+
+def bench_html(doc, repeat):
+    return {"build_document_html": _measure(lambda: build_document_html(doc), repeat)}
+
+
+def _clear_render_caches():
+    with pdf_service._section_cache_lock:
+        pdf_service._section_cache.clear()
+        pdf_service._section_cache_pages = 0
+        pdf_service._page_counts.clear()
+
+
+def bench_pdf(doc, repeat, workdir):
+    path = os.path.join(workdir, f"{doc['id']}.pdf")
+
+    def edit_one():
+        doc["pages"][len(doc["pages"]) // 2]["content"] += "<p>edición</p>"
+        generate_pdf(doc, path)
+
+    results = {
+        "generate_pdf": _measure(lambda: generate_pdf(doc, path), repeat, setup=_clear_render_caches),
+        "generate_pdf_edit": _measure(edit_one, repeat),
+    }
+    results["generate_pdf"]["bytes"] = os.path.getsize(path)
+    return results
+
+
+def bench_routes(client, n_pages, repeat, skip_pdf=False):
+    """Rutas con el test client; la generación usa el cliente falso."""
+    sections = [{"name": f"Sección {i + 1}", "description": "", "pages": 1} for i in range(n_pages)]
+    body = {
+        "title": "Trabajo de prueba", "author": "Estudiante", "carnet": "0000",
+        "includeCaratula": True, "includeIndice": True, "sections": sections,
+    }
+    doc_ids = []
+
+    def generate():
+        res = client.post("/api/generate", json=body)
+        job_id, doc_id = res.get_json()["job_id"], res.get_json()["doc_id"]
+        while client.get(f"/api/jobs/{job_id}").get_json()["status"] not in ("done", "failed"):
+            time.sleep(0.002)
+        doc_ids.append(doc_id)
+
+    results = {"route_generate": _measure(generate, repeat)}
+    doc_id = doc_ids[-1]
+    edit = {"doc_id": doc_id, "page_index": 0, "content": "<p>Contenido editado.</p>"}
+
+    results["route_document"] = _measure(lambda: client.get(f"/api/document/{doc_id}"), repeat)
+    results["route_preview"] = _measure(lambda: client.get(f"/api/preview/{doc_id}"), repeat)
+    results["route_update_page"] = _measure(lambda: client.post("/api/update-page", json=edit), repeat)
+    results["route_edit_page"] = _measure(
+        lambda: client.post("/api/edit-page", json={
+            "doc_id": doc_id, "page_index": 0, "instructions": "Agrega un párrafo",
+        }),
+        repeat,
+    )
+
+    if skip_pdf:
+        return results
+
+    def download_cold():
+        edit["content"] += " "
+        client.post("/api/update-page", json=edit)
+        assert client.get(f"/api/download/{doc_id}").status_code == 200
+
+    results["route_download"] = _measure(download_cold, max(1, repeat // 2))
+    results["route_download_cached"] = _measure(
+        lambda: client.get(f"/api/download/{doc_id}"), repeat,
+    )
+    return results
+
+
+def run(sizes, repeat, skip_pdf=False, skip_routes=False):
+    """Mide todas las etapas. Retorna { "stage/pages": {ms, peak_kb, ...} }."""
+    _ensure_figure()
+    gemini_service.client = FakeGeminiClient()
+    client = None
+    if not skip_routes:
+        from app import create_app
+        client = create_app().test_client()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="tareinador-bench-pdf-") as workdir:
+        for n in sizes:
+            doc = make_document(n)
+            stages = {}
+            stages.update(bench_analyzer(doc, repeat))
+            stages.update(bench_html(make_document(n), repeat))
+            if not skip_pdf:
+                # El PDF es lento: menos repeticiones en documentos grandes
+                stages.update(bench_pdf(make_document(n), max(1, repeat // 2 if n > 50 else repeat), workdir))
+            if client is not None:
+                stages.update(bench_routes(client, n, repeat, skip_pdf))
+            for stage, value in stages.items():
+                results[f"{stage}/{n}"] = value
+    return results
+
+
+def check(results, thresholds):
+    """Lista de regresiones: (clave, métrica, medido, umbral)."""
+    regressions = []
+    for key, limits in thresholds.items():
+        measured = results.get(key)
+        if measured is None:
+            continue
+        for metric, limit in (("ms", limits.get("max_ms")), ("peak_kb", limits.get("max_peak_kb"))):
+            if limit is not None and measured[metric] > limit:
+                regressions.append((key, metric, measured[metric], limit))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="archivo JSON de resultados (por defecto stdout)")
+    parser.add_argument("--skip-pdf", action="store_true")
+    parser.add_argument("--skip-routes", action="store_true")
+    parser.add_argument("--update-thresholds", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args.pages, args.repeat, args.skip_pdf, args.skip_routes)
+
+    thresholds = {}
+    if os.path.exists(THRESHOLDS_PATH):
+        with open(THRESHOLDS_PATH) as f:
+            thresholds = json.load(f)
+
+    if args.update_thresholds:
+        for key, value in results.items():
+            thresholds[key] = {
+                "max_ms": round(max(value["ms"] * THRESHOLD_FACTOR, 5.0), 1),
+                "max_peak_kb": round(max(value["peak_kb"] * THRESHOLD_FACTOR, 64.0)),
+            }
+        with open(THRESHOLDS_PATH, "w") as f:
+            json.dump(dict(sorted(thresholds.items())), f, indent=2)
+            f.write("\n")
+
+    regressions = check(results, thresholds)
+    report = {
+        "python": sys.version.split()[0],
+        "pages": args.pages,
+        "repeat": args.repeat,
+        "results": results,
+        "regressions": [
+            {"key": key, "metric": metric, "measured": measured, "limit": limit}
+            for key, metric, measured, limit in regressions
+        ],
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    for key, metric, measured, limit in regressions:
+        print(f"REGRESIÓN {key} {metric}: {measured} > {limit}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Cliente falso de Gemini para benchmarks: misma interfaz que genai.Client
+(models.generate_content / generate_content_stream y
+aio.models.generate_content), respuestas deterministas y latencia
+simulada opcional.
+
+    from src import gemini_service
+    gemini_service.client = FakeGeminiClient(latency=0)
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from .synthetic import make_page
+
+_SECTION_RE = re.compile(r"^SECCIÓN: (.+)$", re.MULTILINE)
+_SECTIONS_RE = re.compile(r"^\d+\. \*\*(.+?)\*\* — (\d+) página", re.MULTILINE)
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model=None, contents="", config=None):
+        self._client._call()
+        return FakeResponse(self._client.respond(contents))
+
+    def generate_content_stream(self, model=None, contents="", config=None):
+        self._client._call()
+        text = self._client.respond(contents)
+        size = self._client.chunk_size
+        return (FakeResponse(text[i:i + size]) for i in range(0, len(text), size))
+
+
+class _FakeAsyncModels:
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content(self, model=None, contents="", config=None):
+        with self._client._lock:
+            self._client.calls += 1
+        if self._client.latency:
+            await asyncio.sleep(self._client.latency)
+        return FakeResponse(self._client.respond(contents))
+
+
+class _FakeAio:
+    def __init__(self, client):
+        self.models = _FakeAsyncModels(client)
+
+
+class FakeGeminiClient:
+    """
+    - latency: segundos por llamada (simula el tiempo de Gemini)
+    - seed: misma semilla, mismas respuestas
+    Cuenta las llamadas en .calls.
+    """
+
+    def __init__(self, latency=0.0, seed=0, chunk_size=512):
+        self.latency = latency
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.models = _FakeModels(self)
+        self.aio = _FakeAio(self)
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def respond(self, prompt):
+        """Respuesta con la forma que pide el prompt: documento, sección o edición."""
+        rng = random.Random(f"{self.seed}:{len(prompt)}")
+        if "CONTENIDO ACTUAL:" in prompt:
+            current = prompt.split("CONTENIDO ACTUAL:", 1)[1].split("INSTRUCCIONES DEL USUARIO:", 1)[0]
+            return current.strip() + "\n<p>Párrafo agregado por la edición.</p>"
+
+        section = _SECTION_RE.search(prompt)
+        if section:
+            pages = [self._page(rng, 0, section.group(1))]
+        else:
+            pages = []
+            for name, count in _SECTIONS_RE.findall(prompt):
+                for part in range(int(count)):
+                    pages.append(self._page(rng, len(pages), name))
+        return json.dumps({"pages": pages}, ensure_ascii=False)
+
+    @staticmethod
+    def _page(rng, index, name):
+        page = make_page(rng, index)
+        return {"type": "desarrollo", "title": name, "content": page["content"]}
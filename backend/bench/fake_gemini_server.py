@@ -0,0 +1,121 @@
+"""
+Servidor HTTP falso de Gemini para benchmarks de concurrencia.
+- Responde POST /v1beta/models/<modelo>:generateContent como la API real,
+  con el texto de FakeGeminiClient y una latencia simulada (segundos)
+- Un hilo por conexión: muchas peticiones esperan a la vez sin encolarse
+- Cuenta llamadas y el máximo de peticiones simultáneas (peak_in_flight)
+
+El cliente real se apunta aquí con GEMINI_BASE_URL:
+
+    server = FakeGeminiServer(latency=2).start()
+    os.environ["GEMINI_BASE_URL"] = server.url
+
+Uso directo (para apuntar el backend completo):
+    python -m bench.fake_gemini_server --port 8765 --latency 3
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .fake_gemini import FakeGeminiClient
+
+
+class FakeGeminiServer:
+    def __init__(self, latency=2.0, host="127.0.0.1", port=0, seed=0):
+        self.latency = latency
+        self.fake = FakeGeminiClient(seed=seed)
+        self.calls = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _handler(self))
+        self._httpd.daemon_threads = True
+        self._httpd.request_queue_size = 1024
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, name="fake-gemini", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.peak_in_flight = 0
+
+    def _enter(self):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+def _handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.split("?")[0].endswith(":generateContent"):
+                self._reply(404, {"error": {"code": 404, "message": "solo generateContent"}})
+                return
+            prompt = "".join(
+                part.get("text", "")
+                for content in body.get("contents", [])
+                for part in content.get("parts", [])
+            )
+            server._enter()
+            try:
+                if server.latency:
+                    time.sleep(server.latency)
+                text = server.fake.respond(prompt)
+            finally:
+                server._leave()
+            self._reply(200, {
+                "candidates": [{
+                    "content": {"role": "model", "parts": [{"text": text}]},
+                    "finishReason": "STOP",
+                }],
+            })
+
+        def _reply(self, status, payload):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=3.0, help="segundos por llamada")
+    args = parser.parse_args()
+    server = FakeGeminiServer(latency=args.latency, port=args.port).start()
+    print(f"Gemini falso en {server.url} (latencia {args.latency}s); GEMINI_BASE_URL={server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Documentos sintéticos para benchmarks.
+- Páginas con párrafos, listas, tablas e imágenes en proporciones variadas
+- Deterministas: la misma semilla produce el mismo documento
+"""
+import random
+
+_WORDS = (
+    "la investigación demuestra que el desarrollo sostenible requiere políticas "
+    "públicas coordinadas entre los distintos niveles de gobierno y la sociedad "
+    "civil para garantizar resultados medibles en educación salud y economía"
+).split()
+
+
+def _sentence(rng, n):
+    return " ".join(rng.choice(_WORDS) for _ in range(n)).capitalize() + "."
+
+
+def make_page(rng, index):
+    """Una página de contenido con estructura variada."""
+    blocks = [f"<h2>Sección {index + 1}</h2>"]
+    for _ in range(rng.randint(2, 5)):
+        kind = rng.random()
+        if kind < 0.6:
+            blocks.append(f"<p>{_sentence(rng, rng.randint(40, 90))}</p>")
+        elif kind < 0.8:
+            items = "".join(f"<li>{_sentence(rng, rng.randint(5, 15))}</li>" for _ in range(rng.randint(3, 6)))
+            blocks.append(f"<ul>{items}</ul>")
+        else:
+            rows = "".join(
+                "<tr>" + "".join(f"<td>{_sentence(rng, 3)}</td>" for _ in range(3)) + "</tr>"
+                for _ in range(rng.randint(3, 8))
+            )
+            blocks.append(f"<table>{rows}</table>")
+    images = []
+    if rng.random() < 0.2:
+        images.append({"url": "/uploads/figura.png", "caption": _sentence(rng, 6)})
+    return {
+        "type": "desarrollo",
+        "title": f"Sección {index + 1}",
+        "content": "\n".join(blocks),
+        "images": images,
+    }
+
+
+def make_document(n_pages, seed=0):
+    """Documento completo con carátula, índice y n_pages páginas."""
+    rng = random.Random(seed)
+    return {
+        "id": f"bench{n_pages}",
+        "title": "Trabajo de prueba",
+        "author": "Estudiante",
+        "carnet": "0000",
+        "date": "1 de enero, 2026",
+        "sections": ["caratula", "indice"],
+        "universidad": "Universidad",
+        "centro": "Centro",
+        "carrera": "Carrera",
+        "materia": "Materia",
+        "pages": [make_page(rng, i) for i in range(n_pages)],
+    }
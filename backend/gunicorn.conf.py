@@ -0,0 +1,27 @@
+"""
+Configuración de gunicorn (se carga con -c gunicorn.conf.py).
+- Workers con hilos (gthread): las peticiones que esperan a Gemini no
+  bloquean al worker. El store es seguro entre hilos (copia al escribir
+  y escrituras con control de versión)
+- Prepara el directorio de métricas multiproceso de prometheus_client
+"""
+import os
+import shutil
+
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", "16"))
+
+
+def on_starting(server):
+    """Descarta métricas de una ejecución anterior del contenedor."""
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Las métricas de un worker que terminó dejan de contar como vivas."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,38 @@
+"""
+Event loop de fondo, uno por proceso, para las llamadas asíncronas a Gemini.
+- Se arranca en el primer uso (después del fork de gunicorn)
+- Los hilos de Flask le pasan corrutinas con submit() o run()
+- En el loop solo corre I/O: el trabajo que bloquea (SQLite, render de
+  PDF) se manda a un hilo con asyncio.to_thread
+"""
+import asyncio
+import os
+import threading
+
+_loop = None
+_pid = None
+_lock = threading.Lock()
+
+
+def loop():
+    """El event loop del proceso (lo crea y arranca si hace falta)."""
+    global _loop, _pid
+    with _lock:
+        if _loop is None or _pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name="aio", daemon=True).start()
+        return _loop
+
+
+def submit(coro):
+    """Agenda coro en el loop. Retorna un concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, loop())
+
+
+def run(coro, timeout=None):
+    """
+    Ejecuta coro en el loop y espera su resultado desde un hilo normal.
+    No llamar desde el propio loop (se bloquearía a sí mismo).
+    """
+    return submit(coro).result(timeout)
@@ -0,0 +1,97 @@
+"""
+url_fetcher de WeasyPrint para las imágenes del documento.
+- /uploads/<archivo> se lee directo de UPLOAD_DIR (mmap), sin pasar por HTTP
+- Rechaza rutas fuera de UPLOAD_DIR y URLs file://
+- Caché LRU acotada por bytes, compartida entre renders del proceso:
+  un logo o figura usado en varios documentos se lee una sola vez
+"""
+import mimetypes
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import unquote, urlsplit
+from weasyprint.urls import URLFetcher, URLFetcherResponse
+from .config import UPLOAD_DIR, IMAGE_FETCH_CACHE_BYTES
+
+# base_url de los documentos: "/uploads/x.jpg" se resuelve a ASSET_BASE_URL + "uploads/x.jpg"
+ASSET_BASE_URL = "http://tareinador.local/"
+_ASSET_HOST = urlsplit(ASSET_BASE_URL).netloc
+
+_UPLOAD_ROOT = os.path.realpath(UPLOAD_DIR)
+
+_cache = OrderedDict()  # ruta -> (mtime, bytes)
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+class LocalAssetFetcher(URLFetcher):
+    """Sirve /uploads desde disco; el resto de URLs usa el fetcher por defecto."""
+
+    def fetch(self, url, headers=None):
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme == "file":
+            raise ValueError(f"URL no permitida: {url}")
+        if scheme in ("http", "https") and parts.netloc == _ASSET_HOST:
+            return _fetch_local(url, unquote(parts.path))
+        return super().fetch(url, headers)
+
+
+def _fetch_local(url, path):
+    """Lee un archivo de UPLOAD_DIR, validando que no salga del directorio."""
+    if not path.startswith("/uploads/"):
+        raise ValueError(f"Recurso local desconocido: {url}")
+    filepath = os.path.realpath(os.path.join(_UPLOAD_ROOT, path[len("/uploads/"):]))
+    if os.path.dirname(filepath) != _UPLOAD_ROOT:
+        raise ValueError(f"Ruta fuera de UPLOAD_DIR: {url}")
+
+    data = _read_cached(filepath)
+    mime_type = mimetypes.guess_type(filepath)[0] or "application/octet-stream"
+    return URLFetcherResponse(url, data, {"Content-Type": mime_type})
+
+
+def _read_cached(filepath):
+    """Contenido del archivo desde la caché, o leído por mmap si cambió o no está."""
+    global _cache_bytes
+    mtime = os.stat(filepath).st_mtime_ns
+    with _cache_lock:
+        entry = _cache.get(filepath)
+        if entry is not None and entry[0] == mtime:
+            _cache.move_to_end(filepath)
+            _stats["hits"] += 1
+            return entry[1]
+        _stats["misses"] += 1
+
+    with open(filepath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            data = b""
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = mm[:]
+
+    if len(data) > IMAGE_FETCH_CACHE_BYTES:
+        return data
+    with _cache_lock:
+        old = _cache.pop(filepath, None)
+        if old is not None:
+            _cache_bytes -= len(old[1])
+        _cache[filepath] = (mtime, data)
+        _cache_bytes += len(data)
+        while _cache_bytes > IMAGE_FETCH_CACHE_BYTES:
+            _, (_, evicted) = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted)
+    return data
+
+
+def fetch_cache_stats():
+    """Aciertos, fallos y tamaño de la caché de imágenes de este proceso."""
+    with _cache_lock:
+        return {
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "entries": len(_cache),
+            "bytes": _cache_bytes,
+            "max_bytes": IMAGE_FETCH_CACHE_BYTES,
+        }
@@ -6,15 +6,107 @@ load_dotenv()
 # --- Gemini ---
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# Generación en paralelo: una petición por sección (o por página de una sección)
+GEMINI_PARALLEL = os.getenv("GEMINI_PARALLEL", "1") == "1"
+GEMINI_SECTION_WORKERS = int(os.getenv("GEMINI_SECTION_WORKERS", "4"))
+GEMINI_SECTION_RETRIES = int(os.getenv("GEMINI_SECTION_RETRIES", "2"))
+# Páginas por sección que acepta /api/generate (en paralelo es una llamada a Gemini por página)
+MAX_SECTION_PAGES = int(os.getenv("MAX_SECTION_PAGES", "20"))
+# Caché de respuestas (opcional por petición con "cache": true)
+GEMINI_CACHE_TTL = int(os.getenv("GEMINI_CACHE_TTL", str(7 * 24 * 3600)))  # segundos
+GEMINI_CACHE_MAX_BYTES = int(os.getenv("GEMINI_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+# Protección del cliente: cuota compartida entre workers, reintentos y cortocircuito
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))                        # peticiones por minuto
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "10"))                    # ráfaga máxima
+GEMINI_RATE_WAIT = float(os.getenv("GEMINI_RATE_WAIT", "60"))          # espera máxima por turno (s)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")) # llamadas simultáneas por proceso
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", "4"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1"))     # segundos
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "30"))
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))  # fallos seguidos
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30")) # segundos abierto
+# Modo asíncrono: /api/generate y /api/edit-page llaman a Gemini con client.aio
+# sobre un event loop por proceso (muchas llamadas en vuelo sin un hilo cada una)
+GEMINI_ASYNC = os.getenv("GEMINI_ASYNC", "0") == "1"
+GEMINI_ASYNC_CONCURRENCY = int(os.getenv("GEMINI_ASYNC_CONCURRENCY", "256"))  # llamadas en vuelo por proceso
+# URL base alternativa de la API (p. ej. el servidor falso de bench/fake_gemini_server.py)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "")
 
 # --- Paths ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 OUTPUT_DIR = os.path.join(BASE_DIR, "outputs")
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, "data"))
+
 # Crear directorios necesarios
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# --- Almacén de documentos ---
+# "sqlite" (compartido entre workers, persistente) o "memory" (solo un proceso)
+STORE_BACKEND = os.getenv("STORE_BACKEND", "sqlite")
+STORE_DB_PATH = os.getenv("STORE_DB_PATH", os.path.join(DATA_DIR, "documents.db"))
+STORE_CACHE_SIZE = int(os.getenv("STORE_CACHE_SIZE", "64"))  # documentos en caché caliente
+# Solo backend "memory": tope de bytes (LRU), vida sin accesos y compresión de páginas
+STORE_MAX_BYTES = int(os.getenv("STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+STORE_TTL = int(os.getenv("STORE_TTL", str(24 * 3600)))          # segundos sin accesos
+STORE_COLD_AFTER = int(os.getenv("STORE_COLD_AFTER", "300"))     # segundos hasta comprimir
+
+# --- Caché de PDFs renderizados (en OUTPUT_DIR, compartida entre workers) ---
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# --- Render incremental: cada sección se maqueta por separado y se reutiliza ---
+PDF_INCREMENTAL = os.getenv("PDF_INCREMENTAL", "1") == "1"
+# Tope en páginas maquetadas (no en secciones): cada página retiene su árbol de cajas
+# en memoria del proceso de render, que corre con RENDER_MEMORY_MB
+PDF_SECTION_CACHE_PAGES = int(os.getenv("PDF_SECTION_CACHE_PAGES", "60"))
+PREVIEW_FRAGMENT_CACHE_SIZE = int(os.getenv("PREVIEW_FRAGMENT_CACHE_SIZE", "2000"))  # fragmentos HTML
+PDF_WARMUP = os.getenv("PDF_WARMUP", "1") == "1"
+# Identificador del despliegue (p. ej. el commit): se suma a la huella del renderer en los ETag
+BUILD_ID = os.getenv("BUILD_ID", "")  # render de calentamiento al arrancar cada worker
+
+# --- Pool de render de PDF (procesos aislados) ---
+# Por defecto los núcleos se reparten entre los workers de gunicorn. 0 = render en el hilo.
+_web_workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(max(1, (os.cpu_count() or 1) // _web_workers))))
+RENDER_QUEUE_MAX = int(os.getenv("RENDER_QUEUE_MAX", "8"))         # renders en espera antes de 503
+RENDER_TIMEOUT = int(os.getenv("RENDER_TIMEOUT", "45"))            # segundos por render
+RENDER_MEMORY_MB = int(os.getenv("RENDER_MEMORY_MB", "1024"))      # límite de memoria virtual por proceso
+
+# --- Respuestas versionadas (ETag + compresión) de /api/document y /api/preview ---
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))  # cuerpos comprimidos en caché
+HTTP_COMPRESS_MIN_BYTES = int(os.getenv("HTTP_COMPRESS_MIN_BYTES", "1024"))  # más chicos van sin comprimir
+
+# --- Imágenes subidas ---
+# Lado mayor en px: la columna útil es ~16cm y la imagen se limita al 80% (≈ 250 DPI)
+IMAGE_MAX_PX = int(os.getenv("IMAGE_MAX_PX", "1600"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# Caché en memoria de imágenes leídas para el PDF (compartida entre renders)
+IMAGE_FETCH_CACHE_BYTES = int(os.getenv("IMAGE_FETCH_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# --- Limpieza de disco (uploads y outputs) ---
+JANITOR_INTERVAL = int(os.getenv("JANITOR_INTERVAL", "600"))                   # segundos entre barridos, 0 = nunca
+JANITOR_UPLOAD_GRACE = int(os.getenv("JANITOR_UPLOAD_GRACE", "3600"))          # edad mínima de un upload huérfano
+JANITOR_OUTPUT_MAX_AGE = int(os.getenv("JANITOR_OUTPUT_MAX_AGE", str(24 * 3600)))  # PDF sin descargarse
+JANITOR_UPLOAD_QUOTA_BYTES = int(os.getenv("JANITOR_UPLOAD_QUOTA_BYTES", str(2 * 1024 ** 3)))
+JANITOR_OUTPUT_QUOTA_BYTES = int(os.getenv("JANITOR_OUTPUT_QUOTA_BYTES", str(1024 ** 3)))
+
+# --- Trabajos en segundo plano (generación con IA) ---
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))        # generaciones simultáneas por proceso
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "16"))   # trabajos en espera antes de rechazar
+JOB_ASYNC_MAX = int(os.getenv("JOB_ASYNC_MAX", "256"))  # generaciones en vuelo con GEMINI_ASYNC
+JOB_TTL = int(os.getenv("JOB_TTL", str(24 * 3600)))      # segundos que se guarda el estado de un trabajo
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", "3600"))  # en cola/corriendo sin terminar: se da por fallido
+
+# --- Perfilado bajo demanda (solo administradores) ---
+# Con PROFILING_ENABLED=1, una petición con header X-Profile-Token o ?profile=<token>
+# corre bajo cProfile y el perfil se guarda en PROFILE_DIR
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
 
 # --- Server ---
 HOST = "0.0.0.0"
@@ -1,10 +1,37 @@
 """
-Almacén de documentos en memoria.
+Almacén de documentos.
 - Guarda el estado del documento generado por sesión
-- Estructura: {session_id: DocumentData}
+- Backend intercambiable: SQLite (por defecto, compartido entre workers)
+  o memoria (un solo proceso)
+- SQLite en modo WAL, una fila por página, con caché LRU caliente en proceso
 """
+import copy
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
 import uuid
+import zlib
+from collections import OrderedDict
 from datetime import datetime
+from .config import (
+    STORE_BACKEND, STORE_DB_PATH, STORE_CACHE_SIZE, STORE_MAX_BYTES, STORE_TTL, STORE_COLD_AFTER,
+    JOB_TTL, JOB_STALE_AFTER,
+)
+from .metrics import (
+    STORE_CACHE_HITS, STORE_CACHE_MISSES, STORE_EVICTIONS, STORE_MEMORY_BYTES, STORE_MEMORY_DOCUMENTS,
+)
+from .page_ops import apply_ops
+
+
+class VersionConflict(Exception):
+    """El documento cambió desde la versión que el cliente editó."""
+
+    def __init__(self, current):
+        super().__init__(f"versión actual {current}")
+        self.current = current
 
 
 def create_document(title, author, carnet, sections):
@@ -30,63 +57,749 @@ def create_document(title, author, carnet, sections):
     return doc_id, doc
 
 
-# Almacén global en memoria
-_store: dict = {}
+# ─── Backend en memoria ───
+
+_MAINTAIN_EVERY = 5  # segundos entre pasadas de TTL y compresión
+_JOB_PRUNE_EVERY = 60  # segundos entre limpiezas de la tabla jobs (SQLite)
+
+
+class MemoryBackend:
+    """
+    Guarda los documentos en un dict del proceso. Útil en desarrollo.
+    - Cuenta los bytes aproximados de cada documento (JSON) y expulsa los
+      menos usados (LRU) al superar STORE_MAX_BYTES
+    - Un documento sin accesos por STORE_TTL se descarta
+    - Las páginas de un documento sin accesos por STORE_COLD_AFTER se
+      guardan comprimidas (zlib) y se descomprimen en el próximo acceso
+    """
+
+    def __init__(self, max_bytes, ttl, cold_after):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cold_after = cold_after
+        self._docs = {}             # doc_id -> doc (calientes)
+        self._cold = {}             # doc_id -> (meta, páginas JSON comprimidas)
+        self._lru = OrderedDict()   # doc_id -> último acceso (calientes y fríos)
+        self._sizes = {}            # doc_id -> bytes aproximados
+        self._bytes = 0
+        self._versions = {}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._last_maintain = time.monotonic()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0,
+                       "compressions": 0, "decompressions": 0}
+
+    def _bump(self, doc_id):
+        self._versions[doc_id] = self._versions.get(doc_id, 0) + 1
+        return self._versions[doc_id]
+
+    # --- Acceso, tamaño y expulsión (siempre con self._lock tomado) ---
+
+    def _get(self, doc_id):
+        """Documento caliente (descomprimiéndolo si estaba frío) o None."""
+        doc = self._docs.get(doc_id)
+        if doc is None:
+            cold = self._cold.pop(doc_id, None)
+            if cold is None:
+                self._stats["misses"] += 1
+                STORE_CACHE_MISSES.inc()
+                return None
+            meta, packed = cold
+            doc = dict(meta, pages=json.loads(zlib.decompress(packed)))
+            self._docs[doc_id] = doc
+            self._resize(doc_id, _doc_bytes(doc))
+            self._stats["decompressions"] += 1
+        self._stats["hits"] += 1
+        STORE_CACHE_HITS.inc()
+        self._lru[doc_id] = time.monotonic()
+        self._lru.move_to_end(doc_id)
+        return doc
+
+    def _resize(self, doc_id, size):
+        self._bytes += size - self._sizes.get(doc_id, 0)
+        self._sizes[doc_id] = size
+        self._publish()
+
+    def _drop(self, doc_id):
+        self._docs.pop(doc_id, None)
+        self._cold.pop(doc_id, None)
+        self._lru.pop(doc_id, None)
+        self._versions.pop(doc_id, None)
+        self._bytes -= self._sizes.pop(doc_id, 0)
+        self._publish()
+
+    def _publish(self):
+        """Tamaño de este worker para /metrics (gauge livesum entre workers)."""
+        STORE_MEMORY_DOCUMENTS.set(len(self._sizes))
+        STORE_MEMORY_BYTES.set(self._bytes)
+
+    def _maintain(self):
+        """Aplica TTL y compresión (cada _MAINTAIN_EVERY s) y el tope de bytes."""
+        now = time.monotonic()
+        if now - self._last_maintain >= _MAINTAIN_EVERY:
+            self._last_maintain = now
+            for doc_id, touched in list(self._lru.items()):
+                idle = now - touched
+                if idle < self.cold_after and idle < self.ttl:
+                    break
+                if idle >= self.ttl:
+                    self._drop(doc_id)
+                    self._stats["expirations"] += 1
+                elif doc_id in self._docs:
+                    self._freeze(doc_id)
+            expired = time.time() - JOB_TTL
+            for job_id in [j for j, job in self._jobs.items() if job["created_at"] < expired]:
+                del self._jobs[job_id]
+
+        # Nunca se expulsa el último documento usado, aunque solo él supere el tope
+        while self._bytes > self.max_bytes and len(self._lru) > 1:
+            doc_id = next(iter(self._lru))
+            self._drop(doc_id)
+            self._stats["evictions"] += 1
+            STORE_EVICTIONS.inc()
+
+    def _freeze(self, doc_id):
+        doc = self._docs.pop(doc_id)
+        meta = {k: v for k, v in doc.items() if k != "pages"}
+        packed = zlib.compress(json.dumps(doc["pages"]).encode("utf-8"))
+        self._cold[doc_id] = (meta, packed)
+        self._resize(doc_id, len(packed) + len(json.dumps(meta, ensure_ascii=False)))
+        self._stats["compressions"] += 1
+
+    # --- Operaciones ---
+
+    def save(self, doc):
+        with self._lock:
+            self._cold.pop(doc["id"], None)
+            self._docs[doc["id"]] = doc
+            self._lru[doc["id"]] = time.monotonic()
+            self._lru.move_to_end(doc["id"])
+            self._resize(doc["id"], _doc_bytes(doc))
+            self._bump(doc["id"])
+            self._maintain()
+
+    def load(self, doc_id):
+        return self.load_versioned(doc_id)[0]
+
+    def load_versioned(self, doc_id):
+        with self._lock:
+            doc = self._get(doc_id)
+            version = self._versions[doc_id] if doc else None
+            self._maintain()
+            return doc, version
+
+    def version(self, doc_id):
+        return self._versions.get(doc_id)
+
+    def mutate_page(self, doc_id, page_index, fn, expected_version=None):
+        with self._lock:
+            doc = self._get(doc_id)
+            if not doc:
+                return None
+            self._check_version(doc_id, expected_version)
+            if not 0 <= page_index < len(doc["pages"]):
+                return None
+            page = copy.deepcopy(doc["pages"][page_index])
+            fn(page)
+            pages = list(doc["pages"])
+            pages[page_index] = page
+            self._replace(doc_id, dict(doc, pages=pages))
+            version = self._bump(doc_id)
+            self._maintain()
+            return version, page
+
+    def mutate_pages(self, doc_id, fn, expected_version=None):
+        with self._lock:
+            doc = self._get(doc_id)
+            if not doc:
+                return None
+            self._check_version(doc_id, expected_version)
+            pages, result = fn(doc["pages"])
+            self._replace(doc_id, dict(doc, pages=pages))
+            version = self._bump(doc_id)
+            self._maintain()
+            return version, result
+
+    def append_page(self, doc_id, page):
+        with self._lock:
+            doc = self._get(doc_id)
+            if not doc:
+                return None
+            self._replace(doc_id, dict(doc, pages=doc["pages"] + [page]))
+            self._bump(doc_id)
+            self._maintain()
+            return len(doc["pages"])
+
+    def _check_version(self, doc_id, expected_version):
+        if expected_version is not None and expected_version != self._versions[doc_id]:
+            raise VersionConflict(self._versions[doc_id])
+
+    def _replace(self, doc_id, doc):
+        """
+        Copia al escribir: el documento anterior no se modifica, así un hilo
+        que lo está leyendo (JSON, preview, PDF) nunca ve un cambio a medias.
+        """
+        self._docs[doc_id] = doc
+        self._resize(doc_id, _doc_bytes(doc))
+
+    def document_ids(self):
+        with self._lock:
+            return set(self._lru)
+
+    def page_texts(self):
+        with self._lock:
+            pages = [page for doc in self._docs.values() for page in doc["pages"]]
+            cold = [packed for _, packed in self._cold.values()]
+        for page in pages:
+            yield json.dumps(page)
+        for packed in cold:
+            yield zlib.decompress(packed).decode("utf-8")
+
+    def save_job(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def load_job(self, job_id):
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "documents": len(self._lru),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hot": len(self._docs),
+                "cold": len(self._cold),
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else None,
+                **self._stats,
+            }
+
+
+def _doc_bytes(obj):
+    """Tamaño aproximado en memoria: largo de su JSON."""
+    return len(json.dumps(obj, ensure_ascii=False))
+
+
+# ─── Backend SQLite ───
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    meta TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    doc_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (doc_id, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class SQLiteBackend:
+    """
+    Guarda cada documento como una fila de metadata + una fila por página.
+    - Todos los workers de gunicorn comparten el mismo archivo
+    - La caché LRU se valida contra la columna version en cada lectura,
+      así un cambio hecho por otro worker nunca se sirve desactualizado
+    """
+
+    def __init__(self, path, cache_size):
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # doc_id -> (version, doc)
+        self._cache_lock = threading.Lock()
+        self._cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._last_job_prune = 0.0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+
+    def _conn(self):
+        """Una conexión por hilo y por proceso (gunicorn hace fork)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # --- Caché caliente ---
+
+    def _cache_get(self, doc_id, version):
+        with self._cache_lock:
+            entry = self._cache.get(doc_id)
+            if entry is None or entry[0] != version:
+                self._cache_stats["misses"] += 1
+                STORE_CACHE_MISSES.inc()
+                return None
+            self._cache.move_to_end(doc_id)
+            self._cache_stats["hits"] += 1
+            STORE_CACHE_HITS.inc()
+            return entry[1]
+
+    def _cache_put(self, doc_id, version, doc):
+        with self._cache_lock:
+            self._cache[doc_id] = (version, doc)
+            self._cache.move_to_end(doc_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self._cache_stats["evictions"] += 1
+                STORE_EVICTIONS.inc()
+
+    # --- Operaciones ---
+
+    def save(self, doc):
+        meta = {k: v for k, v in doc.items() if k != "pages"}
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT version FROM documents WHERE id = ?", (doc["id"],)
+            ).fetchone()
+            version = row[0] + 1 if row else 1
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (id, meta, version, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (doc["id"], json.dumps(meta), version, time.time()),
+            )
+            conn.execute("DELETE FROM pages WHERE doc_id = ?", (doc["id"],))
+            conn.executemany(
+                "INSERT INTO pages (doc_id, idx, data) VALUES (?, ?, ?)",
+                [(doc["id"], i, json.dumps(p)) for i, p in enumerate(doc.get("pages", []))],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._cache_put(doc["id"], version, doc)
+
+    def load(self, doc_id):
+        return self.load_versioned(doc_id)[0]
+
+    def load_versioned(self, doc_id):
+        """Retorna (doc, versión) leídos juntos, o (None, None)."""
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT version FROM documents WHERE id = ?", (doc_id,)
+        ).fetchone()
+        if not row:
+            return None, None
+        cached = self._cache_get(doc_id, row[0])
+        if cached is not None:
+            return cached, row[0]
+
+        # Lectura consistente de metadata + páginas (snapshot WAL)
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute(
+                "SELECT meta, version FROM documents WHERE id = ?", (doc_id,)
+            ).fetchone()
+            if not row:
+                return None, None
+            rows = conn.execute(
+                "SELECT data FROM pages WHERE doc_id = ? ORDER BY idx", (doc_id,)
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+
+        doc = json.loads(row[0])
+        doc["pages"] = [json.loads(r[0]) for r in rows]
+        self._cache_put(doc_id, row[1], doc)
+        return doc, row[1]
+
+    def mutate_page(self, doc_id, page_index, fn, expected_version=None):
+        """
+        Lee, modifica y escribe una sola página dentro de una transacción.
+        BEGIN IMMEDIATE serializa escritores entre procesos y hilos.
+        Retorna (versión nueva, página) o None si no existe.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT version FROM documents WHERE id = ?", (doc_id,)
+            ).fetchone()
+            if row and expected_version is not None and expected_version != row[0]:
+                raise VersionConflict(row[0])
+            page_row = conn.execute(
+                "SELECT data FROM pages WHERE doc_id = ? AND idx = ?",
+                (doc_id, page_index),
+            ).fetchone()
+            if not row or not page_row:
+                conn.execute("ROLLBACK")
+                return None
+            page = json.loads(page_row[0])
+            fn(page)
+            version = row[0] + 1
+            conn.execute(
+                "UPDATE pages SET data = ? WHERE doc_id = ? AND idx = ?",
+                (json.dumps(page), doc_id, page_index),
+            )
+            conn.execute(
+                "UPDATE documents SET version = ?, updated_at = ? WHERE id = ?",
+                (version, time.time(), doc_id),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        # Copia nueva en la caché caliente si estaba en la versión anterior
+        # (la anterior no se modifica: otros hilos pueden estar leyéndola)
+        with self._cache_lock:
+            entry = self._cache.get(doc_id)
+        if entry is not None and entry[0] == version - 1:
+            pages = list(entry[1]["pages"])
+            pages[page_index] = page
+            self._cache_put(doc_id, version, dict(entry[1], pages=pages))
+        else:
+            with self._cache_lock:
+                self._cache.pop(doc_id, None)
+        return version, page
+
+    def version(self, doc_id):
+        row = self._conn().execute(
+            "SELECT version FROM documents WHERE id = ?", (doc_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def mutate_pages(self, doc_id, fn, expected_version=None):
+        """
+        Aplica fn(pages) -> (nuevas_páginas, resultado) en una transacción.
+        Solo se reescriben las filas cuyo contenido cambió.
+        Retorna (versión nueva, resultado) o None si el documento no existe.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT version FROM documents WHERE id = ?", (doc_id,)
+            ).fetchone()
+            if not row:
+                conn.execute("ROLLBACK")
+                return None
+            version = row[0]
+            if expected_version is not None and expected_version != version:
+                raise VersionConflict(version)
+
+            old_rows = [r[0] for r in conn.execute(
+                "SELECT data FROM pages WHERE doc_id = ? ORDER BY idx", (doc_id,)
+            )]
+            pages, result = fn([json.loads(data) for data in old_rows])
+
+            new_rows = [json.dumps(p) for p in pages]
+            conn.executemany(
+                "INSERT OR REPLACE INTO pages (doc_id, idx, data) VALUES (?, ?, ?)",
+                [(doc_id, i, data) for i, data in enumerate(new_rows)
+                 if i >= len(old_rows) or old_rows[i] != data],
+            )
+            conn.execute(
+                "DELETE FROM pages WHERE doc_id = ? AND idx >= ?", (doc_id, len(new_rows)),
+            )
+            conn.execute(
+                "UPDATE documents SET version = ?, updated_at = ? WHERE id = ?",
+                (version + 1, time.time(), doc_id),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        # Documento nuevo en la caché caliente (el anterior no se modifica)
+        with self._cache_lock:
+            entry = self._cache.get(doc_id)
+        if entry is not None and entry[0] == version:
+            self._cache_put(doc_id, version + 1, dict(entry[1], pages=pages))
+        else:
+            with self._cache_lock:
+                self._cache.pop(doc_id, None)
+        return version + 1, result
+
+    def append_page(self, doc_id, page):
+        """Agrega una página al final escribiendo solo su fila."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT version FROM documents WHERE id = ?", (doc_id,)
+            ).fetchone()
+            if not row:
+                conn.execute("ROLLBACK")
+                return None
+            index = conn.execute(
+                "SELECT COUNT(*) FROM pages WHERE doc_id = ?", (doc_id,)
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO pages (doc_id, idx, data) VALUES (?, ?, ?)",
+                (doc_id, index, json.dumps(page)),
+            )
+            conn.execute(
+                "UPDATE documents SET version = version + 1, updated_at = ? WHERE id = ?",
+                (time.time(), doc_id),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        with self._cache_lock:
+            self._cache.pop(doc_id, None)
+        return index
+
+    def document_ids(self):
+        return {row[0] for row in self._conn().execute("SELECT id FROM documents")}
+
+    def page_texts(self):
+        """JSON crudo de cada página (sin decodificar), para buscar referencias."""
+        for row in self._conn().execute("SELECT data FROM pages"):
+            yield row[0]
+
+    def save_job(self, job):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (id, data, updated_at) VALUES (?, ?, ?)",
+            (job["id"], json.dumps(job), time.time()),
+        )
+        now = time.monotonic()
+        if now - self._last_job_prune >= _JOB_PRUNE_EVERY:
+            self._last_job_prune = now
+            self._prune_jobs(conn)
+
+    def _prune_jobs(self, conn):
+        """
+        Borra los trabajos de más de JOB_TTL y da por fallidos los que
+        llevan JOB_STALE_AFTER en cola o corriendo (su worker murió).
+        """
+        now = time.time()
+        conn.execute("DELETE FROM jobs WHERE updated_at < ?", (now - JOB_TTL,))
+        stale = conn.execute(
+            "SELECT id, data, updated_at FROM jobs WHERE updated_at < ? "
+            "AND json_extract(data, '$.status') IN ('queued', 'running')",
+            (now - JOB_STALE_AFTER,),
+        ).fetchall()
+        for job_id, data, updated_at in stale:
+            job = json.loads(data)
+            job.update(status="failed", finished_at=now,
+                       error="El trabajo se interrumpió (el proceso que lo ejecutaba terminó)")
+            # Solo si nadie lo actualizó mientras tanto
+            conn.execute(
+                "UPDATE jobs SET data = ?, updated_at = ? WHERE id = ? AND updated_at = ?",
+                (json.dumps(job), now, job_id, updated_at),
+            )
+
+    def load_job(self, job_id):
+        row = self._conn().execute(
+            "SELECT data FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def stats(self):
+        conn = self._conn()
+        documents = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        with self._cache_lock:
+            lookups = self._cache_stats["hits"] + self._cache_stats["misses"]
+            return {
+                "documents": documents,
+                "bytes": page_count * page_size,
+                "hot": len(self._cache),
+                "hit_rate": round(self._cache_stats["hits"] / lookups, 4) if lookups else None,
+                **self._cache_stats,
+            }
+
+
+def _make_backend():
+    if STORE_BACKEND == "memory":
+        return MemoryBackend(STORE_MAX_BYTES, STORE_TTL, STORE_COLD_AFTER)
+    if STORE_BACKEND == "sqlite":
+        return SQLiteBackend(STORE_DB_PATH, STORE_CACHE_SIZE)
+    raise ValueError(f"STORE_BACKEND desconocido: {STORE_BACKEND}")
+
+
+# Backend global del proceso
+_backend = _make_backend()
+
+# Funciones a llamar cuando un documento cambia (p. ej. invalidar cachés)
+_listeners = []
+
+
+def on_change(fn):
+    """Registra fn(doc_id) para que se llame después de cada mutación."""
+    _listeners.append(fn)
+    return fn
+
+
+def _notify(doc_id):
+    for fn in _listeners:
+        fn(doc_id)
+
+
+def _changed(doc_id, result):
+    """Notifica el cambio solo si la mutación tuvo efecto."""
+    if result is not None:
+        _notify(doc_id)
+    return result
 
 
 def save_document(doc_id, doc):
     """Guarda un documento en el store."""
-    _store[doc_id] = doc
+    doc["id"] = doc_id
+    _backend.save(doc)
+    _notify(doc_id)
 
 
 def get_document(doc_id):
-    """Obtiene un documento por su ID."""
-    return _store.get(doc_id)
+    """
+    Obtiene un documento por su ID.
+    El dict retornado es compartido con la caché: modificarlo solo a través
+    de las funciones de este módulo.
+    """
+    if not doc_id:
+        return None
+    return _backend.load(doc_id)
+
+
+def get_document_versioned(doc_id):
+    """
+    Obtiene un documento junto con su versión, leídos de forma consistente
+    (para ETags: la versión siempre corresponde al contenido retornado).
+    Retorna: (doc, versión) o (None, None) si no existe
+    """
+    if not doc_id:
+        return None, None
+    return _backend.load_versioned(doc_id)
 
 
-def update_page(doc_id, page_index, content=None, images=None):
+def update_page(doc_id, page_index, content=None, images=None, expected_version=None):
     """
     Actualiza una página específica del documento.
     - page_index: índice de la página (0-based)
     - content: nuevo contenido HTML (opcional)
     - images: nueva lista de imágenes (opcional)
+    - expected_version: versión que editó el cliente (ver VersionConflict)
+    Retorna: (versión nueva, página) o None si la página no existe
     """
-    doc = _store.get(doc_id)
-    if not doc or page_index >= len(doc["pages"]):
-        return None
+    def apply(page):
+        if content is not None:
+            page["content"] = content
+        if images is not None:
+            page["images"] = images
+
+    return _changed(doc_id, _backend.mutate_page(doc_id, page_index, apply, expected_version))
 
-    if content is not None:
-        doc["pages"][page_index]["content"] = content
-    if images is not None:
-        doc["pages"][page_index]["images"] = images
 
-    return doc["pages"][page_index]
+def get_version(doc_id):
+    """Versión actual del documento (sube con cada cambio) o None si no existe."""
+    if not doc_id:
+        return None
+    return _backend.version(doc_id)
 
 
-def add_image_to_page(doc_id, page_index, image_url, caption=""):
-    """Agrega una imagen a una página específica."""
-    doc = _store.get(doc_id)
-    if not doc or page_index >= len(doc["pages"]):
+def apply_page_ops(doc_id, ops, expected_version=None):
+    """
+    Aplica un lote de operaciones de página (ver page_ops) de forma atómica.
+    - expected_version: versión que editó el cliente; si el documento
+      cambió desde entonces se lanza VersionConflict y no se aplica nada
+    Retorna: (versión nueva, resultados, total de páginas) o None si el
+    documento no existe. Lanza InvalidOperation si una operación es inválida.
+    """
+    def fn(pages):
+        new_pages, results = apply_ops(pages, ops)
+        return new_pages, (results, len(new_pages))
+
+    outcome = _changed(doc_id, _backend.mutate_pages(doc_id, fn, expected_version))
+    if outcome is None:
         return None
+    version, (results, total) = outcome
+    return version, results, total
+
+
+def append_page(doc_id, page):
+    """
+    Agrega una página al final del documento.
+    Retorna: índice de la nueva página o None si el documento no existe
+    """
+    return _changed(doc_id, _backend.append_page(doc_id, page))
+
+
+def add_image_to_page(doc_id, page_index, image_url, caption="", meta=None,
+                      expected_version=None):
+    """
+    Agrega una imagen a una página específica.
+    - meta: datos extra de la imagen (p. ej. bytes original/guardado)
+    Retorna: (versión nueva, página) o None si la página no existe
+    """
+    def apply(page):
+        page.setdefault("images", []).append({
+            "url": image_url,
+            "caption": caption,
+            **(meta or {}),
+        })
 
-    if "images" not in doc["pages"][page_index]:
-        doc["pages"][page_index]["images"] = []
+    return _changed(doc_id, _backend.mutate_page(doc_id, page_index, apply, expected_version))
 
-    doc["pages"][page_index]["images"].append({
-        "url": image_url,
-        "caption": caption,
-    })
-    return doc["pages"][page_index]
+
+def remove_image_from_page(doc_id, page_index, image_index, expected_version=None):
+    """
+    Elimina una imagen de una página específica.
+    Retorna: (versión nueva, página) o None si la página no existe
+    """
+    def apply(page):
+        images = page.get("images", [])
+        if 0 <= image_index < len(images):
+            images.pop(image_index)
+
+    return _changed(doc_id, _backend.mutate_page(doc_id, page_index, apply, expected_version))
 
 
-def remove_image_from_page(doc_id, page_index, image_index):
-    """Elimina una imagen de una página específica."""
-    doc = _store.get(doc_id)
-    if not doc or page_index >= len(doc["pages"]):
+def save_job(job):
+    """Guarda el estado de un trabajo en segundo plano (visible para todos los workers)."""
+    _backend.save_job(job)
+
+
+def get_job(job_id):
+    """Obtiene el estado de un trabajo por su ID."""
+    if not job_id:
         return None
+    return _backend.load_job(job_id)
+
 
-    images = doc["pages"][page_index].get("images", [])
-    if image_index < len(images):
-        images.pop(image_index)
+def document_ids():
+    """IDs de todos los documentos del store."""
+    return _backend.document_ids()
 
-    return doc["pages"][page_index]
+
+# Archivo de /uploads referenciado en imágenes o dentro del HTML de una página
+_UPLOAD_REF = re.compile(r"/uploads/([\w.-]+)")
+
+
+def referenced_uploads():
+    """Nombres de los archivos de UPLOAD_DIR que usa algún documento."""
+    refs = set()
+    for text in _backend.page_texts():
+        refs.update(_UPLOAD_REF.findall(text))
+    return refs
+
+
+def store_stats():
+    """
+    Documentos, tamaño aproximado en bytes y uso de la memoria del proceso:
+    aciertos/fallos (del store en memoria o de la caché caliente de SQLite)
+    y expulsiones.
+    """
+    return _backend.stats()
@@ -0,0 +1,276 @@
+"""
+Caché persistente de respuestas de Gemini.
+- Clave: hash normalizado de modelo, tipo de llamada, entradas del prompt
+  y temperatura
+- Guardada en SQLite (DATA_DIR), compartida entre workers, con TTL y
+  expulsión por tamaño (las menos usadas primero)
+- Peticiones idénticas simultáneas se unen en una sola llamada a Gemini
+  (en el proceso con un Future, entre workers con flock)
+- cached_call_async es la misma caché para corrutinas del loop del
+  proceso: SQLite en un hilo corto, la espera del flock sin ocupar hilos
+- Es opcional por petición: solo se usa si el cliente manda "cache": true
+"""
+import asyncio
+import copy
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from .config import DATA_DIR, GEMINI_CACHE_TTL, GEMINI_CACHE_MAX_BYTES
+
+_DB_PATH = os.path.join(DATA_DIR, "gemini_cache.db")
+_LOCK_DIR = os.path.join(DATA_DIR, "gemini_cache.locks")
+os.makedirs(_LOCK_DIR, exist_ok=True)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+_local = threading.local()
+
+_inflight = {}  # clave -> Future del líder
+_inflight_lock = threading.Lock()
+_inflight_async = {}  # clave -> asyncio.Future del líder (solo se toca desde el loop)
+
+# Contadores del proceso (se exponen en /api/gemini/cache/stats)
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "coalesced": 0, "stores": 0, "evictions": 0}
+
+
+def _conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(_DB_PATH, timeout=30, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def make_key(model, kind, inputs, temperature):
+    """Hash estable de la llamada; los espacios en los textos se normalizan."""
+    payload = {
+        "model": model,
+        "kind": kind,
+        "inputs": _normalize(inputs),
+        "temperature": temperature,
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def cached_call(key, compute, should_store=lambda value: True):
+    """
+    Retorna el valor en caché para key o lo calcula con compute().
+    - should_store(value): False para no guardar respuestas de error
+    Si otra petición idéntica ya está en curso, espera su resultado.
+    """
+    value = _get(key)
+    if value is not None:
+        _count("hits")
+        return value
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+
+    if not leader:
+        _count("coalesced")
+        return copy.deepcopy(future.result())
+
+    try:
+        with _file_lock(key):
+            # Otro worker pudo completar la misma llamada mientras esperábamos
+            value = _get(key)
+            if value is not None:
+                _count("hits")
+            else:
+                _count("misses")
+                value = compute()
+                if should_store(value):
+                    _put(key, value)
+        future.set_result(value)
+        return value
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+async def cached_call_async(key, compute, should_store=lambda value: True):
+    """
+    Igual que cached_call para el event loop: compute() es una corrutina
+    y se espera en el loop, nunca dentro de un hilo del executor.
+    """
+    value = await asyncio.to_thread(_get, key)
+    if value is not None:
+        _count("hits")
+        return value
+
+    future = _inflight_async.get(key)
+    if future is not None:
+        _count("coalesced")
+        return copy.deepcopy(await asyncio.shield(future))
+    future = _inflight_async[key] = asyncio.get_running_loop().create_future()
+
+    try:
+        fd = await _file_lock_async(key)
+        try:
+            value = await asyncio.to_thread(_get, key)
+            if value is not None:
+                _count("hits")
+            else:
+                _count("misses")
+                value = await compute()
+                if should_store(value):
+                    await asyncio.to_thread(_put, key, value)
+        finally:
+            _file_unlock(fd)
+        future.set_result(value)
+        return value
+    except BaseException as e:
+        future.set_exception(e)
+        # Que no quede "Future exception was never retrieved" si nadie esperaba
+        future.exception()
+        raise
+    finally:
+        _inflight_async.pop(key, None)
+
+
+def _get(key):
+    row = _conn().execute(
+        "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+    ).fetchone()
+    if row is None:
+        return None
+    if time.time() - row[1] > GEMINI_CACHE_TTL:
+        _conn().execute("DELETE FROM responses WHERE key = ?", (key,))
+        return None
+    _conn().execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+    return json.loads(row[0])
+
+
+def _put(key, value):
+    raw = json.dumps(value, ensure_ascii=False)
+    now = time.time()
+    conn = _conn()
+    conn.execute(
+        "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_used) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (key, raw, len(raw), now, now),
+    )
+    _count("stores")
+    _evict(conn)
+
+
+def _evict(conn):
+    """Borra expiradas y luego las menos usadas hasta quedar bajo GEMINI_CACHE_MAX_BYTES."""
+    conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - GEMINI_CACHE_TTL,))
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total <= GEMINI_CACHE_MAX_BYTES:
+        return
+    evicted = 0
+    for key, size in conn.execute(
+        "SELECT key, size FROM responses ORDER BY last_used"
+    ).fetchall():
+        conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        evicted += 1
+        total -= size
+        if total <= GEMINI_CACHE_MAX_BYTES:
+            break
+    with _stats_lock:
+        _stats["evictions"] += evicted
+
+
+@contextmanager
+def _file_lock(key):
+    """
+    flock exclusivo entre workers. Se bloquea mientras dura la llamada a
+    Gemini, así que se usan muchos archivos (prefijo de 4 hex) para que
+    claves distintas casi nunca compartan bloqueo.
+    """
+    fd = os.open(os.path.join(_LOCK_DIR, f"{key[:4]}.lock"), os.O_CREAT | os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+async def _file_lock_async(key):
+    """
+    El mismo flock que _file_lock, pedido sin bloquear y reintentado con
+    asyncio.sleep: esperar a otro worker no ocupa un hilo del executor.
+    Retorna el descriptor; se libera con _file_unlock.
+    """
+    fd = os.open(os.path.join(_LOCK_DIR, f"{key[:4]}.lock"), os.O_CREAT | os.O_RDWR)
+    delay = 0.01
+    try:
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.25)
+    except BaseException:
+        os.close(fd)
+        raise
+
+
+def _file_unlock(fd):
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    """Contadores de este proceso más tamaño total de la caché en disco."""
+    with _stats_lock:
+        stats = dict(_stats)
+    entries, size = _conn().execute(
+        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+    ).fetchone()
+    lookups = stats["hits"] + stats["misses"]
+    stats.update({
+        "hit_rate": round(stats["hits"] / lookups, 3) if lookups else None,
+        "entries": entries,
+        "bytes": size,
+        "max_bytes": GEMINI_CACHE_MAX_BYTES,
+        "ttl_seconds": GEMINI_CACHE_TTL,
+    })
+    return stats
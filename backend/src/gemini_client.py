@@ -0,0 +1,446 @@
+"""
+Envoltura del cliente de Gemini para no romper la cuota de la API.
+- Cubeta de tokens (GEMINI_RPM, GEMINI_BURST) guardada en SQLite: la
+  cuota se reparte entre todos los workers de gunicorn
+- Techo de llamadas simultáneas por proceso (GEMINI_MAX_CONCURRENCY)
+- Reintentos de errores transitorios (429, 5xx, red) con backoff
+  exponencial y jitter; respeta Retry-After si Gemini lo envía
+- Cortocircuito: tras GEMINI_BREAKER_THRESHOLD fallos seguidos se falla
+  de inmediato durante GEMINI_BREAKER_COOLDOWN segundos
+
+GuardedClient expone la misma interfaz que genai.Client
+(client.models.generate_content / generate_content_stream y
+client.aio.models.generate_content), así que se puede probar con un
+cliente falso:
+
+    client = GuardedClient(FakeClient(), bucket=None, sleep=lambda s: None)
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from .config import (
+    DATA_DIR,
+    GEMINI_RPM, GEMINI_BURST, GEMINI_RATE_WAIT, GEMINI_MAX_CONCURRENCY,
+    GEMINI_RETRIES, GEMINI_BACKOFF_BASE, GEMINI_BACKOFF_MAX,
+    GEMINI_BREAKER_THRESHOLD, GEMINI_BREAKER_COOLDOWN, GEMINI_ASYNC_CONCURRENCY,
+)
+
+_RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class GeminiUnavailable(Exception):
+    """Gemini no se puede llamar ahora; no tiene sentido reintentar de inmediato."""
+
+
+class CircuitOpen(GeminiUnavailable):
+    """El cortocircuito está abierto tras varios fallos seguidos."""
+
+
+class RateLimitTimeout(GeminiUnavailable):
+    """No hubo turno en la cubeta de tokens dentro de GEMINI_RATE_WAIT."""
+
+
+def is_retryable(error):
+    """Errores transitorios: cuota, errores del servidor y fallos de red."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in _RETRYABLE_CODES
+    return isinstance(error, (ConnectionError, TimeoutError)) or (
+        type(error).__module__.startswith("httpx") and "Error" in type(error).__name__
+    )
+
+
+def _retry_after(error):
+    """Segundos de Retry-After de la respuesta, si vienen."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# ─── Cubeta de tokens compartida ───
+
+class TokenBucket:
+    """
+    Cubeta de tokens en SQLite: rate tokens por segundo, hasta capacity.
+    Cada acquire() toma un token en una transacción BEGIN IMMEDIATE, así
+    que varios procesos se reparten la misma cuota.
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS buckets (
+        name TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, db_path, name, rate, capacity, clock=time.time, sleep=time.sleep):
+        self.db_path = db_path
+        self.name = name
+        self.rate = rate
+        self.capacity = max(1.0, float(capacity))
+        self._clock = clock
+        self._sleep = sleep
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self._SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def acquire(self, timeout):
+        """Espera un token. Retorna los segundos esperados o lanza RateLimitTimeout."""
+        if self.rate <= 0:
+            return 0.0
+        start = self._clock()
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return self._clock() - start
+            if self._clock() + wait - start > timeout:
+                raise RateLimitTimeout(f"sin turno para Gemini en {timeout:.0f}s")
+            self._sleep(wait)
+
+    async def acquire_async(self, timeout):
+        """Igual que acquire() sin bloquear el event loop (SQLite va en un hilo)."""
+        if self.rate <= 0:
+            return 0.0
+        start = self._clock()
+        while True:
+            wait = await asyncio.to_thread(self._take)
+            if wait == 0:
+                return self._clock() - start
+            if self._clock() + wait - start > timeout:
+                raise RateLimitTimeout(f"sin turno para Gemini en {timeout:.0f}s")
+            await asyncio.sleep(wait)
+
+    def _take(self):
+        """Toma un token si hay; si no, retorna cuánto falta para el siguiente."""
+        conn = self._conn()
+        now = self._clock()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            tokens = self.capacity if row is None else min(
+                self.capacity, row[0] + max(0.0, now - row[1]) * self.rate
+            )
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (self.name, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+# ─── Cortocircuito ───
+
+class CircuitBreaker:
+    """
+    closed: pasa todo. open: falla de inmediato hasta que pasa el cooldown.
+    half_open: deja pasar una sola llamada de prueba; si sale bien se cierra.
+    Si la prueba termina sin llegar a Gemini (cuota agotada, cancelación),
+    se libera con release_probe para que otra llamada pueda probar.
+    """
+
+    def __init__(self, threshold, cooldown, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def before_call(self):
+        """Lanza CircuitOpen si no se puede llamar. Retorna True si esta llamada es la prueba."""
+        if self.threshold <= 0:
+            return False
+        with self._lock:
+            if self.state == "open":
+                remaining = self.cooldown - (self._clock() - self._opened_at)
+                if remaining > 0:
+                    raise CircuitOpen(f"Gemini no disponible, reintente en {remaining:.0f}s")
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._probing:
+                    raise CircuitOpen("Gemini no disponible, probando reconexión")
+                self._probing = True
+                return True
+            return False
+
+    def release_probe(self):
+        """La llamada de prueba terminó sin resultado de Gemini: se permite otra."""
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or (
+                self.threshold > 0 and self.failures >= self.threshold
+            ):
+                self.state = "open"
+                self._opened_at = self._clock()
+
+
+# ─── Cliente ───
+
+class GuardedClient:
+    """Misma interfaz que genai.Client para generate_content(_stream) y aio."""
+
+    def __init__(self, inner, bucket=None, breaker=None,
+                 max_concurrency=GEMINI_MAX_CONCURRENCY, retries=GEMINI_RETRIES,
+                 backoff_base=GEMINI_BACKOFF_BASE, backoff_max=GEMINI_BACKOFF_MAX,
+                 rate_wait=GEMINI_RATE_WAIT, sleep=time.sleep,
+                 async_concurrency=GEMINI_ASYNC_CONCURRENCY):
+        self.inner = inner
+        self.bucket = bucket
+        self.breaker = breaker or CircuitBreaker(GEMINI_BREAKER_THRESHOLD, GEMINI_BREAKER_COOLDOWN)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_wait = rate_wait
+        self._sleep = sleep
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self.models = _GuardedModels(self)
+        # Llamadas con client.aio: turnos propios, se crean en el loop que las usa
+        self._async_concurrency = max(1, async_concurrency)
+        self._async_slots = None
+        self.aio = _GuardedAio(self)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "calls": 0, "succeeded": 0, "failed": 0, "retries": 0,
+            "short_circuited": 0, "rate_wait_ms": 0.0, "in_flight": 0,
+        }
+
+    def call(self, fn, hold_slot=True):
+        """
+        Ejecuta fn() con cuota, techo de concurrencia, reintentos y cortocircuito.
+        Lanza GeminiUnavailable o el último error de fn.
+        """
+        self._count("calls")
+        attempt = 0
+        while True:
+            try:
+                probe = self.breaker.before_call()
+            except CircuitOpen:
+                self._count("short_circuited")
+                raise
+            if self.bucket is not None:
+                try:
+                    waited = self.bucket.acquire(self.rate_wait)
+                except BaseException:
+                    # Sin turno (RateLimitTimeout) no se llegó a Gemini
+                    self._release(probe)
+                    raise
+                self._count("rate_wait_ms", waited * 1000)
+            try:
+                if hold_slot:
+                    with self._slots:
+                        result = self._run(fn)
+                else:
+                    result = self._run(fn)
+            except Exception as e:
+                delay = self._on_error(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                self._sleep(delay)
+                continue
+            except BaseException:
+                self._release(probe)
+                raise
+
+            self.breaker.record_success()
+            self._count("succeeded")
+            return result
+
+    async def call_async(self, make_coro):
+        """
+        Igual que call() para corrutinas: make_coro() crea una corrutina
+        nueva por intento. Las esperas (cuota, backoff) no bloquean el loop.
+        """
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self._async_concurrency)
+        self._count("calls")
+        attempt = 0
+        while True:
+            try:
+                probe = self.breaker.before_call()
+            except CircuitOpen:
+                self._count("short_circuited")
+                raise
+            if self.bucket is not None:
+                try:
+                    waited = await self.bucket.acquire_async(self.rate_wait)
+                except BaseException:
+                    # Sin turno (RateLimitTimeout) no se llegó a Gemini
+                    self._release(probe)
+                    raise
+                self._count("rate_wait_ms", waited * 1000)
+            try:
+                async with self._async_slots:
+                    self._count("in_flight")
+                    try:
+                        result = await make_coro()
+                    finally:
+                        self._count("in_flight", -1)
+            except Exception as e:
+                delay = self._on_error(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # CancelledError: la prueba no llegó a un resultado
+                self._release(probe)
+                raise
+
+            self.breaker.record_success()
+            self._count("succeeded")
+            return result
+
+    def _release(self, probe):
+        """El intento terminó sin respuesta de Gemini; si era la prueba, se libera."""
+        self._count("failed")
+        if probe:
+            self.breaker.release_probe()
+
+    def _on_error(self, error, attempt):
+        """
+        Registra un intento fallido.
+        Retorna los segundos a esperar antes de reintentar, o None si no se reintenta.
+        """
+        if not is_retryable(error):
+            # Error de la petición (400, prompt inválido): Gemini está sano
+            self.breaker.record_success()
+            self._count("failed")
+            return None
+        self.breaker.record_failure()
+        if attempt >= self.retries:
+            self._count("failed")
+            return None
+        self._count("retries")
+        return self._backoff(attempt + 1, error)
+
+    def _run(self, fn):
+        self._count("in_flight")
+        try:
+            return fn()
+        finally:
+            self._count("in_flight", -1)
+
+    def _backoff(self, attempt, error):
+        """Backoff exponencial con jitter completo; nunca menos que Retry-After."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        """Contadores de este proceso y estado del cortocircuito."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["rate_wait_ms"] = round(stats["rate_wait_ms"], 1)
+        stats["breaker_state"] = self.breaker.state
+        stats["consecutive_failures"] = self.breaker.failures
+        return stats
+
+
+class _GuardedModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, **kwargs):
+        return self._client.call(
+            lambda: self._client.inner.models.generate_content(**kwargs)
+        )
+
+    def generate_content_stream(self, **kwargs):
+        """
+        Se reintenta hasta recibir el primer fragmento; después un error
+        corta el stream (ya se entregaron páginas al cliente).
+        El turno de concurrencia se mantiene mientras dura el stream.
+        """
+        client = self._client
+
+        def start():
+            stream = iter(client.inner.models.generate_content_stream(**kwargs))
+            return next(stream, None), stream
+
+        def chunks():
+            with client._slots:
+                first, stream = client.call(start, hold_slot=False)
+                if first is None:
+                    return
+                yield first
+                try:
+                    yield from stream
+                except Exception as e:
+                    if is_retryable(e):
+                        client.breaker.record_failure()
+                    raise
+
+        return chunks()
+
+
+class _GuardedAio:
+    """client.aio: la interfaz asíncrona de genai.Client con las mismas protecciones."""
+
+    def __init__(self, client):
+        self.models = _GuardedAsyncModels(client)
+
+
+class _GuardedAsyncModels:
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content(self, **kwargs):
+        return await self._client.call_async(
+            lambda: self._client.inner.aio.models.generate_content(**kwargs)
+        )
+
+
+def default_bucket():
+    """Cubeta compartida por los workers según GEMINI_RPM y GEMINI_BURST."""
+    return TokenBucket(
+        os.path.join(DATA_DIR, "gemini_limits.db"), "gemini",
+        rate=GEMINI_RPM / 60.0, capacity=GEMINI_BURST,
+    )
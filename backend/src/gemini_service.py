@@ -1,32 +1,223 @@
 """
 Servicio de integración con Gemini API.
 - Generación de contenido académico con búsqueda web
+- Generación en paralelo por sección con reintentos independientes
+- Streaming de páginas a medida que Gemini las escribe
 - Edición de secciones con instrucciones del usuario
+- Caché opcional de respuestas idénticas (gemini_cache)
+- Límite de cuota, reintentos y cortocircuito (gemini_client)
+- Variantes async (generate_document_async, edit_section_async) sobre
+  client.aio para el modo GEMINI_ASYNC
 """
+import asyncio
 import json
 import re
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from google import genai
 from google.genai import types
-from .config import GEMINI_API_KEY, GEMINI_MODEL
+from .json_stream import PageStreamParser, parse_pages
+from .gemini_cache import make_key, cached_call, cached_call_async
+from .gemini_client import GuardedClient, GeminiUnavailable, default_bucket
+from .metrics import GEMINI_LATENCY, GEMINI_RESPONSE_BYTES, timed
+from .config import (
+    GEMINI_API_KEY, GEMINI_MODEL, GEMINI_BASE_URL,
+    GEMINI_PARALLEL, GEMINI_SECTION_WORKERS, GEMINI_SECTION_RETRIES,
+)
 
-client = genai.Client(api_key=GEMINI_API_KEY)
+# Cuota compartida, reintentos con backoff y cortocircuito (gemini_client)
+client = GuardedClient(
+    genai.Client(
+        api_key=GEMINI_API_KEY,
+        http_options=types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None,
+    ),
+    bucket=default_bucket(),
+)
 
 # --- Herramienta de búsqueda Google ---
 google_search_tool = types.Tool(google_search=types.GoogleSearch())
 
+# Pool compartido por todas las generaciones del proceso (techo global de peticiones)
+_section_executor = ThreadPoolExecutor(
+    max_workers=GEMINI_SECTION_WORKERS, thread_name_prefix="gemini-section",
+)
 
-def generate_document(title, sections, author, carnet):
+
+def generate_document(title, sections, author, carnet, parallel=None, use_cache=False):
     """
     Genera el contenido completo del documento académico.
     - title: título del trabajo
     - sections: lista de secciones definidas por el usuario
       [{ "name": "...", "description": "...", "pages": N }]
     - author, carnet: datos del estudiante
+    - parallel: una petición por sección/página (por defecto GEMINI_PARALLEL)
+    - use_cache: reutilizar una respuesta idéntica guardada (gemini_cache)
     Retorna: lista de páginas [{type, title, content}]
     """
+    if parallel is None:
+        parallel = GEMINI_PARALLEL
+
+    def compute():
+        if parallel and sections:
+            return _generate_parallel(title, sections, author, carnet)
+        return _generate_single(title, sections, author, carnet)
+
+    if not use_cache:
+        return compute()
+    key = make_key(GEMINI_MODEL, "generate", {
+        "title": title, "sections": sections, "author": author,
+        "carnet": carnet, "parallel": parallel,
+    }, 0.7)
+    return cached_call(key, compute, should_store=_no_error_pages)
+
+
+def _no_error_pages(pages):
+    """Solo se guardan en caché generaciones sin páginas de error."""
+    return bool(pages) and all(page.get("type") != "error" for page in pages)
+
+
+async def generate_document_async(title, sections, author, carnet, parallel=None, use_cache=False):
+    """
+    Igual que generate_document, con client.aio: las secciones en paralelo
+    son corrutinas en el loop del proceso, no hilos del pool.
+    """
+    if parallel is None:
+        parallel = GEMINI_PARALLEL
+
+    def compute():
+        if parallel and sections:
+            return _generate_parallel_async(title, sections, author, carnet)
+        return _generate_single_async(title, sections, author, carnet)
+
+    if not use_cache:
+        return await compute()
+    key = make_key(GEMINI_MODEL, "generate", {
+        "title": title, "sections": sections, "author": author,
+        "carnet": carnet, "parallel": parallel,
+    }, 0.7)
+    return await cached_call_async(key, compute, should_store=_no_error_pages)
+
+
+def _call_gemini(kind, prompt, temperature):
+    """
+    Una llamada a Gemini con búsqueda web. Registra duración y tamaño de
+    la respuesta por tipo de llamada (document, section, edit).
+    Retorna: texto de la respuesta
+    """
+    with timed(GEMINI_LATENCY, kind=kind):
+        response = client.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                tools=[google_search_tool],
+                temperature=temperature,
+            ),
+        )
+    return _response_text(kind, response)
+
+
+async def _call_gemini_async(kind, prompt, temperature):
+    """Igual que _call_gemini, con client.aio."""
+    with timed(GEMINI_LATENCY, kind=kind):
+        response = await client.aio.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                tools=[google_search_tool],
+                temperature=temperature,
+            ),
+        )
+    return _response_text(kind, response)
+
+
+def _response_text(kind, response):
+    text = response.text
+    GEMINI_RESPONSE_BYTES.labels(kind=kind).observe(len(text.encode("utf-8")) if text else 0)
+    return text
+
+
+def _generate_single(title, sections, author, carnet):
+    """Genera todo el documento en una sola petición a Gemini."""
+    prompt = _build_document_prompt(title, sections, author, carnet)
+
+    try:
+        raw = _call_gemini("document", prompt, temperature=0.7).strip()
+    except Exception as e:
+        return _generation_error(e)
+    return _document_pages(raw, title)
+
+
+async def _generate_single_async(title, sections, author, carnet):
+    prompt = _build_document_prompt(title, sections, author, carnet)
+
+    try:
+        raw = (await _call_gemini_async("document", prompt, temperature=0.7)).strip()
+    except Exception as e:
+        return _generation_error(e)
+    return _document_pages(raw, title)
+
+
+def _document_pages(raw, title):
+    """Páginas de la respuesta con el documento completo."""
+    parsed = _parse_json_response(raw)
+
+    if parsed and "pages" in parsed:
+        pages = parsed["pages"]
+        if parsed.get("dropped"):
+            pages.append({
+                "type": "error",
+                "title": "Páginas incompletas",
+                "content": f"<p>{parsed['dropped']} página(s) de la respuesta de Gemini "
+                           f"no se pudieron leer. Vuelva a generar el documento.</p>",
+            })
+        return pages
+    else:
+        return [{"type": "contenido", "title": title, "content": f"<p>{raw}</p>"}]
+
+
+def _generation_error(e):
+    return [{
+        "type": "error",
+        "title": "Error de generación",
+        "content": f"<p>Error al generar el contenido: {str(e)}</p>",
+    }]
+
+
+def stream_document(title, sections, author, carnet):
+    """
+    Genera el documento con la API de streaming y produce cada página
+    apenas Gemini termina de escribirla.
+    - Mismos parámetros que generate_document
+    Produce: dicts de página {type, title, content}
+    """
+    prompt = _build_document_prompt(title, sections, author, carnet)
+    parser = PageStreamParser()
+
+    stream = client.models.generate_content_stream(
+        model=GEMINI_MODEL,
+        contents=prompt,
+        config=types.GenerateContentConfig(
+            tools=[google_search_tool],
+            temperature=0.7,
+        ),
+    )
+    start = time.perf_counter()
+    size = 0
+    for chunk in stream:
+        if chunk.text:
+            size += len(chunk.text.encode("utf-8"))
+            yield from parser.feed(chunk.text)
+    parser.close()
+    GEMINI_LATENCY.labels(kind="stream").observe(time.perf_counter() - start)
+    GEMINI_RESPONSE_BYTES.labels(kind="stream").observe(size)
+
+
+def _build_document_prompt(title, sections, author, carnet):
+    """Construye el prompt para generar todo el documento de una vez."""
     sections_desc = _build_sections_prompt(sections)
 
-    prompt = f"""Eres un asistente académico. Genera un trabajo/tarea universitario completo en español.
+    return f"""Eres un asistente académico. Genera un trabajo/tarea universitario completo en español.
 
 TÍTULO: {title}
 AUTOR: {author}
@@ -63,40 +254,65 @@ Ejemplo: si "Desarrollo" tiene 3 páginas, genera 3 objetos con type="desarrollo
 Genera las secciones en el orden dado por el usuario.
 """
 
-    try:
-        response = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                tools=[google_search_tool],
-                temperature=0.7,
-            ),
-        )
-
-        raw = response.text.strip()
-        parsed = _parse_json_response(raw)
 
-        if parsed and "pages" in parsed:
-            return parsed["pages"]
-        else:
-            return [{"type": "contenido", "title": title, "content": f"<p>{raw}</p>"}]
-
-    except Exception as e:
-        return [{
-            "type": "error",
-            "title": "Error de generación",
-            "content": f"<p>Error al generar el contenido: {str(e)}</p>",
-        }]
-
-
-def edit_section(current_content, instructions):
+def edit_section(current_content, instructions, use_cache=False):
     """
     Edita una sección existente según las instrucciones del usuario.
     - current_content: HTML actual de la sección
     - instructions: instrucciones del usuario en lenguaje natural
+    - use_cache: reutilizar una respuesta idéntica guardada (gemini_cache)
     Retorna: nuevo HTML de la sección
     """
-    prompt = f"""Eres un asistente académico. Edita el siguiente contenido HTML según las instrucciones del usuario.
+    if not use_cache:
+        return _edit_section(current_content, instructions)
+    key = make_key(GEMINI_MODEL, "edit", {
+        "content": current_content, "instructions": instructions,
+    }, 0.5)
+    return cached_call(
+        key,
+        lambda: _edit_section(current_content, instructions),
+        should_store=lambda html: not html.startswith("<p>Error al editar:"),
+    )
+
+
+async def edit_section_async(current_content, instructions, use_cache=False):
+    """Igual que edit_section, con client.aio."""
+    if not use_cache:
+        return await _edit_section_async(current_content, instructions)
+    key = make_key(GEMINI_MODEL, "edit", {
+        "content": current_content, "instructions": instructions,
+    }, 0.5)
+    return await cached_call_async(
+        key,
+        lambda: _edit_section_async(current_content, instructions),
+        should_store=lambda html: not html.startswith("<p>Error al editar:"),
+    )
+
+
+def _edit_section(current_content, instructions):
+    """Llama a Gemini para editar una sección."""
+    try:
+        return _clean_edit(_call_gemini("edit", _edit_prompt(current_content, instructions), 0.5))
+    except Exception as e:
+        return f"<p>Error al editar: {str(e)}</p>"
+
+
+async def _edit_section_async(current_content, instructions):
+    prompt = _edit_prompt(current_content, instructions)
+    try:
+        return _clean_edit(await _call_gemini_async("edit", prompt, 0.5))
+    except Exception as e:
+        return f"<p>Error al editar: {str(e)}</p>"
+
+
+def _clean_edit(result):
+    """Quita posibles bloques de código markdown de la respuesta."""
+    result = re.sub(r'^```html\s*', '', result.strip())
+    return re.sub(r'\s*```$', '', result)
+
+
+def _edit_prompt(current_content, instructions):
+    return f"""Eres un asistente académico. Edita el siguiente contenido HTML según las instrucciones del usuario.
 
 CONTENIDO ACTUAL:
 {current_content}
@@ -110,23 +326,156 @@ REGLAS:
 - Responde SOLO con el HTML editado, sin explicaciones adicionales, sin markdown.
 """
 
-    try:
-        response = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                tools=[google_search_tool],
-                temperature=0.5,
-            ),
-        )
-        result = response.text.strip()
-        # Limpiar posibles bloques de código markdown
-        result = re.sub(r'^```html\s*', '', result)
-        result = re.sub(r'\s*```$', '', result)
-        return result
 
-    except Exception as e:
-        return f"<p>Error al editar: {str(e)}</p>"
+def _generate_parallel(title, sections, author, carnet):
+    """
+    Genera cada sección (o cada página de una sección de varias páginas)
+    en una petición propia, sobre el pool acotado.
+    Las páginas se reensamblan en el orden original.
+    """
+    units = []
+    for i, sec in enumerate(sections, 1):
+        total = max(1, int(sec.get("pages", 1) or 1))
+        for part in range(1, total + 1):
+            units.append((i, sec, part, total))
+
+    futures = [
+        _section_executor.submit(_generate_unit, title, author, carnet, *unit)
+        for unit in units
+    ]
+
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
+
+
+def _generate_unit(title, author, carnet, index, section, part, total):
+    """
+    Genera una página de una sección. Reintenta solo esta unidad si
+    Gemini falla o responde algo que no es JSON.
+    """
+    name = section.get("name", f"Sección {index}")
+    page_title = f"{name} ({part}/{total})" if total > 1 else name
+    prompt = _build_section_prompt(title, author, carnet, section, name, page_title, part, total)
+
+    error = None
+    for _ in range(GEMINI_SECTION_RETRIES + 1):
+        try:
+            page = _section_page(_call_gemini("section", prompt, temperature=0.7), name, page_title)
+            if page:
+                return [page]
+            error = "respuesta sin JSON válido"
+        except GeminiUnavailable as e:
+            # Cuota agotada o Gemini caído: reintentar aquí solo empeora
+            error = str(e)
+            break
+        except Exception as e:
+            error = str(e)
+
+    return [_section_error(page_title, error)]
+
+
+async def _generate_parallel_async(title, sections, author, carnet):
+    """Igual que _generate_parallel, con una corrutina por unidad."""
+    units = []
+    for i, sec in enumerate(sections, 1):
+        total = max(1, int(sec.get("pages", 1) or 1))
+        for part in range(1, total + 1):
+            units.append((i, sec, part, total))
+
+    results = await asyncio.gather(*(
+        _generate_unit_async(title, author, carnet, *unit) for unit in units
+    ))
+    return [page for pages in results for page in pages]
+
+
+async def _generate_unit_async(title, author, carnet, index, section, part, total):
+    name = section.get("name", f"Sección {index}")
+    page_title = f"{name} ({part}/{total})" if total > 1 else name
+    prompt = _build_section_prompt(title, author, carnet, section, name, page_title, part, total)
+
+    error = None
+    for _ in range(GEMINI_SECTION_RETRIES + 1):
+        try:
+            raw = await _call_gemini_async("section", prompt, temperature=0.7)
+            page = _section_page(raw, name, page_title)
+            if page:
+                return [page]
+            error = "respuesta sin JSON válido"
+        except GeminiUnavailable as e:
+            error = str(e)
+            break
+        except Exception as e:
+            error = str(e)
+
+    return [_section_error(page_title, error)]
+
+
+def _section_page(raw, name, page_title):
+    """La página de la respuesta de una unidad, o None si no trae JSON válido."""
+    parsed = _parse_json_response(raw.strip())
+    if not parsed or not parsed.get("pages"):
+        return None
+    page = parsed["pages"][0]
+    page["type"] = _snake_case(name)
+    page["title"] = page_title
+    return page
+
+
+def _section_error(page_title, error):
+    return {
+        "type": "error",
+        "title": page_title,
+        "content": f"<p>Error al generar esta sección: {error}</p>",
+    }
+
+
+def _build_section_prompt(title, author, carnet, section, name, page_title, part, total):
+    """Construye el prompt para una sola página de una sección."""
+    desc = section.get("description", "")
+    instructions = f"\nINSTRUCCIONES DE LA SECCIÓN: {desc}" if desc else ""
+    if total > 1:
+        scope = (f"Genera SOLO la parte {part} de {total} de esta sección. "
+                 f"Las otras partes se generan por separado: no repitas su contenido "
+                 f"y continúa el hilo lógico de la sección.")
+    else:
+        scope = "Genera la sección completa."
+
+    return f"""Eres un asistente académico. Estás escribiendo UNA sección de un trabajo universitario en español.
+
+TÍTULO DEL TRABAJO: {title}
+AUTOR: {author}
+CARNET: {carnet}
+
+SECCIÓN: {name}{instructions}
+{scope}
+
+INSTRUCCIONES:
+- Investiga el tema en internet para obtener información real y actualizada.
+- Escribe contenido académico formal, bien estructurado y detallado.
+- Una página de contenido equivale a MÁXIMO 250 palabras (contando títulos, subtítulos y espaciado).
+- Genera SOLO ~200-250 palabras. NO te pases.
+- Incluye un título <h2> al inicio y usa <p> para párrafos.
+- Si la sección es de bibliografía, usa formato APA con fuentes reales.
+
+Responde EXCLUSIVAMENTE con un JSON válido (sin markdown, sin ```json), con esta estructura:
+{{
+  "pages": [
+    {{
+      "type": "{_snake_case(name)}",
+      "title": "{page_title}",
+      "content": "<p>Contenido HTML aquí...</p>"
+    }}
+  ]
+}}
+"""
+
+
+def _snake_case(name):
+    """Convierte el nombre de una sección en un type en snake_case sin tildes."""
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return re.sub(r'\W+', '_', ascii_name.strip().lower()).strip('_') or "contenido"
 
 
 def _build_sections_prompt(sections):
@@ -147,7 +496,8 @@ def _parse_json_response(raw):
     """
     Intenta parsear JSON de la respuesta de Gemini.
     - Limpia bloques de código markdown si los hay
-    - Intenta extraer JSON si está envuelto en texto
+    - Si no es JSON válido, rescata en una pasada las páginas bien formadas
+      del arreglo "pages"; "dropped" indica cuántas se descartaron
     """
     # Remover bloques de markdown ```json ... ```
     cleaned = re.sub(r'^```(?:json)?\s*', '', raw)
@@ -158,12 +508,7 @@ def _parse_json_response(raw):
     except json.JSONDecodeError:
         pass
 
-    # Intentar encontrar JSON dentro del texto
-    match = re.search(r'\{[\s\S]*\}', raw)
-    if match:
-        try:
-            return json.loads(match.group())
-        except json.JSONDecodeError:
-            pass
-
+    pages, parser = parse_pages(raw)
+    if pages:
+        return {"pages": pages, "dropped": parser.dropped}
     return None
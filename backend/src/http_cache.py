@@ -0,0 +1,114 @@
+"""
+Respuestas versionadas para los endpoints que el editor consulta seguido.
+- ETag fuerte derivado de (doc_id, versión) y, para lo renderizado, de la
+  huella del renderer: si el cliente ya tiene esa versión (If-None-Match)
+  se responde 304 sin construir el cuerpo
+- El cuerpo se comprime con brotli (si está instalado) o gzip según
+  Accept-Encoding, y cada variante se guarda en una caché LRU acotada por
+  bytes: el preview de una versión se construye y comprime una sola vez
+"""
+import gzip
+import threading
+from collections import OrderedDict
+from flask import Response, request
+from .config import HTTP_CACHE_MAX_BYTES, HTTP_COMPRESS_MIN_BYTES
+
+try:
+    import brotli
+except ImportError:  # gzip es suficiente si brotli no está instalado
+    brotli = None
+
+_ENCODERS = {"gzip": lambda body: gzip.compress(body, compresslevel=6)}
+if brotli is not None:
+    _ENCODERS = {"br": lambda body: brotli.compress(body, quality=5), **_ENCODERS}
+
+_cache = OrderedDict()  # (etag, codificación pedida) -> (bytes, codificación usada)
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+_stats = {"not_modified": 0, "hits": 0, "misses": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def document_etag(doc_id, version, kind, build=None):
+    """
+    ETag de una representación (kind: document, preview, fragment-…) de una versión.
+    - build: huella del código que la genera (pdf_service.RENDER_BUILD para HTML)
+    """
+    etag = f"{kind}-{doc_id}-v{version}"
+    return f"{etag}-{build}" if build else etag
+
+
+def versioned_response(etag, build, mimetype):
+    """
+    Responde 304 si el cliente tiene etag; si no, el cuerpo de build() comprimido.
+    - build: función sin argumentos que retorna el cuerpo (str o bytes);
+      solo se llama si esa versión no está en caché
+    """
+    if request.if_none_match.contains(etag):
+        with _cache_lock:
+            _stats["not_modified"] += 1
+        response = Response(status=304)
+    else:
+        encoding = request.accept_encodings.best_match(list(_ENCODERS)) or "identity"
+        body, encoding = _encoded(etag, encoding, build)
+        response = Response(body, mimetype=mimetype)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def _encoded(etag, encoding, build):
+    """
+    Cuerpo para la codificación pedida, desde la caché o construido y comprimido.
+    Retorna: (bytes, codificación usada); los cuerpos chicos van sin comprimir
+    """
+    key = (etag, encoding)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return entry
+        _stats["misses"] += 1
+
+    raw = build()
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    if encoding == "identity" or len(raw) < HTTP_COMPRESS_MIN_BYTES:
+        entry = (raw, "identity")
+    else:
+        entry = (_ENCODERS[encoding](raw), encoding)
+    _put(key, entry)
+    with _cache_lock:
+        _stats["bytes_in"] += len(raw)
+        _stats["bytes_out"] += len(entry[0])
+    return entry
+
+
+def _put(key, entry):
+    global _cache_bytes
+    size = len(entry[0])
+    if size > HTTP_CACHE_MAX_BYTES:
+        return
+    with _cache_lock:
+        old = _cache.pop(key, None)
+        if old is not None:
+            _cache_bytes -= len(old[0])
+        _cache[key] = entry
+        _cache_bytes += size
+        while _cache_bytes > HTTP_CACHE_MAX_BYTES:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted[0])
+
+
+def http_cache_stats():
+    """Respuestas 304, aciertos de la caché y bytes antes/después de comprimir."""
+    with _cache_lock:
+        return {
+            **_stats,
+            "entries": len(_cache),
+            "cached_bytes": _cache_bytes,
+            "encodings": list(_ENCODERS),
+        }
@@ -0,0 +1,107 @@
+"""
+Ingesta de imágenes subidas por el usuario.
+- Decodifica una sola vez, corrige la orientación EXIF y reduce a
+  resolución de impresión (IMAGE_MAX_PX en el lado mayor)
+- Elimina metadatos y recodifica: JPEG para fotos, PNG si hay transparencia
+- Guarda por hash de contenido: la misma imagen subida dos veces se
+  almacena una sola vez
+"""
+import hashlib
+import io
+import os
+import threading
+from PIL import Image, ImageOps, UnidentifiedImageError
+from .config import UPLOAD_DIR, IMAGE_MAX_PX, IMAGE_JPEG_QUALITY
+
+# Rechazar "bombas" de descompresión en lugar de solo advertir
+Image.MAX_IMAGE_PIXELS = 60_000_000
+
+# Totales del proceso para medir el ahorro
+_stats_lock = threading.Lock()
+_stats = {"uploads": 0, "deduplicated": 0, "original_bytes": 0, "stored_bytes": 0}
+
+
+class InvalidImage(Exception):
+    """El archivo subido no es una imagen que se pueda decodificar."""
+
+
+def ingest_image(data):
+    """
+    Procesa los bytes de una imagen subida y la guarda en UPLOAD_DIR.
+    - data: contenido original del archivo
+    Retorna: dict { filename, original_bytes, stored_bytes, width, height }
+    Lanza InvalidImage si no se puede decodificar.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        # JPEG: decodificar directamente a menor escala (mucho más rápido)
+        img.draft("RGB", (IMAGE_MAX_PX, IMAGE_MAX_PX))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((IMAGE_MAX_PX, IMAGE_MAX_PX), Image.LANCZOS)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise InvalidImage(str(e))
+
+    encoded, ext = _encode(img)
+    digest = hashlib.sha256(encoded).hexdigest()[:24]
+    filename = f"{digest}{ext}"
+    filepath = os.path.join(UPLOAD_DIR, filename)
+
+    duplicate = _touch(filepath)
+    if not duplicate:
+        tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(encoded)
+        os.replace(tmp_path, filepath)
+
+    with _stats_lock:
+        _stats["uploads"] += 1
+        _stats["deduplicated"] += int(duplicate)
+        _stats["original_bytes"] += len(data)
+        _stats["stored_bytes"] += 0 if duplicate else len(encoded)
+
+    return {
+        "filename": filename,
+        "original_bytes": len(data),
+        "stored_bytes": len(encoded),
+        "width": img.width,
+        "height": img.height,
+    }
+
+
+def _touch(filepath):
+    """
+    Marca un archivo ya guardado como recién usado, para que el janitor no
+    lo borre antes de que se asocie a su página. Retorna False si no existe.
+    """
+    try:
+        os.utime(filepath)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _encode(img):
+    """Recodifica sin metadatos. Retorna (bytes, extensión)."""
+    out = io.BytesIO()
+    has_alpha = img.mode in ("RGBA", "LA", "PA") or (
+        img.mode == "P" and "transparency" in img.info
+    )
+    if has_alpha:
+        img.convert("RGBA").save(out, format="PNG", optimize=True)
+        return out.getvalue(), ".png"
+
+    # WeasyPrint incrusta los JPEG tal cual en el PDF, sin recomprimir
+    img.convert("RGB").save(
+        out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True,
+    )
+    return out.getvalue(), ".jpg"
+
+
+def ingest_stats():
+    """Totales de imágenes procesadas por este proceso."""
+    with _stats_lock:
+        stats = dict(_stats)
+    saved = stats["original_bytes"] - stats["stored_bytes"]
+    stats["saved_bytes"] = saved
+    stats["saved_ratio"] = round(saved / stats["original_bytes"], 3) if stats["original_bytes"] else None
+    return stats
@@ -0,0 +1,179 @@
+"""
+Limpieza de disco de UPLOAD_DIR y OUTPUT_DIR según la vida de los documentos.
+- Uploads huérfanos (ningún documento los referencia) se borran pasado
+  JANITOR_UPLOAD_GRACE, para no pisar una imagen recién subida que aún
+  no se asoció a su página
+- PDFs de documentos que ya no existen se borran; los demás pasado
+  JANITOR_OUTPUT_MAX_AGE sin usarse (pdf_cache los toca en cada descarga)
+- Temporales (*.tmp) abandonados por un proceso caído
+- Cuotas por volumen: si se superan, se borran primero los archivos
+  borrables más viejos. Un upload referenciado nunca se borra
+- Corre en un hilo de fondo; con varios workers de gunicorn solo uno
+  barre a la vez (flock no bloqueante)
+"""
+import fcntl
+import os
+import threading
+import time
+from .config import (
+    OUTPUT_DIR, UPLOAD_DIR, JANITOR_INTERVAL, JANITOR_UPLOAD_GRACE,
+    JANITOR_OUTPUT_MAX_AGE, JANITOR_UPLOAD_QUOTA_BYTES, JANITOR_OUTPUT_QUOTA_BYTES,
+)
+from .document_store import document_ids, referenced_uploads
+from .metrics import JANITOR_RECLAIMED_BYTES
+
+_TMP_MAX_AGE = 3600     # segundos
+_MIN_ORPHAN_AGE = 300   # ni con la cuota superada se borra un upload más nuevo
+
+_LOCK_PATH = os.path.join(OUTPUT_DIR, ".locks", "janitor.lock")
+
+_thread = None
+_stats_lock = threading.Lock()
+_stats = {"sweeps": 0, "skipped": 0, "deleted_files": 0, "reclaimed_bytes": 0,
+          "last_sweep_at": None, "last_sweep_ms": None, "over_quota": []}
+
+
+def start():
+    """Arranca el hilo de limpieza del proceso (JANITOR_INTERVAL=0 lo desactiva)."""
+    global _thread
+    if JANITOR_INTERVAL <= 0 or _thread is not None:
+        return
+    _thread = threading.Thread(target=_loop, name="janitor", daemon=True)
+    _thread.start()
+
+
+def _loop():
+    while True:
+        time.sleep(JANITOR_INTERVAL)
+        try:
+            sweep()
+        except Exception:
+            # Un barrido fallido no debe matar el hilo; se reintenta en el próximo
+            pass
+
+
+def sweep():
+    """
+    Un barrido completo de ambos volúmenes.
+    Retorna: bytes liberados, o None si otro proceso ya estaba barriendo
+    """
+    os.makedirs(os.path.dirname(_LOCK_PATH), exist_ok=True)
+    fd = os.open(_LOCK_PATH, os.O_CREAT | os.O_RDWR)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            with _stats_lock:
+                _stats["skipped"] += 1
+            return None
+        began = time.perf_counter()
+        now = time.time()
+        over_quota = []
+        reclaimed = _sweep_uploads(now, over_quota) + _sweep_outputs(now, over_quota)
+    finally:
+        os.close(fd)
+
+    with _stats_lock:
+        _stats["sweeps"] += 1
+        _stats["last_sweep_at"] = now
+        _stats["last_sweep_ms"] = round((time.perf_counter() - began) * 1000, 1)
+        _stats["over_quota"] = over_quota
+    return reclaimed
+
+
+def _sweep_uploads(now, over_quota):
+    refs = referenced_uploads()
+    files = _scan(UPLOAD_DIR)
+    deletable = []
+    for name, size, mtime in files:
+        if name.endswith(".tmp"):
+            if now - mtime > _TMP_MAX_AGE:
+                deletable.append((mtime, size, name, "tmp"))
+        elif name not in refs:
+            deletable.append((mtime, size, name, "orphan"))
+
+    # Huérfanos pasado el período de gracia; si hay que bajar de la cuota,
+    # también los más nuevos (nunca los referenciados)
+    total = sum(size for _, size, _ in files)
+    reclaimed = 0
+    for mtime, size, name, reason in sorted(deletable):
+        expired = reason == "tmp" or now - mtime > JANITOR_UPLOAD_GRACE
+        if not expired and (total <= JANITOR_UPLOAD_QUOTA_BYTES or now - mtime < _MIN_ORPHAN_AGE):
+            continue
+        if _remove(UPLOAD_DIR, name, size, mtime, "uploads", reason if expired else "quota"):
+            total -= size
+            reclaimed += size
+    if total > JANITOR_UPLOAD_QUOTA_BYTES:
+        over_quota.append("uploads")
+    return reclaimed
+
+
+def _sweep_outputs(now, over_quota):
+    docs = document_ids()
+    files = _scan(OUTPUT_DIR)
+    total = sum(size for _, size, _ in files)
+    reclaimed = 0
+    remaining = []
+    for name, size, mtime in files:
+        reason = None
+        if name.endswith(".tmp"):
+            reason = "tmp" if now - mtime > _TMP_MAX_AGE else None
+        elif name.startswith("tarea_") and name.endswith(".pdf"):
+            # tarea_<doc_id>_<clave>.pdf
+            doc_id = name[len("tarea_"):].rsplit("_", 1)[0]
+            if doc_id not in docs:
+                reason = "orphan"
+            elif now - mtime > JANITOR_OUTPUT_MAX_AGE:
+                reason = "stale"
+            else:
+                remaining.append((mtime, size, name))
+        if reason and _remove(OUTPUT_DIR, name, size, mtime, "outputs", reason):
+            total -= size
+            reclaimed += size
+
+    # PDFs menos usados primero hasta bajar de la cuota
+    for mtime, size, name in sorted(remaining):
+        if total <= JANITOR_OUTPUT_QUOTA_BYTES:
+            break
+        if _remove(OUTPUT_DIR, name, size, mtime, "outputs", "quota"):
+            total -= size
+            reclaimed += size
+    if total > JANITOR_OUTPUT_QUOTA_BYTES:
+        over_quota.append("outputs")
+    return reclaimed
+
+
+def _scan(path):
+    """Archivos del directorio (sin subdirectorios): [(nombre, bytes, mtime)]."""
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    files.append((entry.name, st.st_size, st.st_mtime))
+            except FileNotFoundError:
+                continue
+    return files
+
+
+def _remove(directory, name, size, mtime, volume, reason):
+    """Borra el archivo si no se tocó desde el escaneo (upload reutilizado, PDF descargado)."""
+    path = os.path.join(directory, name)
+    try:
+        if os.stat(path).st_mtime != mtime:
+            return False
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    JANITOR_RECLAIMED_BYTES.labels(volume, reason).inc(size)
+    with _stats_lock:
+        _stats["deleted_files"] += 1
+        _stats["reclaimed_bytes"] += size
+    return True
+
+
+def janitor_stats():
+    """Barridos, archivos borrados y bytes liberados por este worker."""
+    with _stats_lock:
+        return dict(_stats, over_quota=list(_stats["over_quota"]))
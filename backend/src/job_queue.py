@@ -0,0 +1,151 @@
+"""
+Cola de trabajos en segundo plano.
+- Ejecuta las generaciones con IA fuera del hilo de la petición
+- Executor acotado: JOB_WORKERS en paralelo, JOB_QUEUE_MAX en espera
+- El estado de cada trabajo se guarda en el store, así cualquier worker
+  de gunicorn puede responder la consulta de estado
+- Un trabajo async (fn es una corrutina) corre en el event loop del
+  proceso (aio_runner) en vez de ocupar un hilo, hasta JOB_ASYNC_MAX a la vez
+"""
+import asyncio
+import inspect
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from . import aio_runner
+from .config import JOB_WORKERS, JOB_QUEUE_MAX, JOB_ASYNC_MAX
+from .document_store import save_job, get_job
+
+
+class QueueFull(Exception):
+    """La cola de trabajos de este proceso está llena."""
+
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+_lock = threading.Lock()
+
+# Contadores del proceso (se exponen en /api/jobs/stats)
+_stats = {
+    "queued": 0,
+    "running": 0,
+    "done": 0,
+    "failed": 0,
+    "rejected": 0,
+    "running_async": 0,
+    "total_queue_ms": 0.0,
+    "total_run_ms": 0.0,
+}
+
+
+def submit_job(kind, fn, *args, doc_id=None):
+    """
+    Encola un trabajo y retorna su registro inicial sin esperar a que termine.
+    - kind: tipo de trabajo ("generate", ...)
+    - fn: función (o corrutina) a ejecutar; retorna None si tuvo éxito o un mensaje de error
+    - doc_id: documento asociado (se devuelve en el estado del trabajo)
+    Lanza QueueFull si ya hay JOB_QUEUE_MAX trabajos esperando
+    (o JOB_ASYNC_MAX trabajos async en curso).
+    """
+    is_async = inspect.iscoroutinefunction(fn)
+    with _lock:
+        full = _stats["running_async"] >= JOB_ASYNC_MAX if is_async \
+            else _stats["queued"] >= JOB_QUEUE_MAX
+        if full:
+            _stats["rejected"] += 1
+            raise QueueFull()
+        _stats["queued"] += 1
+        if is_async:
+            _stats["running_async"] += 1
+
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "kind": kind,
+        "status": "queued",
+        "doc_id": doc_id,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "queue_ms": None,
+        "run_ms": None,
+    }
+    save_job(job)
+    snapshot = dict(job)
+    if is_async:
+        aio_runner.submit(_run_async(job, fn, args))
+    else:
+        _executor.submit(_run, job, fn, args)
+    return snapshot
+
+
+def _run(job, fn, args):
+    """Ejecuta el trabajo y actualiza su estado en el store."""
+    _start(job)
+    try:
+        error = fn(*args)
+    except Exception as e:
+        error = str(e)
+    _finish(job, error)
+
+
+async def _run_async(job, fn, args):
+    """Igual que _run en el event loop; el store (SQLite) se escribe en un hilo."""
+    try:
+        await asyncio.to_thread(_start, job)
+        try:
+            error = await fn(*args)
+        except Exception as e:
+            error = str(e)
+        await asyncio.to_thread(_finish, job, error)
+    finally:
+        with _lock:
+            _stats["running_async"] -= 1
+
+
+def _start(job):
+    job["started_at"] = time.time()
+    job["queue_ms"] = round((job["started_at"] - job["created_at"]) * 1000, 1)
+    job["status"] = "running"
+    with _lock:
+        _stats["queued"] -= 1
+        _stats["running"] += 1
+        _stats["total_queue_ms"] += job["queue_ms"]
+    save_job(job)
+
+
+def _finish(job, error):
+    job["finished_at"] = time.time()
+    job["run_ms"] = round((job["finished_at"] - job["started_at"]) * 1000, 1)
+    job["status"] = "failed" if error else "done"
+    job["error"] = error
+    with _lock:
+        _stats["running"] -= 1
+        _stats[job["status"]] += 1
+        _stats["total_run_ms"] += job["run_ms"]
+    save_job(job)
+
+
+def job_status(job_id):
+    """Retorna el registro de un trabajo o None si no existe."""
+    return get_job(job_id)
+
+
+def queue_stats():
+    """Profundidad de cola y tiempos promedio de este proceso."""
+    with _lock:
+        stats = dict(_stats)
+    finished = stats["done"] + stats["failed"]
+    started = finished + stats["running"]
+    return {
+        "workers": JOB_WORKERS,
+        "max_queue": JOB_QUEUE_MAX,
+        "queued": stats["queued"],
+        "running": stats["running"],
+        "done": stats["done"],
+        "failed": stats["failed"],
+        "rejected": stats["rejected"],
+        "running_async": stats["running_async"],
+        "avg_queue_ms": round(stats["total_queue_ms"] / started, 1) if started else None,
+        "avg_run_ms": round(stats["total_run_ms"] / finished, 1) if finished else None,
+    }
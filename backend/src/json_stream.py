@@ -0,0 +1,173 @@
+"""
+Parser incremental y tolerante del JSON { "pages": [...] } que responde Gemini.
+- Recibe la respuesta por fragmentos (streaming) o completa (parse_pages)
+- Emite cada objeto página apenas se cierra su llave
+- Cada carácter se examina una sola vez: el estado (profundidad, string,
+  escape) se conserva entre fragmentos y el buffer solo guarda la página
+  que se está leyendo
+- Rescata lo que puede de respuestas mal formadas: comillas sin escapar
+  dentro del HTML, saltos de línea crudos y comas finales. Una página
+  rota se descarta sin perder las demás
+"""
+import json
+import re
+import threading
+
+# Después de una comilla que cierra un string solo puede venir uno de estos
+_AFTER_STRING = ",:}]"
+_WHITESPACE = " \t\r\n"
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+
+# Totales del proceso para respuestas en streaming o que no eran JSON válido
+# (se exponen en /api/gemini/parse/stats)
+_stats_lock = threading.Lock()
+_stats = {"responses": 0, "pages": 0, "dropped": 0, "repaired": 0, "truncated": 0}
+
+
+class PageStreamParser:
+    """
+    Uso:
+        parser = PageStreamParser()
+        for chunk in stream:
+            for page in parser.feed(chunk):
+                ...
+        parser.close()
+    Se asume la estructura del prompt: un objeto raíz cuyo primer arreglo
+    contiene las páginas. Texto fuera del JSON (p. ej. ```json) se ignora.
+    """
+
+    def __init__(self):
+        self._depth = 0          # profundidad de {} y [] abiertos
+        self._in_string = False
+        self._escape = False
+        self._quote_pending = False  # comilla dentro de un string: ¿cierra o es literal?
+        self._quote_idx = None       # su posición en _buf, para escaparla si es literal
+        self._page_repaired = False
+        self._array_depth = None  # profundidad a la que vive el arreglo de páginas
+        self._done = False       # el arreglo de páginas ya se cerró
+        self._closed = False
+        self._buf = []           # caracteres de la página actual
+        self.pages_emitted = 0
+        self.dropped = 0         # páginas con JSON inválido descartadas
+        self.repaired = 0        # páginas que solo se pudieron leer tras repararlas
+        self.truncated = False   # la respuesta terminó a mitad de una página
+
+    def feed(self, chunk):
+        """Procesa un fragmento y retorna las páginas completas encontradas."""
+        pages = []
+        capturing = bool(self._buf)
+        buf = self._buf
+
+        if self._done:
+            return pages
+
+        for ch in chunk:
+            if capturing:
+                buf.append(ch)
+
+            if self._quote_pending:
+                if ch in _WHITESPACE:
+                    continue
+                self._quote_pending = False
+                if ch in _AFTER_STRING:
+                    self._in_string = False
+                else:
+                    # Comilla sin escapar dentro del texto (p. ej. class="x")
+                    if self._quote_idx is not None:
+                        buf[self._quote_idx] = '\\"'
+                        self._page_repaired = True
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._quote_pending = True
+                    self._quote_idx = len(buf) - 1 if capturing else None
+                continue
+
+            if ch == '"':
+                if self._depth > 0:
+                    self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "[" and self._array_depth is None and self._depth == 2:
+                    self._array_depth = self._depth
+                elif ch == "{" and self._array_depth is not None \
+                        and self._depth == self._array_depth + 1 and not capturing:
+                    capturing = True
+                    buf.append(ch)
+            elif ch in "}]":
+                if self._depth == 0:
+                    continue
+                self._depth -= 1
+                if capturing and self._depth == self._array_depth:
+                    page = self._decode("".join(buf))
+                    if page is not None:
+                        pages.append(page)
+                    buf.clear()
+                    self._page_repaired = False
+                    capturing = False
+                elif self._array_depth is not None and self._depth < self._array_depth:
+                    self._done = True
+                    break
+
+        return pages
+
+    def close(self):
+        """Fin de la respuesta: una página a medio escribir cuenta como descartada."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._buf:
+            self._buf.clear()
+            self.dropped += 1
+            self.truncated = True
+        with _stats_lock:
+            _stats["responses"] += 1
+            _stats["pages"] += self.pages_emitted
+            _stats["dropped"] += self.dropped
+            _stats["repaired"] += self.repaired
+            _stats["truncated"] += int(self.truncated)
+
+    def _decode(self, raw):
+        repaired = self._page_repaired
+        page = _loads(raw)
+        if page is None:
+            # Comas finales: {"a": 1,} / [..., ]
+            page = _loads(_TRAILING_COMMA_RE.sub(r"\1", raw))
+            repaired = True
+        if not isinstance(page, dict):
+            self.dropped += 1
+            return None
+        self.pages_emitted += 1
+        self.repaired += int(repaired)
+        return page
+
+
+def _loads(raw):
+    try:
+        # strict=False acepta saltos de línea y tabs crudos dentro de strings
+        return json.loads(raw, strict=False)
+    except json.JSONDecodeError:
+        return None
+
+
+def parse_pages(raw):
+    """
+    Extrae en una sola pasada todas las páginas bien formadas de una
+    respuesta completa.
+    Retorna: (pages, parser) — parser.dropped / repaired / truncated
+    indican lo que no se pudo leer tal cual.
+    """
+    parser = PageStreamParser()
+    pages = parser.feed(raw)
+    parser.close()
+    return pages, parser
+
+
+def parse_stats():
+    """Páginas leídas, reparadas y descartadas por este proceso."""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,169 @@
+"""
+Métricas Prometheus (GET /metrics).
+- Latencia por ruta (plantilla de la URL, no la URL con IDs)
+- Latencia por etapa: llamadas a Gemini y tamaño de sus respuestas,
+  HTML del preview, mapa de páginas, render del PDF y tamaño del PDF
+- Con varios workers de gunicorn se usa el modo multiproceso de
+  prometheus_client: si PROMETHEUS_MULTIPROC_DIR está definido, cada
+  proceso escribe ahí sus valores y /metrics los suma (gunicorn.conf.py
+  limpia el directorio al arrancar)
+- Aciertos, fallos y expulsiones del store son contadores normales (se
+  suman entre workers); el tamaño del store en memoria es un gauge
+  livesum (cada worker aporta el suyo mientras vive)
+- Tamaño del store SQLite (compartido) y uso de disco se calculan en cada scrape
+"""
+import os
+import time
+from contextlib import contextmanager
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+from .config import OUTPUT_DIR, UPLOAD_DIR, STORE_BACKEND
+
+_MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+_SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+_BYTE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))  # 1 KB … 64 MB
+
+HTTP_LATENCY = Histogram(
+    "tareinador_http_request_duration_seconds",
+    "Tiempo hasta la respuesta por ruta (en streaming: hasta el primer byte)",
+    ["method", "route", "status"],
+)
+GEMINI_LATENCY = Histogram(
+    "tareinador_gemini_call_duration_seconds",
+    "Duración de cada llamada a Gemini",
+    ["kind"], buckets=_SLOW_BUCKETS,
+)
+GEMINI_RESPONSE_BYTES = Histogram(
+    "tareinador_gemini_response_bytes",
+    "Tamaño del texto que responde Gemini",
+    ["kind"], buckets=_BYTE_BUCKETS,
+)
+STAGE_LATENCY = Histogram(
+    "tareinador_stage_duration_seconds",
+    "Duración de las etapas del pipeline (html_build, page_map, pdf_render)",
+    ["stage"], buckets=_SLOW_BUCKETS,
+)
+PDF_BYTES = Histogram(
+    "tareinador_pdf_bytes",
+    "Tamaño de los PDFs renderizados",
+    buckets=_BYTE_BUCKETS,
+)
+JANITOR_RECLAIMED_BYTES = Counter(
+    "tareinador_janitor_reclaimed_bytes",
+    "Bytes liberados por el janitor (reason: orphan, stale, tmp, quota)",
+    ["volume", "reason"],
+)
+
+STORE_CACHE_HITS = Counter(
+    "tareinador_store_cache_hits",
+    "Lecturas servidas desde memoria del proceso",
+)
+STORE_CACHE_MISSES = Counter(
+    "tareinador_store_cache_misses",
+    "Lecturas que no estaban en memoria",
+)
+STORE_EVICTIONS = Counter(
+    "tareinador_store_evictions",
+    "Documentos expulsados de la memoria (LRU)",
+)
+STORE_MEMORY_DOCUMENTS = Gauge(
+    "tareinador_store_memory_documents",
+    "Documentos en el store en memoria (suma de los workers vivos)",
+    multiprocess_mode="livesum",
+)
+STORE_MEMORY_BYTES = Gauge(
+    "tareinador_store_memory_bytes",
+    "Tamaño aproximado del store en memoria (suma de los workers vivos)",
+    multiprocess_mode="livesum",
+)
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observa en histogram la duración del bloque."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metric = histogram.labels(**labels) if labels else histogram
+        metric.observe(time.perf_counter() - start)
+
+
+def stage(name):
+    """Atajo: with stage("page_map"): ..."""
+    return timed(STAGE_LATENCY, stage=name)
+
+
+# ─── Estado calculado en cada scrape ───
+
+class _StateCollector:
+    """Tamaño del store SQLite y de los volúmenes: son compartidos, da igual qué worker los calcule."""
+
+    def collect(self):
+        if STORE_BACKEND == "sqlite":
+            from .document_store import store_stats
+
+            stats = store_stats()
+            yield GaugeMetricFamily(
+                "tareinador_store_documents", "Documentos en el store", value=stats["documents"],
+            )
+            yield GaugeMetricFamily(
+                "tareinador_store_bytes", "Tamaño aproximado del store", value=stats["bytes"],
+            )
+        disk = GaugeMetricFamily(
+            "tareinador_disk_bytes", "Bytes usados por volumen", labels=["volume"],
+        )
+        for volume, path in (("uploads", UPLOAD_DIR), ("outputs", OUTPUT_DIR)):
+            disk.add_metric([volume], _dir_bytes(path))
+        yield disk
+
+
+def _dir_bytes(path):
+    total = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+if not _MULTIPROCESS:
+    REGISTRY.register(_StateCollector())
+
+
+def _registry():
+    if not _MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(_StateCollector())
+    return registry
+
+
+# ─── Integración con Flask ───
+
+def init_app(app):
+    """Registra el middleware de latencia y la ruta /metrics."""
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        start = g.pop("metrics_start", None)
+        if start is not None and request.endpoint != "metrics":
+            route = request.url_rule.rule if request.url_rule else "<sin ruta>"
+            HTTP_LATENCY.labels(request.method, route, str(response.status_code)).observe(
+                time.perf_counter() - start
+            )
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(generate_latest(_registry()), mimetype=CONTENT_TYPE_LATEST)
@@ -6,9 +6,15 @@ Simula el layout de una página tamaño carta con márgenes de 2.5cm:
   - ~28 líneas útiles por página
   - ~11 palabras promedio por línea
   - ~300 palabras de texto plano por página
+Las estimaciones se memorizan por contenido y el mapa de páginas de cada
+documento se mantiene con sumas prefijas, así una edición solo vuelve a
+estimar la sección editada.
 """
+import html
 import re
-from html.parser import HTMLParser
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 
 
 # ─── Constantes de layout (tamaño carta, márgenes 2.5cm, 12pt, line-height 1.8) ───
@@ -35,42 +41,37 @@ ELEMENT_LINES = {
 }
 
 
-class _ContentParser(HTMLParser):
-    """Parser que extrae texto y elementos estructurales del HTML."""
+# ─── Tokenizer de una pasada ───
+# Etiquetas (grupo 1 = "/" si es de cierre, grupo 2 = nombre), comentarios y
+# declaraciones. Lo que queda entre dos coincidencias es texto.
+_TOKEN_RE = re.compile(r'<(/?)([A-Za-z][A-Za-z0-9]*)[^>]*>|<!--[\s\S]*?-->|<![^>]*>')
 
-    def __init__(self):
-        super().__init__()
-        self.total_lines = 0.0
-        self._current_text = []
-        self._in_heading = False
-
-    def handle_starttag(self, tag, attrs):
-        # Flush text antes del nuevo elemento
-        self._flush_text()
-        # Sumar líneas del elemento
-        tag_lower = tag.lower()
-        self.total_lines += ELEMENT_LINES.get(tag_lower, 0)
-        if tag_lower in ("h1", "h2", "h3", "h4"):
-            self._in_heading = True
-
-    def handle_endtag(self, tag):
-        self._flush_text()
-        if tag.lower() in ("h1", "h2", "h3", "h4"):
-            self._in_heading = False
-
-    def handle_data(self, data):
-        self._current_text.append(data)
-
-    def _flush_text(self):
-        if not self._current_text:
-            return
-        text = " ".join(self._current_text).strip()
-        self._current_text = []
-        if not text:
-            return
-        words = len(text.split())
-        lines = words / WORDS_PER_LINE
-        self.total_lines += lines
+
+def _count_lines(html_content):
+    """
+    Recorre el HTML una sola vez sumando el costo de cada etiqueta de
+    apertura (ELEMENT_LINES) y las líneas de cada tramo de texto.
+    """
+    total_lines = 0.0
+    pos = 0
+    for match in _TOKEN_RE.finditer(html_content):
+        start = match.start()
+        if start > pos:
+            total_lines += _text_lines(html_content[pos:start])
+        pos = match.end()
+        tag = match.group(2)
+        if tag and not match.group(1):
+            total_lines += ELEMENT_LINES.get(tag.lower(), 0)
+    if pos < len(html_content):
+        total_lines += _text_lines(html_content[pos:])
+    return total_lines
+
+
+def _text_lines(text):
+    """Líneas que ocupa un tramo de texto entre etiquetas."""
+    if "&" in text:
+        text = html.unescape(text)
+    return len(text.split()) / WORDS_PER_LINE
 
 
 def estimate_pages(html_content):
@@ -81,47 +82,120 @@ def estimate_pages(html_content):
     """
     if not html_content:
         return 1
+    return _estimate_cached(html_content)
 
-    parser = _ContentParser()
-    try:
-        parser.feed(html_content)
-        parser._flush_text()  # flush final
-    except Exception:
-        # Fallback: contar palabras si el parser falla
-        text = re.sub(r'<[^>]+>', ' ', html_content)
-        words = len(text.split())
-        return max(1, round(words / WORDS_PER_PAGE))
-
-    pages = parser.total_lines / LINES_PER_PAGE
+
+@lru_cache(maxsize=4096)
+def _estimate_cached(html_content):
+    """estimate_pages memorizado por contenido."""
+    pages = _count_lines(html_content) / LINES_PER_PAGE
     return max(1, round(pages))
 
 
-def calculate_page_map(doc):
+# ─── Mapa de páginas incremental ───
+
+class PageMap:
+    """
+    Mapa de páginas de un documento con sumas prefijas.
+    Al sincronizar con el contenido actual solo se estiman las secciones
+    que cambiaron, y las páginas iniciales se recorren desde la primera
+    sección modificada.
+    """
+
+    def __init__(self):
+        self.first_page = None
+        self.titles = []
+        self.contents = []
+        self.counts = []
+        self.starts = []
+
+    def sync(self, pages, first_page):
+        """Actualiza el mapa con las páginas actuales del documento."""
+        dirty = None
+        if first_page != self.first_page:
+            self.first_page = first_page
+            dirty = 0
+
+        n = len(pages)
+        if n < len(self.contents):
+            del self.titles[n:], self.contents[n:], self.counts[n:], self.starts[n:]
+
+        for i, page in enumerate(pages):
+            title = page.get("title", "Sin título")
+            content = page.get("content", "")
+            if i < len(self.contents):
+                self.titles[i] = title
+                if self.contents[i] == content:
+                    continue
+                self.contents[i] = content
+                self.counts[i] = estimate_pages(content)
+            else:
+                self.titles.append(title)
+                self.contents.append(content)
+                self.counts.append(estimate_pages(content))
+                self.starts.append(0)
+            if dirty is None:
+                dirty = i
+
+        if dirty is None or not n:
+            return
+        start = self.first_page if dirty == 0 else self.starts[dirty - 1] + self.counts[dirty - 1]
+        for i in range(dirty, n):
+            self.starts[i] = start
+            start += self.counts[i]
+
+    def entries(self):
+        """Lista de dicts [{ "title": "...", "start_page": N }]."""
+        return [
+            {"title": title, "start_page": start}
+            for title, start in zip(self.titles, self.starts)
+        ]
+
+
+# Un PageMap por documento (LRU)
+_PAGE_MAP_CACHE_SIZE = 256
+_page_maps = OrderedDict()
+_page_maps_lock = threading.Lock()
+
+
+def calculate_page_map(doc, page_counts=None, cover_pages=1, toc_pages=1):
     """
     Calcula en qué página comienza cada sección del documento.
     - doc: diccionario del documento
+    - page_counts: páginas reales de cada sección (modo exacto, medido con
+      WeasyPrint); si es None se usa estimate_pages
+    - cover_pages, toc_pages: páginas que ocupan la carátula y el índice
     Retorna: lista de dicts [{ "title": "...", "start_page": N }]
     """
     current_page = 1
 
-    # Carátula siempre ocupa exactamente 1 página
     if "caratula" in doc.get("sections", []):
-        current_page += 1
+        current_page += cover_pages
 
-    # Índice siempre ocupa exactamente 1 página
     if "indice" in doc.get("sections", []):
-        current_page += 1
+        current_page += toc_pages
+
+    if page_counts is None:
+        return _estimated_page_map(doc, current_page)
 
     page_map = []
-    for page in doc.get("pages", []):
-        title = page.get("title", "Sin título")
+    for page, pages_used in zip(doc.get("pages", []), page_counts):
         page_map.append({
-            "title": title,
+            "title": page.get("title", "Sin título"),
             "start_page": current_page,
         })
-        # Estimar cuántas páginas ocupa esta sección
-        content = page.get("content", "")
-        pages_used = estimate_pages(content)
         current_page += pages_used
 
     return page_map
+
+
+def _estimated_page_map(doc, first_page):
+    """Mapa estimado, reutilizando el PageMap del documento si existe."""
+    doc_id = doc.get("id")
+    with _page_maps_lock:
+        page_map = _page_maps.pop(doc_id, None) or PageMap()
+        _page_maps[doc_id] = page_map
+        while len(_page_maps) > _PAGE_MAP_CACHE_SIZE:
+            _page_maps.popitem(last=False)
+        page_map.sync(doc.get("pages", []), first_page)
+        return page_map.entries()
@@ -0,0 +1,206 @@
+"""
+Operaciones sobre las páginas de un documento, aplicadas en lote.
+- Todas las operaciones de un lote se aplican o ninguna (si una es
+  inválida se lanza InvalidOperation antes de escribir)
+- Copia al escribir: las páginas originales no se modifican, así otros
+  hilos que leen el documento nunca ven un lote a medias
+
+Operaciones (los índices se refieren al estado después de las anteriores):
+    { "op": "set", "index": i, "content"?: str, "title"?: str }
+    { "op": "patch", "index": i, "edits": [[inicio, fin, texto], ...], "base_hash"?: str }
+        reemplaza content[inicio:fin] por texto; las posiciones son del
+        contenido base y se cuentan en unidades UTF-16, como los índices
+        de un string de JavaScript (un emoji ocupa 2). Una posición que
+        parte un par sustituto, o un texto con un sustituto suelto, es
+        inválido. base_hash (content_hash del
+        contenido base) evita aplicar el diff sobre otro texto
+    { "op": "insert", "index": i, "page": { type, title, content, images } }
+        images: [{ "url": str, "caption"?: str }, ...]
+    { "op": "delete", "index": i }
+    { "op": "move", "from": i, "to": j }
+    { "op": "reorder_images", "index": i, "order": [2, 0, 1] }
+"""
+import hashlib
+
+MAX_OPS = 500
+
+
+class InvalidOperation(ValueError):
+    """Una operación del lote no se puede aplicar."""
+
+
+def content_hash(content):
+    """Hash corto del contenido de una página (para validar diffs)."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def apply_ops(pages, ops):
+    """
+    Aplica ops sobre una copia de pages.
+    Retorna: (nuevas_páginas, resultados) con un resultado corto por operación
+    Lanza InvalidOperation si alguna operación es inválida.
+    """
+    if not isinstance(ops, list) or not ops:
+        raise InvalidOperation("Se requiere una lista de operaciones")
+    if len(ops) > MAX_OPS:
+        raise InvalidOperation(f"Máximo {MAX_OPS} operaciones por lote")
+
+    pages = list(pages)
+    results = []
+    for n, op in enumerate(ops):
+        if not isinstance(op, dict):
+            raise InvalidOperation(f"Operación {n}: se esperaba un objeto")
+        handler = _HANDLERS.get(op.get("op"))
+        if handler is None:
+            raise InvalidOperation(f"Operación {n}: tipo desconocido {op.get('op')!r}")
+        try:
+            results.append(handler(pages, op))
+        except InvalidOperation as e:
+            raise InvalidOperation(f"Operación {n} ({op['op']}): {e}")
+    return pages, results
+
+
+def _index(pages, op, key="index", allow_end=False):
+    index = op.get(key)
+    limit = len(pages) + 1 if allow_end else len(pages)
+    if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < limit:
+        raise InvalidOperation(f"{key} fuera de rango: {index!r}")
+    return index
+
+
+def _string(op, key):
+    value = op.get(key)
+    if not isinstance(value, str):
+        raise InvalidOperation(f"{key} debe ser texto")
+    return _text(value, key)
+
+
+def _text(value, key):
+    """
+    Rechaza sustitutos sueltos ("\\ud83d" en el JSON): no se pueden
+    codificar en UTF-8, y el hash del contenido y el render fallarían.
+    """
+    try:
+        value.encode("utf-8")
+    except UnicodeEncodeError:
+        raise InvalidOperation(f"{key} tiene un carácter inválido (sustituto UTF-16 suelto)")
+    return value
+
+
+def _op_set(pages, op):
+    i = _index(pages, op)
+    page = dict(pages[i])
+    updated = []
+    for key in ("content", "title"):
+        if key in op:
+            page[key] = _string(op, key)
+            updated.append(key)
+    if not updated:
+        raise InvalidOperation("nada que actualizar (content o title)")
+    pages[i] = page
+    return {"index": i, "updated": updated}
+
+
+def _op_patch(pages, op):
+    i = _index(pages, op)
+    content = pages[i].get("content", "")
+    base_hash = op.get("base_hash")
+    if base_hash is not None and base_hash != content_hash(content):
+        raise InvalidOperation("el contenido base cambió")
+
+    edits = op.get("edits")
+    if not isinstance(edits, list) or not edits:
+        raise InvalidOperation("edits debe ser una lista no vacía")
+    # Se trabaja sobre los bytes UTF-16: cada unidad son 2 bytes
+    units = content.encode("utf-16-le")
+    length = len(units) // 2
+    parts = []
+    pos = 0
+    for edit in sorted(edits, key=_edit_start):
+        start, end, text = edit
+        if not pos <= start <= end <= length:
+            raise InvalidOperation(f"edición fuera de rango o superpuesta: {edit!r}")
+        if _splits_pair(units, start) or _splits_pair(units, end):
+            raise InvalidOperation(f"edición parte un carácter en dos: {edit!r}")
+        parts.append(units[2 * pos:2 * start])
+        parts.append(_text(text, "texto de la edición").encode("utf-16-le"))
+        pos = end
+    parts.append(units[2 * pos:])
+
+    # Las posiciones ya no parten pares y el texto es válido: el resultado decodifica
+    new_content = b"".join(parts).decode("utf-16-le")
+    pages[i] = dict(pages[i], content=new_content)
+    return {"index": i, "content_hash": content_hash(new_content)}
+
+
+def _splits_pair(units, offset):
+    """True si offset cae entre las dos mitades de un par sustituto (fuera del BMP)."""
+    if not 0 < offset < len(units) // 2:
+        return False
+    unit = int.from_bytes(units[2 * offset:2 * offset + 2], "little")
+    return 0xDC00 <= unit <= 0xDFFF
+
+
+def _edit_start(edit):
+    if not (isinstance(edit, list) and len(edit) == 3
+            and all(isinstance(x, int) and not isinstance(x, bool) for x in edit[:2])
+            and isinstance(edit[2], str)):
+        raise InvalidOperation(f"edición inválida: {edit!r}")
+    return edit[0]
+
+
+def _op_insert(pages, op):
+    i = _index(pages, op, allow_end=True)
+    page = op.get("page")
+    if not isinstance(page, dict) or not isinstance(page.get("images", []), list):
+        raise InvalidOperation("page debe ser un objeto con images como lista")
+    new_page = {
+        "type": _text(str(page.get("type", "contenido")), "type"),
+        "title": _text(str(page.get("title", "Sin título")), "title"),
+        "content": _text(str(page.get("content", "")), "content"),
+        "images": [_image(img) for img in page.get("images", [])],
+    }
+    pages.insert(i, new_page)
+    return {"index": i}
+
+
+def _image(img):
+    """Imagen de una página insertada: solo url y caption, ambos texto (los usa el renderer)."""
+    if not isinstance(img, dict) or not isinstance(img.get("url"), str) \
+            or not isinstance(img.get("caption", ""), str):
+        raise InvalidOperation(f"imagen inválida (se espera {{url, caption?}}): {img!r}")
+    return {"url": _text(img["url"], "url"), "caption": _text(img.get("caption", ""), "caption")}
+
+
+def _op_delete(pages, op):
+    i = _index(pages, op)
+    del pages[i]
+    return {"index": i}
+
+
+def _op_move(pages, op):
+    src = _index(pages, op, "from")
+    dst = _index(pages, op, "to")
+    pages.insert(dst, pages.pop(src))
+    return {"from": src, "to": dst}
+
+
+def _op_reorder_images(pages, op):
+    i = _index(pages, op)
+    images = pages[i].get("images", [])
+    order = op.get("order")
+    if not isinstance(order, list) or not all(isinstance(j, int) for j in order) \
+            or sorted(order) != list(range(len(images))):
+        raise InvalidOperation(f"order debe ser una permutación de 0..{len(images) - 1}")
+    pages[i] = dict(pages[i], images=[images[j] for j in order])
+    return {"index": i}
+
+
+_HANDLERS = {
+    "set": _op_set,
+    "patch": _op_patch,
+    "insert": _op_insert,
+    "delete": _op_delete,
+    "move": _op_move,
+    "reorder_images": _op_reorder_images,
+}
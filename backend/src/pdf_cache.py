@@ -0,0 +1,150 @@
+"""
+Caché de PDFs direccionada por contenido.
+- La clave es un hash del estado renderizable del documento
+- Los archivos viven en OUTPUT_DIR como tarea_<doc_id>_<clave>.pdf
+- Expulsión LRU (por fecha de último uso) limitada por bytes en disco
+- Single-flight: descargas simultáneas del mismo documento comparten
+  un solo render, también entre workers (flock sobre archivos de bloqueo)
+- get_pdf entrega el archivo ya abierto: si luego lo borra una mutación,
+  la expulsión o el janitor, la descarga en curso sigue leyendo el handle
+"""
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from .config import OUTPUT_DIR, PDF_CACHE_MAX_BYTES
+from .document_store import on_change
+from .pdf_service import RENDER_BUILD
+from .render_pool import render_pdf
+from .metrics import PDF_BYTES, stage
+from . import profiling
+
+# Campos que no afectan al PDF
+_VOLATILE_KEYS = ("created_at",)
+
+_LOCK_DIR = os.path.join(OUTPUT_DIR, ".locks")
+os.makedirs(_LOCK_DIR, exist_ok=True)
+
+# Locks por clave dentro del proceso
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def render_key(doc):
+    """Hash estable de todo lo que influye en el PDF, renderer incluido (sirve también de ETag)."""
+    state = {k: v for k, v in doc.items() if k not in _VOLATILE_KEYS}
+    state["_render_build"] = RENDER_BUILD
+    raw = json.dumps(state, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+def get_pdf(doc):
+    """
+    Retorna el PDF del documento abierto en binario, renderizándolo solo si no está en caché.
+    Retorna: (archivo, key); quien lo recibe lo cierra (send_file lo hace)
+    Propaga RenderBusy / RenderTimeout / RenderFailed del pool de render.
+    """
+    key = render_key(doc)
+    path = os.path.join(OUTPUT_DIR, f"tarea_{doc['id']}_{key}.pdf")
+    # Una descarga perfilada siempre renderiza, para que el perfil lo muestre
+    fresh = profiling.active()
+    if not fresh:
+        pdf = _open(path)
+        if pdf is not None:
+            return pdf, key
+
+    try:
+        with _key_lock(key), _file_lock(key):
+            # Otro hilo u otro worker pudo terminar el render mientras esperábamos
+            pdf = None if fresh else _open(path)
+            if pdf is not None:
+                return pdf, key
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with stage("pdf_render"):
+                    render_pdf(doc, tmp_path)
+                PDF_BYTES.observe(os.path.getsize(tmp_path))
+                # Se abre antes de publicarlo: un invalidate inmediato no lo quita de esta descarga
+                pdf = open(tmp_path, "rb")
+                os.replace(tmp_path, path)
+            except BaseException:
+                if pdf is not None:
+                    pdf.close()
+                raise
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+    _evict()
+    return pdf, key
+
+
+@on_change
+def invalidate(doc_id):
+    """Borra los PDFs en caché de un documento (se llama en cada mutación)."""
+    for path in glob.glob(os.path.join(OUTPUT_DIR, f"tarea_{glob.escape(doc_id)}_*.pdf")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _open(path):
+    """Abre el PDF y lo marca como usado recién (para LRU). Retorna None si no existe."""
+    try:
+        pdf = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    os.utime(pdf.fileno())
+    return pdf
+
+
+def _key_lock(key):
+    with _inflight_lock:
+        lock = _inflight.get(key)
+        if lock is None:
+            lock = _inflight[key] = threading.Lock()
+        return lock
+
+
+@contextmanager
+def _file_lock(key):
+    """flock exclusivo compartido entre procesos (256 archivos de bloqueo)."""
+    fd = os.open(os.path.join(_LOCK_DIR, f"{key[:2]}.lock"), os.O_CREAT | os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _evict():
+    """Borra los PDFs menos usados hasta quedar bajo PDF_CACHE_MAX_BYTES."""
+    entries = []
+    total = 0
+    for path in glob.glob(os.path.join(OUTPUT_DIR, "tarea_*.pdf")):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+
+    if total <= PDF_CACHE_MAX_BYTES:
+        return
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        if total <= PDF_CACHE_MAX_BYTES:
+            break
+
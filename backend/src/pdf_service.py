@@ -2,198 +2,296 @@
 Servicio de generación de PDF.
 - Construye HTML completo con todas las secciones
 - Convierte HTML a PDF usando WeasyPrint como librería
+- Render incremental: carátula, índice y cada sección se maquetan como
+  documentos separados, se guardan en caché (con tope de páginas
+  maquetadas, PDF_SECTION_CACHE_PAGES) y se unen en un solo PDF
+- El índice del PDF usa las páginas reales de la maquetación; el preview
+  usa la estimación instantánea de page_analyzer
+- La hoja de estilos se compila una vez (weasyprint.CSS) con una
+  FontConfiguration compartida; el HTML del PDF lleva solo el cuerpo
+- Las imágenes subidas se leen de UPLOAD_DIR con un url_fetcher propio
+- El HTML de carátula, índice y cada sección (fragmentos) se guarda en
+  caché por contenido: el preview completo es solo concatenar fragmentos
 """
+import hashlib
 import os
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from weasyprint import HTML
-from .config import OUTPUT_DIR
+from functools import lru_cache
+import weasyprint
+from weasyprint import CSS, HTML
+from weasyprint.text.fonts import FontConfiguration
+from .config import BUILD_ID, OUTPUT_DIR, PDF_INCREMENTAL, PDF_SECTION_CACHE_PAGES, PREVIEW_FRAGMENT_CACHE_SIZE
 from .page_analyzer import calculate_page_map
+from .asset_fetcher import ASSET_BASE_URL, LocalAssetFetcher
+from .metrics import stage
+
+
+# ─── Hoja de estilos del documento (carta, márgenes 2.5cm) ───
+STYLESHEET = """@page {
+    size: letter;
+    margin: 2.5cm;
+    @bottom-center {
+        content: "Página " counter(page);
+        font-size: 10pt;
+        color: #888;
+    }
+}
+body {
+    font-family: 'Segoe UI', Arial, Helvetica, sans-serif;
+    line-height: 1.8;
+    color: #222;
+    text-align: justify;
+    font-size: 12pt;
+}
+
+/* --- Carátula --- */
+.cover {
+    height: 90vh;
+    display: flex;
+    flex-direction: column;
+    justify-content: space-between;
+    align-items: center;
+    text-align: center;
+    border: 3px double #1a2332;
+    padding: 50px 40px;
+    page-break-after: always;
+}
+.cover-header {
+    margin-top: 20px;
+}
+.cover-header .uni-name {
+    font-size: 1.4em;
+    font-weight: bold;
+    color: #1a2332;
+    margin: 0;
+}
+.cover-header .uni-center {
+    font-size: 1.1em;
+    color: #333;
+    margin: 4px 0 0 0;
+}
+.cover-middle {
+    flex: 1;
+    display: flex;
+    flex-direction: column;
+    justify-content: center;
+}
+.cover-middle .carrera {
+    font-size: 1.05em;
+    color: #444;
+    margin-bottom: 8px;
+}
+.cover-middle .docente {
+    font-size: 0.95em;
+    color: #555;
+    margin-bottom: 6px;
+}
+.cover-middle .materia {
+    font-size: 1.1em;
+    font-weight: bold;
+    color: #333;
+    margin-bottom: 6px;
+}
+.cover-middle .semestre {
+    font-size: 0.95em;
+    color: #555;
+    margin-bottom: 30px;
+}
+.cover-middle .work-title {
+    font-size: 1.8em;
+    font-weight: bold;
+    color: #1a2332;
+    line-height: 1.3;
+    margin: 0;
+}
+.cover-footer {
+    margin-bottom: 20px;
+}
+.cover-footer p {
+    margin: 5px 0;
+    font-size: 1em;
+    color: #333;
+}
+
+/* --- Índice --- */
+.toc {
+    page-break-after: always;
+}
+.toc h2 {
+    color: #1a2332;
+    border-bottom: 2px solid #1a2332;
+    padding-bottom: 8px;
+    margin-bottom: 25px;
+}
+.toc table {
+    width: 100%;
+    border-collapse: collapse;
+}
+.toc td {
+    padding: 8px 4px;
+    border-bottom: 1px dotted #ccc;
+    font-size: 1.05em;
+}
+.toc td.toc-page {
+    text-align: right;
+    width: 50px;
+    font-weight: bold;
+    color: #1a2332;
+}
+
+/* --- Contenido --- */
+.page-section {
+    page-break-before: always;
+}
+.page-section:first-of-type {
+    page-break-before: auto;
+}
+h1, h2, h3 {
+    color: #1a2332;
+    page-break-after: avoid;
+}
+h2 {
+    border-bottom: 1px solid #ddd;
+    padding-bottom: 6px;
+    margin-top: 30px;
+}
+p {
+    margin: 12px 0;
+}
+
+/* --- Imágenes --- */
+.page-image {
+    text-align: center;
+    margin: 20px 0;
+}
+.page-image img {
+    max-width: 80%;
+    height: auto;
+    border: 1px solid #ddd;
+    border-radius: 4px;
+}
+.page-image .caption {
+    font-size: 0.9em;
+    color: #666;
+    font-style: italic;
+    margin-top: 8px;
+}
+
+/* --- Bibliografía --- */
+.bibliography p {
+    text-indent: -2em;
+    padding-left: 2em;
+    margin: 8px 0;
+}
+"""
 
 
 def build_document_html(doc):
     """
-    Construye el HTML completo del documento listo para PDF o preview.
+    Construye el HTML completo del documento (con estilos) para el preview.
     - doc: diccionario del documento con meta y pages
     Retorna: string HTML completo
     """
+    with stage("html_build"):
+        return _wrap_html(_build_body(doc, exact_toc=False))
+
+
+def _build_body(doc, exact_toc):
+    """
+    Construye el cuerpo HTML con todas las secciones.
+    - exact_toc: numerar el índice con páginas medidas por WeasyPrint
+      (para el PDF); si es False se usa la estimación (preview)
+    """
     sections_html = []
 
     # --- Carátula ---
     if "caratula" in doc.get("sections", []):
-        sections_html.append(_render_cover(doc))
+        sections_html.append(_cover_fragment(doc))
 
     # --- Índice con números de página reales ---
     if "indice" in doc.get("sections", []):
-        page_map = calculate_page_map(doc)
-        sections_html.append(_render_toc(page_map))
+        with stage("page_map"):
+            page_map = exact_page_map(doc) if exact_toc else calculate_page_map(doc)
+        sections_html.append(_toc_fragment(page_map))
 
     # --- Páginas de contenido ---
     for page in doc.get("pages", []):
-        sections_html.append(_render_page(page))
+        sections_html.append(_page_fragment(page))
+
+    return "\n".join(sections_html)
+
+
+def render_fragment(doc, part):
+    """
+    HTML de una sola parte del documento, sin envoltura ni estilos.
+    - part: "cover", "toc" o el índice (int) de una página
+    Retorna: string HTML o None si el documento no tiene esa parte
+    """
+    sections = doc.get("sections", [])
+    if part == "cover":
+        return _cover_fragment(doc) if "caratula" in sections else None
+    if part == "toc":
+        return _toc_fragment(calculate_page_map(doc)) if "indice" in sections else None
+    pages = doc.get("pages", [])
+    if isinstance(part, int) and 0 <= part < len(pages):
+        return _page_fragment(pages[part])
+    return None
+
+
+# ─── Caché de fragmentos HTML ───
+
+# La clave es una tupla con todo lo que usa el renderer: los str de Python
+# guardan su hash, así que buscar una página que no cambió es casi gratis
+_fragment_cache = OrderedDict()  # clave -> html
+_fragment_lock = threading.Lock()
+
+_COVER_FIELDS = (
+    "universidad", "centro", "carrera", "docente", "materia", "semestre",
+    "author", "carnet", "sede", "title", "date",
+)
 
-    body = "\n".join(sections_html)
 
+def _fragment(key, render):
+    """HTML de la caché para key, o render() guardado en la caché."""
+    with _fragment_lock:
+        html = _fragment_cache.get(key)
+        if html is not None:
+            _fragment_cache.move_to_end(key)
+            return html
+    html = render()
+    with _fragment_lock:
+        _fragment_cache[key] = html
+        while len(_fragment_cache) > PREVIEW_FRAGMENT_CACHE_SIZE:
+            _fragment_cache.popitem(last=False)
+    return html
+
+
+def _cover_fragment(doc):
+    key = ("cover",) + tuple(doc.get(field, "") for field in _COVER_FIELDS)
+    return _fragment(key, lambda: _render_cover(doc))
+
+
+def _toc_fragment(page_map):
+    key = ("toc",) + tuple((entry["title"], entry["start_page"]) for entry in page_map)
+    return _fragment(key, lambda: _render_toc(page_map))
+
+
+def _page_fragment(page):
+    images = tuple((img.get("url"), img.get("caption", "")) for img in page.get("images", []))
+    key = ("page", page.get("type"), page.get("title", ""), page.get("content", ""), images)
+    return _fragment(key, lambda: _render_page(page))
+
+
+def _wrap_html(body):
+    """Envuelve el cuerpo en un documento HTML completo con la hoja de estilos."""
     return f"""<!DOCTYPE html>
 <html lang="es">
 <head>
     <meta charset="UTF-8">
     <style>
-        @page {{
-            size: letter;
-            margin: 2.5cm;
-            @bottom-center {{
-                content: "Página " counter(page);
-                font-size: 10pt;
-                color: #888;
-            }}
-        }}
-        body {{
-            font-family: 'Segoe UI', Arial, Helvetica, sans-serif;
-            line-height: 1.8;
-            color: #222;
-            text-align: justify;
-            font-size: 12pt;
-        }}
-
-        /* --- Carátula --- */
-        .cover {{
-            height: 90vh;
-            display: flex;
-            flex-direction: column;
-            justify-content: space-between;
-            align-items: center;
-            text-align: center;
-            border: 3px double #1a2332;
-            padding: 50px 40px;
-            page-break-after: always;
-        }}
-        .cover-header {{
-            margin-top: 20px;
-        }}
-        .cover-header .uni-name {{
-            font-size: 1.4em;
-            font-weight: bold;
-            color: #1a2332;
-            margin: 0;
-        }}
-        .cover-header .uni-center {{
-            font-size: 1.1em;
-            color: #333;
-            margin: 4px 0 0 0;
-        }}
-        .cover-middle {{
-            flex: 1;
-            display: flex;
-            flex-direction: column;
-            justify-content: center;
-        }}
-        .cover-middle .carrera {{
-            font-size: 1.05em;
-            color: #444;
-            margin-bottom: 8px;
-        }}
-        .cover-middle .docente {{
-            font-size: 0.95em;
-            color: #555;
-            margin-bottom: 6px;
-        }}
-        .cover-middle .materia {{
-            font-size: 1.1em;
-            font-weight: bold;
-            color: #333;
-            margin-bottom: 6px;
-        }}
-        .cover-middle .semestre {{
-            font-size: 0.95em;
-            color: #555;
-            margin-bottom: 30px;
-        }}
-        .cover-middle .work-title {{
-            font-size: 1.8em;
-            font-weight: bold;
-            color: #1a2332;
-            line-height: 1.3;
-            margin: 0;
-        }}
-        .cover-footer {{
-            margin-bottom: 20px;
-        }}
-        .cover-footer p {{
-            margin: 5px 0;
-            font-size: 1em;
-            color: #333;
-        }}
-
-        /* --- Índice --- */
-        .toc {{
-            page-break-after: always;
-        }}
-        .toc h2 {{
-            color: #1a2332;
-            border-bottom: 2px solid #1a2332;
-            padding-bottom: 8px;
-            margin-bottom: 25px;
-        }}
-        .toc table {{
-            width: 100%;
-            border-collapse: collapse;
-        }}
-        .toc td {{
-            padding: 8px 4px;
-            border-bottom: 1px dotted #ccc;
-            font-size: 1.05em;
-        }}
-        .toc td.toc-page {{
-            text-align: right;
-            width: 50px;
-            font-weight: bold;
-            color: #1a2332;
-        }}
-
-        /* --- Contenido --- */
-        .page-section {{
-            page-break-before: always;
-        }}
-        .page-section:first-of-type {{
-            page-break-before: auto;
-        }}
-        h1, h2, h3 {{
-            color: #1a2332;
-            page-break-after: avoid;
-        }}
-        h2 {{
-            border-bottom: 1px solid #ddd;
-            padding-bottom: 6px;
-            margin-top: 30px;
-        }}
-        p {{
-            margin: 12px 0;
-        }}
-
-        /* --- Imágenes --- */
-        .page-image {{
-            text-align: center;
-            margin: 20px 0;
-        }}
-        .page-image img {{
-            max-width: 80%;
-            height: auto;
-            border: 1px solid #ddd;
-            border-radius: 4px;
-        }}
-        .page-image .caption {{
-            font-size: 0.9em;
-            color: #666;
-            font-style: italic;
-            margin-top: 8px;
-        }}
-
-        /* --- Bibliografía --- */
-        .bibliography p {{
-            text-indent: -2em;
-            padding-left: 2em;
-            margin: 8px 0;
-        }}
+{STYLESHEET}
     </style>
 </head>
 <body>
@@ -202,6 +300,17 @@ def build_document_html(doc):
 </html>"""
 
 
+def _bare_html(body):
+    """Documento solo con el cuerpo: los estilos van precompilados (_stylesheet)."""
+    return f"""<!DOCTYPE html>
+<html lang="es">
+<head><meta charset="UTF-8"></head>
+<body>
+{body}
+</body>
+</html>"""
+
+
 def _render_cover(doc):
     """Renderiza la carátula del documento con todos los datos universitarios."""
     universidad = doc.get("universidad", "")
@@ -290,16 +399,208 @@ def _render_page(page):
     </div>"""
 
 
-def generate_pdf(doc):
+def generate_pdf(doc, pdf_path=None):
     """
     Genera un archivo PDF del documento.
     - doc: diccionario del documento
+    - pdf_path: ruta de destino (por defecto un archivo nuevo en OUTPUT_DIR)
     Retorna: ruta absoluta al PDF generado
     """
-    html_content = build_document_html(doc)
-    filename = f"tarea_{doc['id']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    pdf_path = os.path.join(OUTPUT_DIR, filename)
+    if pdf_path is None:
+        filename = f"tarea_{doc['id']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+        pdf_path = os.path.join(OUTPUT_DIR, filename)
 
-    HTML(string=html_content).write_pdf(pdf_path)
+    if PDF_INCREMENTAL:
+        _render_incremental(doc).write_pdf(pdf_path)
+    else:
+        _html(_build_body(doc, exact_toc=True)).write_pdf(
+            pdf_path, stylesheets=[_stylesheet], font_config=_font_config,
+        )
 
     return pdf_path
+
+
+# ─── Render incremental por sección ───
+
+# Cada .page-section empieza con page-break-before, así que las secciones no
+# dependen entre sí salvo por el contador de página. Se maqueta cada parte
+# por separado empezando en su número de página, y el resultado se guarda
+# con clave (html de la parte, página inicial).
+_PART_CSS = """
+.cover, .toc {
+    page-break-after: auto;
+}
+@page :first {
+    counter-reset: page %d;
+}
+"""
+
+# Hoja de estilos y fuentes compiladas una vez por proceso
+_font_config = FontConfiguration()
+_stylesheet = CSS(string=STYLESHEET, font_config=_font_config)
+
+
+def _render_build():
+    """
+    Huella del renderer: hojas de estilo, código que arma el HTML y el PDF
+    (este módulo y page_analyzer), versión de WeasyPrint y BUILD_ID.
+    Va en los ETag del preview y en la clave de la caché de PDFs: tras un
+    despliegue que cambia el renderer no se responde 304 con lo anterior.
+    """
+    digest = hashlib.sha256()
+    for text in (STYLESHEET, _PART_CSS, weasyprint.__version__, BUILD_ID):
+        digest.update(text.encode("utf-8"))
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ("pdf_service.py", "page_analyzer.py"):
+        with open(os.path.join(here, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+RENDER_BUILD = _render_build()
+
+
+@lru_cache(maxsize=512)
+def _part_stylesheet(start_page):
+    """Hoja extra de una parte que empieza en start_page (compilada y reutilizada)."""
+    return CSS(string=_PART_CSS % start_page, font_config=_font_config)
+
+
+def _layout(body, *extra_stylesheets):
+    """Maqueta un cuerpo HTML con las hojas precompiladas."""
+    return _html(body).render(
+        stylesheets=[_stylesheet, *extra_stylesheets], font_config=_font_config,
+    )
+
+
+def _html(body):
+    """
+    HTML de WeasyPrint para un cuerpo: las imágenes /uploads/... se
+    resuelven contra ASSET_BASE_URL y se leen de disco con LocalAssetFetcher.
+    """
+    return HTML(
+        string=_bare_html(body),
+        base_url=ASSET_BASE_URL,
+        url_fetcher=LocalAssetFetcher(),
+    )
+
+
+def warm_up():
+    """
+    Render de calentamiento: carga fuentes (fontconfig), Pango y la hoja
+    de estilos antes de la primera petición real del worker.
+    """
+    _layout(_render_page({"title": "Calentamiento", "content": "<p>Tareinador</p>"}))
+
+
+_section_cache = OrderedDict()  # clave -> documento WeasyPrint maquetado
+_section_cache_lock = threading.Lock()
+_section_cache_pages = 0        # páginas retenidas en _section_cache (tope PDF_SECTION_CACHE_PAGES)
+
+# Páginas reales de cada parte, por hash de su HTML (no depende de la página inicial)
+_PAGE_COUNT_CACHE_SIZE = 10000
+_page_counts = OrderedDict()
+
+
+def exact_page_map(doc):
+    """
+    Mapa de páginas con el número real de páginas de cada sección.
+    Cada sección se mide una sola vez por contenido; después es un lookup.
+    """
+    sections = doc.get("sections", [])
+    cover_pages = _page_count(_cover_fragment(doc)) if "caratula" in sections else 1
+    counts = [_page_count(_page_fragment(page)) for page in doc.get("pages", [])]
+
+    toc_pages = 1
+    for _ in range(3):
+        page_map = calculate_page_map(doc, counts, cover_pages, toc_pages)
+        if "indice" not in sections:
+            break
+        measured = _page_count(_toc_fragment(page_map))
+        if measured == toc_pages:
+            break
+        toc_pages = measured
+    return page_map
+
+
+def _page_count(part_html):
+    """Páginas que ocupa una parte; la maqueta solo si no está memorizada."""
+    key = hashlib.sha256(part_html.encode("utf-8")).hexdigest()
+    with _section_cache_lock:
+        count = _page_counts.get(key)
+        if count is not None:
+            _page_counts.move_to_end(key)
+            return count
+    return len(_render_part(part_html, 1).pages)
+
+
+def _render_incremental(doc):
+    """
+    Maqueta cada parte (o la toma de la caché) y las une en un documento.
+    Editar una sección solo vuelve a maquetar esa sección, más las
+    siguientes si cambió su número de páginas (su página inicial se corre).
+    El índice usa las páginas reales medidas en esta misma maquetación.
+    Retorna: documento WeasyPrint listo para write_pdf
+    """
+    sections = doc.get("sections", [])
+    cover = _render_part(_cover_fragment(doc), 1) if "caratula" in sections else None
+    cover_pages = len(cover.pages) if cover else 0
+    section_html = [_page_fragment(page) for page in doc.get("pages", [])]
+
+    # Se supone un índice de 1 página; si al maquetarlo ocupa más, se
+    # corren las secciones y se repite (converge en 1-2 vueltas)
+    toc_pages = 1 if "indice" in sections else 0
+    for _ in range(3):
+        start_page = 1 + cover_pages + toc_pages
+        rendered = []
+        for html in section_html:
+            part = _render_part(html, start_page)
+            rendered.append(part)
+            start_page += len(part.pages)
+
+        if "indice" not in sections:
+            toc = None
+            break
+        page_map = calculate_page_map(
+            doc,
+            page_counts=[len(part.pages) for part in rendered],
+            cover_pages=cover_pages,
+            toc_pages=toc_pages,
+        )
+        toc = _render_part(_toc_fragment(page_map), 1 + cover_pages)
+        if len(toc.pages) == toc_pages:
+            break
+        toc_pages = len(toc.pages)
+
+    parts = [part for part in (cover, toc) if part is not None] + rendered
+    if not parts:
+        return _layout("")
+    all_pages = [page for part in parts for page in part.pages]
+    return parts[0].copy(all_pages)
+
+
+def _render_part(part_html, start_page):
+    """Maqueta una parte empezando en start_page, usando la caché si es posible."""
+    key = hashlib.sha256(f"{start_page}:{part_html}".encode("utf-8")).hexdigest()
+    with _section_cache_lock:
+        cached = _section_cache.get(key)
+        if cached is not None:
+            _section_cache.move_to_end(key)
+            return cached
+
+    part = _layout(part_html, _part_stylesheet(start_page))
+
+    global _section_cache_pages
+    with _section_cache_lock:
+        # Una parte más grande que el tope no se guarda: solo su número de páginas
+        if len(part.pages) <= PDF_SECTION_CACHE_PAGES and key not in _section_cache:
+            _section_cache[key] = part
+            _section_cache_pages += len(part.pages)
+            while _section_cache_pages > PDF_SECTION_CACHE_PAGES:
+                _, evicted = _section_cache.popitem(last=False)
+                _section_cache_pages -= len(evicted.pages)
+        count_key = hashlib.sha256(part_html.encode("utf-8")).hexdigest()
+        _page_counts[count_key] = len(part.pages)
+        while len(_page_counts) > _PAGE_COUNT_CACHE_SIZE:
+            _page_counts.popitem(last=False)
+    return part
@@ -0,0 +1,202 @@
+"""
+Perfilado bajo demanda de peticiones lentas.
+- Solo con PROFILING_ENABLED=1 y PROFILING_TOKEN definido; cada petición
+  se perfila si trae el header X-Profile-Token o ?profile=<token>
+- El handler corre bajo cProfile. El perfil (.prof, se abre con pstats o
+  snakeviz) se guarda en PROFILE_DIR junto a un .json con ruta, request
+  id, doc id, duración y las funciones más costosas
+- Se conservan los PROFILE_MAX_FILES perfiles más recientes
+- Desactivado no registra ningún hook: no agrega costo a las peticiones
+
+Una descarga perfilada renderiza el PDF en el hilo de la petición y sin
+usar la caché, para que el perfil muestre a WeasyPrint. Una generación
+perfilada perfila además el trabajo en segundo plano.
+"""
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from flask import g, jsonify, request, send_file
+from .config import PROFILING_ENABLED, PROFILING_TOKEN, PROFILE_DIR, PROFILE_MAX_FILES
+
+ENABLED = PROFILING_ENABLED and bool(PROFILING_TOKEN)
+_TOP_FUNCTIONS = 25
+
+_local = threading.local()
+_prune_lock = threading.Lock()
+# cProfile no admite dos perfiles activos a la vez (Python 3.12+): uno por proceso
+_profile_lock = threading.Lock()
+
+
+def active():
+    """True si el hilo actual está siendo perfilado."""
+    return getattr(_local, "active", False)
+
+
+def requested():
+    """True si la petición actual trae un token de perfilado válido."""
+    if not ENABLED:
+        return False
+    token = request.headers.get("X-Profile-Token") or request.args.get("profile") or ""
+    return hmac.compare_digest(token.encode(), PROFILING_TOKEN.encode())
+
+
+@contextmanager
+def capture(route, request_id, doc_id=None, wait=0):
+    """
+    Perfila el bloque en el hilo actual y guarda el resultado en PROFILE_DIR.
+    Si ya hay otro perfil en curso espera hasta wait segundos; si no se
+    libera, el bloque corre sin perfilar.
+    """
+    acquired = _profile_lock.acquire(timeout=wait) if wait else _profile_lock.acquire(blocking=False)
+    if not acquired:
+        yield
+        return
+    profiler = cProfile.Profile()
+    _local.active = True
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _local.active = False
+        _profile_lock.release()
+        _save(profiler, route, request_id, doc_id, (time.perf_counter() - start) * 1000)
+
+
+def wrap(fn, route, request_id, doc_id=None):
+    """
+    fn envuelta para perfilarla en otro hilo (p. ej. un trabajo de la cola).
+    Espera a que termine el perfil de la petición que la encoló.
+    """
+    def profiled(*args, **kwargs):
+        with capture(route, request_id, doc_id, wait=30):
+            return fn(*args, **kwargs)
+    return profiled
+
+
+def _save(profiler, route, request_id, doc_id, duration_ms):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{time.time():.3f}_{_slug(route)}_{request_id}"
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f"{name}.prof"))
+
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(_TOP_FUNCTIONS)
+    meta = {
+        "name": name,
+        "route": route,
+        "request_id": request_id,
+        "doc_id": doc_id,
+        "created_at": time.time(),
+        "duration_ms": round(duration_ms, 1),
+        "summary": out.getvalue(),
+    }
+    with open(os.path.join(PROFILE_DIR, f"{name}.json"), "w") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    _prune()
+
+
+def _slug(route):
+    return "".join(ch if ch.isalnum() else "-" for ch in route).strip("-") or "root"
+
+
+def _prune():
+    """Borra los perfiles más viejos por encima de PROFILE_MAX_FILES."""
+    with _prune_lock:
+        names = sorted(f[:-5] for f in os.listdir(PROFILE_DIR) if f.endswith(".json"))
+        for name in names[:max(0, len(names) - PROFILE_MAX_FILES)]:
+            for ext in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(PROFILE_DIR, name + ext))
+                except FileNotFoundError:
+                    pass
+
+
+def list_profiles(route=None, limit=20):
+    """Metadata de los perfiles más recientes, opcionalmente de una ruta."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, filename)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if route and not meta["route"].startswith(route):
+            continue
+        meta.pop("summary", None)
+        profiles.append(meta)
+        if len(profiles) >= limit:
+            break
+    return profiles
+
+
+# ─── Integración con Flask ───
+
+def init_app(app):
+    """Registra los hooks y las rutas de perfilado solo si está habilitado."""
+    if not ENABLED:
+        return
+
+    @app.before_request
+    def _start_profile():
+        if request.endpoint in ("api_profiles", "api_profile") or not requested():
+            return
+        g.profile_request_id = uuid.uuid4().hex[:12]
+        g.profile_doc_id = _doc_id()
+        g.profile_capture = capture(
+            request.url_rule.rule if request.url_rule else request.path,
+            g.profile_request_id,
+            g.profile_doc_id,
+        )
+        g.profile_capture.__enter__()
+
+    @app.after_request
+    def _profile_header(response):
+        if "profile_request_id" in g:
+            response.headers["X-Profile-Id"] = g.profile_request_id
+        return response
+
+    @app.teardown_request
+    def _stop_profile(exc):
+        ctx = g.pop("profile_capture", None)
+        if ctx is not None:
+            ctx.__exit__(None, None, None)
+
+    @app.route("/api/profiles")
+    def api_profiles():
+        """Perfiles recientes. Query: route (prefijo, p. ej. /api/download), limit."""
+        if not requested():
+            return jsonify({"error": "No autorizado"}), 403
+        limit = request.args.get("limit", 20, type=int)
+        return jsonify(list_profiles(request.args.get("route"), limit))
+
+    @app.route("/api/profiles/<name>")
+    def api_profile(name):
+        """El .prof de un perfil, o su resumen en texto con ?format=text."""
+        if not requested():
+            return jsonify({"error": "No autorizado"}), 403
+        base = os.path.join(PROFILE_DIR, os.path.basename(name))
+        if not os.path.exists(f"{base}.json"):
+            return jsonify({"error": "Perfil no encontrado"}), 404
+        if request.args.get("format") == "text":
+            with open(f"{base}.json") as f:
+                return json.load(f)["summary"], 200, {"Content-Type": "text/plain; charset=utf-8"}
+        return send_file(f"{base}.prof", as_attachment=True, download_name=f"{name}.prof")
+
+
+def _doc_id():
+    doc_id = (request.view_args or {}).get("doc_id")
+    if doc_id is None and request.is_json:
+        doc_id = (request.get_json(silent=True) or {}).get("doc_id")
+    return doc_id
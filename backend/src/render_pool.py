@@ -0,0 +1,223 @@
+"""
+Pool de procesos para renderizar PDFs.
+- WeasyPrint corre fuera del worker de gunicorn, en RENDER_WORKERS procesos
+- Cada render tiene un timeout de reloj (RENDER_TIMEOUT) y cada proceso
+  un límite de memoria virtual (RENDER_MEMORY_MB)
+- Contrapresión: si ya hay RENDER_WORKERS + RENDER_QUEUE_MAX renders en
+  curso o en espera, se rechaza con RenderBusy (la ruta responde 503)
+- Afinidad: cada proceso es un executor propio y un documento va siempre
+  al mismo (hash del doc_id), así su caché de secciones maquetadas
+  (pdf_service, render incremental) sirve en el próximo render. A cambio,
+  dos documentos del mismo proceso se esperan aunque otro esté libre
+- Un render que no termina ni con la alarma retiene su turno hasta que
+  su proceso se mata y se reemplaza: el tope de concurrencia es real
+"""
+import multiprocessing
+import resource
+import signal
+import threading
+import time
+import zlib
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from . import profiling
+from .config import (
+    RENDER_WORKERS, RENDER_QUEUE_MAX, RENDER_TIMEOUT, RENDER_MEMORY_MB, PDF_WARMUP,
+)
+
+
+class RenderBusy(Exception):
+    """El pool está lleno; el cliente debe reintentar más tarde."""
+
+
+class RenderTimeout(Exception):
+    """El render superó RENDER_TIMEOUT."""
+
+
+class RenderFailed(Exception):
+    """El render falló (error de WeasyPrint, memoria agotada, proceso caído)."""
+
+
+_shards = [None] * max(0, RENDER_WORKERS)  # un executor de un proceso por posición
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(1, RENDER_WORKERS) + RENDER_QUEUE_MAX)
+
+# Contadores del proceso (se exponen en /api/render/stats)
+_stats_lock = threading.Lock()
+_stats = {
+    "in_flight": 0,
+    "completed": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "rejected": 0,
+    "total_render_ms": 0.0,
+}
+
+
+# ─── Lado del proceso de render ───
+
+def _init_worker():
+    """Inicializa cada proceso del pool: límite de memoria y calentamiento."""
+    if RENDER_MEMORY_MB > 0:
+        limit = RENDER_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    signal.signal(signal.SIGALRM, _on_alarm)
+    if PDF_WARMUP:
+        from .pdf_service import warm_up
+        warm_up()
+
+
+def _on_alarm(signum, frame):
+    raise RenderTimeout()
+
+
+def _render_task(doc, pdf_path):
+    """Corre dentro del proceso del pool con una alarma de reloj."""
+    from .pdf_service import generate_pdf
+
+    start = time.perf_counter()
+    signal.alarm(RENDER_TIMEOUT)
+    try:
+        generate_pdf(doc, pdf_path)
+    finally:
+        signal.alarm(0)
+    return (time.perf_counter() - start) * 1000
+
+
+# ─── Lado del worker web ───
+
+def _shard_index(doc_id):
+    """Proceso fijo para un documento (crc32: estable entre workers y reinicios)."""
+    return zlib.crc32(str(doc_id).encode("utf-8")) % len(_shards)
+
+
+def _get_shard(index):
+    with _pool_lock:
+        if _shards[index] is None:
+            _shards[index] = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return _shards[index]
+
+
+def _recycle(index, pool):
+    """
+    Descarta el proceso de una posición (roto, o colgado tras un timeout)
+    y lo mata; el próximo render de esa posición levanta uno nuevo.
+    Sus renders en curso terminan con BrokenProcessPool y sueltan su turno.
+    """
+    with _pool_lock:
+        if _shards[index] is not pool:
+            return
+        _shards[index] = None
+    # ProcessPoolExecutor no expone sus procesos; _processes es pid -> Process
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _ping():
+    return True
+
+
+def start():
+    """Levanta los procesos por adelantado para no pagar el arranque en la primera descarga."""
+    for index in range(len(_shards)):
+        _get_shard(index).submit(_ping)
+
+
+def render_pdf(doc, pdf_path):
+    """
+    Renderiza el documento en pdf_path usando el proceso que le corresponde.
+    Lanza RenderBusy, RenderTimeout o RenderFailed.
+    """
+    # Perfilando: render en este hilo para que cProfile vea a WeasyPrint
+    if RENDER_WORKERS <= 0 or profiling.active():
+        from .pdf_service import generate_pdf
+        generate_pdf(doc, pdf_path)
+        return pdf_path
+
+    if not _slots.acquire(blocking=False):
+        with _stats_lock:
+            _stats["rejected"] += 1
+        raise RenderBusy()
+
+    with _stats_lock:
+        _stats["in_flight"] += 1
+    index = _shard_index(doc["id"])
+    try:
+        pool = _get_shard(index)
+        future = pool.submit(_render_task, doc, pdf_path)
+    except BrokenProcessPool:
+        _release()
+        _recycle(index, pool)
+        _count("failed")
+        raise RenderFailed("el proceso de render terminó inesperadamente")
+    except BaseException:
+        _release()
+        raise
+    # El turno se suelta cuando el render termina de verdad (o se cancela en
+    # la cola, o muere su proceso), no cuando esta petición deja de esperar
+    future.add_done_callback(lambda _: _release())
+
+    try:
+        # Margen sobre el timeout del proceso por el tiempo en cola
+        elapsed_ms = future.result(timeout=RENDER_TIMEOUT * 2)
+    except FutureTimeout:
+        if not future.cancel():
+            # Ya corría y ni la alarma lo cortó: se mata su proceso
+            _recycle(index, pool)
+        _count("timeouts")
+        raise RenderTimeout()
+    except RenderTimeout:
+        _count("timeouts")
+        raise
+    except (BrokenProcessPool, CancelledError):
+        _recycle(index, pool)
+        _count("failed")
+        raise RenderFailed("el proceso de render terminó inesperadamente")
+    except MemoryError:
+        _count("failed")
+        raise RenderFailed("memoria insuficiente para renderizar el documento")
+    except Exception as e:
+        _count("failed")
+        raise RenderFailed(str(e))
+
+    with _stats_lock:
+        _stats["completed"] += 1
+        _stats["total_render_ms"] += elapsed_ms
+    return pdf_path
+
+
+def _release():
+    with _stats_lock:
+        _stats["in_flight"] -= 1
+    _slots.release()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def pool_stats():
+    """Utilización y profundidad de cola del pool de este worker."""
+    with _stats_lock:
+        stats = dict(_stats)
+    workers = max(0, RENDER_WORKERS)
+    completed = stats["completed"]
+    return {
+        "workers": workers,
+        "max_queue": RENDER_QUEUE_MAX,
+        "in_flight": stats["in_flight"],
+        "busy": min(stats["in_flight"], workers),
+        "queued": max(0, stats["in_flight"] - workers),
+        "utilization": round(min(stats["in_flight"], workers) / workers, 2) if workers else None,
+        "completed": completed,
+        "failed": stats["failed"],
+        "timeouts": stats["timeouts"],
+        "rejected": stats["rejected"],
+        "avg_render_ms": round(stats["total_render_ms"] / completed, 1) if completed else None,
+    }
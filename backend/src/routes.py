@@ -3,44 +3,111 @@ Rutas de la API REST.
 - Endpoints para generación, edición, preview y descarga
 - Manejo de subida de imágenes
 """
-import os
-import uuid
-from flask import Blueprint, request, jsonify, send_file
+import asyncio
+import hashlib
+import json
+from flask import Blueprint, Response, g, request, jsonify, send_file, stream_with_context
 from .document_store import (
-    create_document, save_document, get_document,
+    create_document, save_document, get_document, get_document_versioned, append_page,
     update_page, add_image_to_page, remove_image_from_page,
+    apply_page_ops, VersionConflict, store_stats,
 )
-from .gemini_service import generate_document, edit_section
-from .pdf_service import build_document_html, generate_pdf
-from .config import UPLOAD_DIR
+from .page_ops import InvalidOperation
+from .http_cache import document_etag, versioned_response, http_cache_stats
+from .gemini_service import (
+    generate_document, stream_document, edit_section, client as gemini_client,
+    generate_document_async, edit_section_async,
+)
+from .config import GEMINI_ASYNC, MAX_SECTION_PAGES
+from . import aio_runner
+from .pdf_service import build_document_html, render_fragment, STYLESHEET, RENDER_BUILD
+from .pdf_cache import get_pdf, render_key
+from .render_pool import RenderBusy, RenderTimeout, RenderFailed, pool_stats
+from .image_service import ingest_image, ingest_stats, InvalidImage
+from .janitor import janitor_stats
+from .gemini_cache import cache_stats as gemini_cache_stats
+from .json_stream import parse_stats
+from . import profiling
+from .job_queue import submit_job, job_status, queue_stats, QueueFull
 
 api = Blueprint("api", __name__)
 
 
+@api.errorhandler(VersionConflict)
+def _version_conflict(e):
+    """El cliente editó una versión vieja: debe recargar el documento."""
+    return jsonify({"error": "El documento cambió, recarga antes de guardar", "version": e.current}), 409
+
+
+def _client_version(value):
+    """Versión enviada por el cliente (int) o None; ValueError si es inválida."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(value)
+    return int(value)
+
+
 # ─── Generar documento con IA ───
 @api.route("/api/generate", methods=["POST"])
 def api_generate():
     """
-    Recibe la configuración del documento y genera el contenido con Gemini.
+    Recibe la configuración del documento y encola la generación con Gemini.
+    Retorna 202 con { job_id, doc_id }; el progreso se consulta en /api/jobs/<job_id>.
     Body JSON: { title, author, carnet, includeCaratula, includeIndice,
-                 sections: [{ name, description, pages }] }
+                 sections: [{ name, description, pages }], cache? }
     """
     data = request.get_json()
     if not data:
         return jsonify({"error": "Se requieren datos JSON"}), 400
 
+    try:
+        doc, sections = _new_document(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    doc_id = doc["id"]
+
+    # Guardar el documento vacío para que el doc_id exista desde ya
+    save_document(doc_id, doc)
+
+    # Encolar la generación con Gemini y responder de inmediato.
+    # En modo async corre en el event loop (cProfile no sigue corrutinas: sin perfil)
+    run = _run_generation_async if GEMINI_ASYNC else _run_generation
+    if "profile_request_id" in g and not GEMINI_ASYNC:
+        run = profiling.wrap(run, "/api/generate#job", g.profile_request_id, doc_id)
+    try:
+        job = submit_job(
+            "generate", run, doc, sections, bool(data.get("cache")), doc_id=doc_id,
+        )
+    except QueueFull:
+        return jsonify({"error": "Demasiadas generaciones en curso, intenta en un momento"}), 503, \
+            {"Retry-After": "10"}
+
+    return jsonify({
+        "job_id": job["id"],
+        "doc_id": doc_id,
+        "status": job["status"],
+    }), 202
+
+
+def _new_document(data):
+    """
+    Crea el documento (sin páginas) a partir del body de /api/generate.
+    Retorna: (doc, sections)
+    Lanza ValueError (400) si las secciones son inválidas.
+    """
     title = data.get("title", "Sin título")
     author = data.get("author", "Estudiante")
     carnet = data.get("carnet", "")
     include_caratula = data.get("includeCaratula", True)
     include_indice = data.get("includeIndice", True)
-    sections = data.get("sections", [])
+    sections = _sections(data.get("sections", []))
 
-    # Crear documento en el store
+    # Crear documento (se guarda en el store al encolar la generación)
     section_ids = ["caratula"] if include_caratula else []
     if include_indice:
         section_ids.append("indice")
-    doc_id, doc = create_document(title, author, carnet, section_ids)
+    _, doc = create_document(title, author, carnet, section_ids)
     doc["includeCaratula"] = include_caratula
     doc["includeIndice"] = include_indice
 
@@ -53,33 +120,161 @@ def api_generate():
     doc["semestre"] = data.get("semestre", "")
     doc["sede"] = data.get("sede", "")
 
-    # Generar contenido con Gemini
-    pages = generate_document(title, sections, author, carnet)
+    return doc, sections
+
+
+def _sections(sections):
+    """
+    Secciones del body con pages validado: entero entre 1 y MAX_SECTION_PAGES.
+    Con generación en paralelo cada página es una llamada a Gemini.
+    """
+    if not isinstance(sections, list) or not all(isinstance(sec, dict) for sec in sections):
+        raise ValueError("sections debe ser una lista de objetos")
+    result = []
+    for i, sec in enumerate(sections, 1):
+        pages = sec.get("pages")
+        if pages is None or pages == "":
+            pages = 1
+        elif isinstance(pages, str) and pages.isascii() and pages.isdigit():
+            pages = int(pages)
+        if isinstance(pages, bool) or not isinstance(pages, int) \
+                or not 1 <= pages <= MAX_SECTION_PAGES:
+            raise ValueError(f"Sección {i}: pages debe ser un entero entre 1 y {MAX_SECTION_PAGES}")
+        result.append(dict(sec, pages=pages))
+    return result
+
+
+# ─── Generar documento con streaming (SSE) ───
+@api.route("/api/generate/stream", methods=["POST"])
+def api_generate_stream():
+    """
+    Igual que /api/generate pero responde con Server-Sent Events:
+    - event: doc   → { doc_id }
+    - event: page  → { index, page } por cada página apenas está completa
+    - event: done  → { doc_id, total_pages }
+    - event: error → { error }
+    Cada página se agrega al documento guardado en cuanto llega.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Se requieren datos JSON"}), 400
+
+    try:
+        doc, sections = _new_document(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    doc_id = doc["id"]
+    save_document(doc_id, doc)
+
+    def events():
+        yield _sse("doc", {"doc_id": doc_id})
+        total = 0
+        try:
+            for page in stream_document(doc["title"], sections, doc["author"], doc["carnet"]):
+                page.setdefault("images", [])
+                index = append_page(doc_id, page)
+                total += 1
+                yield _sse("page", {"index": index, "page": page})
+        except Exception as e:
+            yield _sse("error", {"error": f"Error al generar el contenido: {e}"})
+            return
+        if total == 0:
+            yield _sse("error", {"error": "La respuesta de Gemini no contenía páginas"})
+            return
+        yield _sse("done", {"doc_id": doc_id, "total_pages": total})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _sse(event, payload):
+    """Formatea un evento SSE."""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _run_generation(doc, sections, use_cache=False):
+    """
+    Trabajo en segundo plano: genera el contenido y lo guarda en el documento.
+    Retorna None si tuvo éxito o un mensaje de error.
+    """
+    pages = generate_document(
+        doc["title"], sections, doc["author"], doc["carnet"], use_cache=use_cache,
+    )
+    return _save_generated(doc, pages)
+
+
+async def _run_generation_async(doc, sections, use_cache=False):
+    """Igual que _run_generation con client.aio; el guardado (SQLite) va en un hilo."""
+    pages = await generate_document_async(
+        doc["title"], sections, doc["author"], doc["carnet"], use_cache=use_cache,
+    )
+    return await asyncio.to_thread(_save_generated, doc, pages)
 
+
+def _save_generated(doc, pages):
+    """Guarda las páginas generadas. Retorna None o el mensaje de error."""
     # Agregar lista de imágenes vacía a cada página
     for page in pages:
         if "images" not in page:
             page["images"] = []
 
-    doc["pages"] = pages
-    save_document(doc_id, doc)
+    doc = dict(doc, pages=pages)
+    save_document(doc["id"], doc)
+
+    if len(pages) == 1 and pages[0].get("type") == "error":
+        return pages[0]["content"]
+    return None
 
-    return jsonify({
-        "doc_id": doc_id,
-        "title": title,
-        "pages": pages,
-        "total_pages": len(pages),
-    })
+
+# ─── Estado de trabajos en segundo plano ───
+@api.route("/api/jobs/<job_id>")
+def api_job_status(job_id):
+    """Retorna el estado de un trabajo: queued, running, done o failed."""
+    job = job_status(job_id)
+    if not job:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(job)
+
+
+@api.route("/api/jobs/stats")
+def api_job_stats():
+    """Profundidad de cola y tiempos de los trabajos de este worker."""
+    return jsonify(queue_stats())
 
 
 # ─── Obtener documento ───
 @api.route("/api/document/<doc_id>")
 def api_get_document(doc_id):
-    """Retorna el documento completo."""
-    doc = get_document(doc_id)
+    """
+    Retorna el documento completo.
+    - ETag por versión: responde 304 si el cliente ya la tiene (If-None-Match)
+    - La versión va en X-Document-Version (para /api/pages/batch)
+    """
+    doc, version = get_document_versioned(doc_id)
     if not doc:
         return jsonify({"error": "Documento no encontrado"}), 404
-    return jsonify(doc)
+    response = versioned_response(
+        document_etag(doc_id, version, "document"),
+        lambda: json.dumps(doc, ensure_ascii=False),
+        "application/json",
+    )
+    response.headers["X-Document-Version"] = str(version)
+    return response
+
+
+@api.route("/api/store/stats")
+def api_store_stats():
+    """Tamaño del store, aciertos y expulsiones de la memoria de este worker."""
+    return jsonify(store_stats())
+
+
+@api.route("/api/http/cache/stats")
+def api_http_cache_stats():
+    """Respuestas 304 y compresión de /api/document y /api/preview en este worker."""
+    return jsonify(http_cache_stats())
 
 
 # ─── Editar una página con IA ───
@@ -87,76 +282,211 @@ def api_get_document(doc_id):
 def api_edit_page():
     """
     Edita una página usando instrucciones en lenguaje natural.
-    Body JSON: { doc_id, page_index, instructions }
+    Body JSON: { doc_id, page_index, instructions, cache?, version? }
+    - Responde 409 si el documento cambió desde version, o mientras
+      Gemini respondía (la edición no pisa el cambio del otro cliente)
     """
     data = request.get_json()
     doc_id = data.get("doc_id")
     page_index = data.get("page_index", 0)
     instructions = data.get("instructions", "")
+    try:
+        client_version = _client_version(data.get("version"))
+    except ValueError:
+        return jsonify({"error": "version debe ser un entero"}), 400
 
-    doc = get_document(doc_id)
+    doc, version = get_document_versioned(doc_id)
     if not doc:
         return jsonify({"error": "Documento no encontrado"}), 404
-    if page_index >= len(doc["pages"]):
+    if client_version is not None and client_version != version:
+        raise VersionConflict(version)
+    if not 0 <= page_index < len(doc["pages"]):
         return jsonify({"error": "Página no encontrada"}), 404
 
     current_content = doc["pages"][page_index]["content"]
-    new_content = edit_section(current_content, instructions)
-
-    update_page(doc_id, page_index, content=new_content)
+    use_cache = bool(data.get("cache"))
+    if GEMINI_ASYNC:
+        # La llamada corre en el event loop del proceso; este hilo solo espera
+        new_content = aio_runner.run(edit_section_async(current_content, instructions, use_cache))
+    else:
+        new_content = edit_section(current_content, instructions, use_cache=use_cache)
+
+    # Si alguien cambió el documento mientras Gemini respondía, 409 en vez de pisarlo
+    result = update_page(doc_id, page_index, content=new_content, expected_version=version)
+    if not result:
+        return jsonify({"error": "Página no encontrada"}), 404
 
     return jsonify({
         "page_index": page_index,
         "content": new_content,
+        "version": result[0],
     })
 
 
+@api.route("/api/gemini/cache/stats")
+def api_gemini_cache_stats():
+    """Aciertos/fallos de la caché de respuestas de Gemini."""
+    return jsonify(gemini_cache_stats())
+
+
+@api.route("/api/gemini/client/stats")
+def api_gemini_client_stats():
+    """Reintentos, esperas por cuota y estado del cortocircuito de este worker."""
+    return jsonify(gemini_client.stats())
+
+
+@api.route("/api/gemini/parse/stats")
+def api_gemini_parse_stats():
+    """Páginas rescatadas, reparadas y descartadas de respuestas mal formadas."""
+    return jsonify(parse_stats())
+
+
 # ─── Actualizar página manualmente ───
 @api.route("/api/update-page", methods=["POST"])
 def api_update_page():
     """
     Actualiza el contenido de una página directamente.
-    Body JSON: { doc_id, page_index, content }
+    Body JSON: { doc_id, page_index, content, version? }
+    - version: versión que editó el cliente; si el documento cambió responde 409
     """
     data = request.get_json()
     doc_id = data.get("doc_id")
     page_index = data.get("page_index", 0)
     content = data.get("content", "")
+    try:
+        version = _client_version(data.get("version"))
+    except ValueError:
+        return jsonify({"error": "version debe ser un entero"}), 400
 
-    result = update_page(doc_id, page_index, content=content)
+    result = update_page(doc_id, page_index, content=content, expected_version=version)
     if not result:
         return jsonify({"error": "Página no encontrada"}), 404
 
-    return jsonify({"page_index": page_index, "content": content})
+    return jsonify({"page_index": page_index, "content": content, "version": result[0]})
+
+
+# ─── Operaciones de página en lote ───
+@api.route("/api/pages/batch", methods=["POST"])
+def api_pages_batch():
+    """
+    Aplica varias operaciones de página de forma atómica (ver page_ops).
+    Body JSON: { doc_id, ops: [...], version? }
+    - version: versión que editó el cliente; si el documento cambió responde 409
+    Retorna solo lo que cambió: { version, total_pages, results }
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Se requieren datos JSON"}), 400
+    doc_id = data.get("doc_id")
+    try:
+        version = _client_version(data.get("version"))
+    except ValueError:
+        return jsonify({"error": "version debe ser un entero"}), 400
+
+    try:
+        outcome = apply_page_ops(doc_id, data.get("ops"), version)
+    except InvalidOperation as e:
+        return jsonify({"error": str(e)}), 400
+    if outcome is None:
+        return jsonify({"error": "Documento no encontrado"}), 404
+
+    version, results, total = outcome
+    return jsonify({"version": version, "total_pages": total, "results": results})
 
 
 # ─── Preview HTML del documento ───
 @api.route("/api/preview/<doc_id>")
 def api_preview(doc_id):
-    """Retorna el HTML completo del documento para preview."""
-    doc = get_document(doc_id)
+    """
+    Retorna el HTML completo del documento para preview.
+    El HTML de cada versión se construye una vez; si el cliente ya la
+    tiene (If-None-Match) responde 304.
+    """
+    doc, version = get_document_versioned(doc_id)
+    if not doc:
+        return jsonify({"error": "Documento no encontrado"}), 404
+
+    response = versioned_response(
+        document_etag(doc_id, version, "preview", RENDER_BUILD),
+        lambda: build_document_html(doc),
+        "text/html",
+    )
+    response.headers["X-Document-Version"] = str(version)
+    return response
+
+
+@api.route("/api/preview/<doc_id>/fragment/<part>")
+def api_preview_fragment(doc_id, part):
+    """
+    Retorna el HTML de una sola parte del documento (sin estilos).
+    - part: cover, toc o el índice de una página (0-based)
+    Los estilos se piden una vez en /api/preview/styles.css.
+    """
+    doc, version = get_document_versioned(doc_id)
     if not doc:
         return jsonify({"error": "Documento no encontrado"}), 404
+    # isdigit() solo no basta: acepta dígitos Unicode ("²") que int() rechaza
+    html = render_fragment(doc, int(part) if part.isascii() and part.isdigit() else part)
+    if html is None:
+        return jsonify({"error": "Parte no encontrada"}), 404
+
+    response = versioned_response(
+        document_etag(doc_id, version, f"fragment-{part}", RENDER_BUILD), lambda: html, "text/html",
+    )
+    response.headers["X-Document-Version"] = str(version)
+    return response
+
+
+_STYLESHEET_ETAG = "styles-" + hashlib.sha256(STYLESHEET.encode("utf-8")).hexdigest()[:16]
 
-    html = build_document_html(doc)
-    return html, 200, {"Content-Type": "text/html; charset=utf-8"}
+
+@api.route("/api/preview/styles.css")
+def api_preview_styles():
+    """Hoja de estilos del preview, para mostrar fragmentos sueltos."""
+    return versioned_response(_STYLESHEET_ETAG, lambda: STYLESHEET, "text/css")
 
 
 # ─── Descargar PDF ───
 @api.route("/api/download/<doc_id>")
 def api_download(doc_id):
-    """Genera y descarga el PDF del documento."""
+    """
+    Descarga el PDF del documento.
+    - Reutiliza el PDF en caché si el documento no cambió
+    - Responde 304 si el cliente ya tiene esa versión (If-None-Match)
+    """
     doc = get_document(doc_id)
     if not doc:
         return jsonify({"error": "Documento no encontrado"}), 404
 
-    pdf_path = generate_pdf(doc)
-    return send_file(
-        pdf_path,
+    key = render_key(doc)
+    if request.if_none_match.contains(key):
+        return "", 304, {"ETag": f'"{key}"'}
+
+    try:
+        pdf, key = get_pdf(doc)
+    except RenderBusy:
+        return jsonify({"error": "El servidor está generando muchos PDFs, intenta en un momento"}), 503, \
+            {"Retry-After": "5"}
+    except RenderTimeout:
+        return jsonify({"error": "El documento tardó demasiado en generarse"}), 504
+    except RenderFailed as e:
+        return jsonify({"error": f"No se pudo generar el PDF: {e}"}), 500
+
+    response = send_file(
+        pdf,
         as_attachment=True,
         download_name=f"{doc['title']}.pdf",
         mimetype="application/pdf",
+        etag=key,
     )
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@api.route("/api/render/stats")
+def api_render_stats():
+    """Utilización y cola del pool de render de este worker."""
+    return jsonify(pool_stats())
 
 
 # ─── Subir imagen propia ───
@@ -164,11 +494,16 @@ def api_download(doc_id):
 def api_upload_image():
     """
     Sube una imagen del usuario y la asocia a una página.
-    Form data: doc_id, page_index, image (file), caption
+    La imagen se reduce a resolución de impresión y se recodifica (image_service).
+    Form data: doc_id, page_index, image (file), caption, version?
     """
     doc_id = request.form.get("doc_id")
     page_index = int(request.form.get("page_index", 0))
     caption = request.form.get("caption", "")
+    try:
+        version = _client_version(request.form.get("version"))
+    except ValueError:
+        return jsonify({"error": "version debe ser un entero"}), 400
 
     if "image" not in request.files:
         return jsonify({"error": "No se envió ninguna imagen"}), 400
@@ -177,20 +512,36 @@ def api_upload_image():
     if file.filename == "":
         return jsonify({"error": "Nombre de archivo vacío"}), 400
 
-    # Guardar el archivo
-    ext = os.path.splitext(file.filename)[1]
-    filename = f"{uuid.uuid4().hex[:12]}{ext}"
-    filepath = os.path.join(UPLOAD_DIR, filename)
-    file.save(filepath)
+    # Reducir, limpiar y guardar por hash de contenido
+    try:
+        stored = ingest_image(file.read())
+    except InvalidImage:
+        return jsonify({"error": "El archivo no es una imagen válida"}), 400
 
     # URL relativa para servir el archivo
-    image_url = f"/uploads/{filename}"
-    result = add_image_to_page(doc_id, page_index, image_url, caption)
+    image_url = f"/uploads/{stored['filename']}"
+    meta = {
+        "original_bytes": stored["original_bytes"],
+        "stored_bytes": stored["stored_bytes"],
+    }
+    result = add_image_to_page(doc_id, page_index, image_url, caption, meta, version)
 
     if not result:
         return jsonify({"error": "Página no encontrada"}), 404
 
-    return jsonify({"image_url": image_url, "caption": caption})
+    return jsonify({"image_url": image_url, "caption": caption, **meta, "version": result[0]})
+
+
+@api.route("/api/uploads/stats")
+def api_upload_stats():
+    """Bytes originales vs. guardados de las imágenes procesadas por este worker."""
+    return jsonify(ingest_stats())
+
+
+@api.route("/api/janitor/stats")
+def api_janitor_stats():
+    """Barridos de limpieza de disco y bytes liberados por este worker."""
+    return jsonify(janitor_stats())
 
 
 # ─── Eliminar imagen de una página ───
@@ -198,15 +549,19 @@ def api_upload_image():
 def api_remove_image():
     """
     Elimina una imagen de una página.
-    Body JSON: { doc_id, page_index, image_index }
+    Body JSON: { doc_id, page_index, image_index, version? }
     """
     data = request.get_json()
     doc_id = data.get("doc_id")
     page_index = data.get("page_index", 0)
     image_index = data.get("image_index", 0)
+    try:
+        version = _client_version(data.get("version"))
+    except ValueError:
+        return jsonify({"error": "version debe ser un entero"}), 400
 
-    result = remove_image_from_page(doc_id, page_index, image_index)
+    result = remove_image_from_page(doc_id, page_index, image_index, version)
     if not result:
         return jsonify({"error": "Imagen no encontrada"}), 404
 
-    return jsonify({"success": True})
+    return jsonify({"success": True, "version": result[0]})
@@ -1,5 +1,7 @@
 const API_BASE = "";
 
+const JOB_POLL_MS = 1500;
+
 export async function generateDocument(data) {
     const res = await fetch(`${API_BASE}/api/generate`, {
         method: "POST",
@@ -10,41 +12,113 @@ export async function generateDocument(data) {
         const err = await res.json();
         throw new Error(err.error || "Error al generar");
     }
+    const { job_id } = await res.json();
+    return waitForJob(job_id);
+}
+
+// Genera con streaming: onPage(index, page) se llama por cada página que llega
+export async function streamDocument(data, onPage) {
+    const res = await fetch(`${API_BASE}/api/generate/stream`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(data),
+    });
+    if (!res.ok || !res.body) throw new Error("Error al generar");
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let docId = null;
+    for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep;
+        while ((sep = buffer.indexOf("\n\n")) !== -1) {
+            const raw = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            const event = raw.match(/^event: (.*)$/m)?.[1];
+            const payload = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || "{}");
+            if (event === "doc") docId = payload.doc_id;
+            else if (event === "page") onPage?.(payload.index, payload.page);
+            else if (event === "error") throw new Error(payload.error);
+            else if (event === "done") return { doc_id: docId, total_pages: payload.total_pages };
+        }
+    }
+    throw new Error("La generación se interrumpió");
+}
+
+export async function getJob(jobId) {
+    const res = await fetch(`${API_BASE}/api/jobs/${jobId}`);
+    if (!res.ok) throw new Error("Trabajo no encontrado");
     return res.json();
 }
 
+// La generación corre en segundo plano: consultar hasta que termine
+async function waitForJob(jobId) {
+    for (;;) {
+        const job = await getJob(jobId);
+        if (job.status === "done") return job;
+        if (job.status === "failed") throw new Error(job.error || "Error al generar");
+        await new Promise((resolve) => setTimeout(resolve, JOB_POLL_MS));
+    }
+}
+
 export async function getDocument(docId) {
     const res = await fetch(`${API_BASE}/api/document/${docId}`);
     if (!res.ok) throw new Error("Documento no encontrado");
     return res.json();
 }
 
-export async function editPageWithAI(docId, pageIndex, instructions) {
+export async function editPageWithAI(docId, pageIndex, instructions, version) {
     const res = await fetch(`${API_BASE}/api/edit-page`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ doc_id: docId, page_index: pageIndex, instructions }),
+        body: JSON.stringify({ doc_id: docId, page_index: pageIndex, instructions, version }),
     });
+    if (res.status === 409) throw await conflictError(res);
     if (!res.ok) throw new Error("Error al editar");
     return res.json();
 }
 
-export async function updatePage(docId, pageIndex, content) {
+export async function updatePage(docId, pageIndex, content, version) {
     const res = await fetch(`${API_BASE}/api/update-page`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ doc_id: docId, page_index: pageIndex, content }),
+        body: JSON.stringify({ doc_id: docId, page_index: pageIndex, content, version }),
     });
+    if (res.status === 409) throw await conflictError(res);
     if (!res.ok) throw new Error("Error al guardar");
     return res.json();
 }
 
+// Aplica varias operaciones de página en una sola petición (atómica).
+// Las posiciones de "patch" son índices de string de JS (unidades UTF-16), no code points.
+// version: la que editó el cliente; si el documento cambió se lanza un error con .version actual
+export async function applyPageOps(docId, ops, version) {
+    const res = await fetch(`${API_BASE}/api/pages/batch`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ doc_id: docId, ops, version }),
+    });
+    const body = await res.json();
+    if (!res.ok) throw Object.assign(new Error(body.error || "Error al guardar"), { version: body.version });
+    return body;
+}
+
 export async function getPreviewHTML(docId) {
     const res = await fetch(`${API_BASE}/api/preview/${docId}`);
     if (!res.ok) throw new Error("Error al cargar preview");
     return res.text();
 }
 
+// HTML de una sola parte: "cover", "toc" o el índice de una página (estilos en /api/preview/styles.css)
+export async function getPreviewFragment(docId, part) {
+    const res = await fetch(`${API_BASE}/api/preview/${docId}/fragment/${part}`);
+    if (!res.ok) throw new Error("Error al cargar preview");
+    return res.text();
+}
+
 export async function downloadPDF(docId, title) {
     const res = await fetch(`${API_BASE}/api/download/${docId}`);
     if (!res.ok) throw new Error("Error al generar PDF");
@@ -57,25 +131,34 @@ export async function downloadPDF(docId, title) {
     URL.revokeObjectURL(url);
 }
 
-export async function uploadImage(docId, pageIndex, file, caption) {
+export async function uploadImage(docId, pageIndex, file, caption, version) {
     const fd = new FormData();
     fd.append("doc_id", docId);
     fd.append("page_index", pageIndex);
     fd.append("image", file);
     fd.append("caption", caption || "");
+    if (version != null) fd.append("version", version);
     const res = await fetch(`${API_BASE}/api/upload-image`, { method: "POST", body: fd });
+    if (res.status === 409) throw await conflictError(res);
     if (!res.ok) throw new Error("Error al subir imagen");
     return res.json();
 }
 
-export async function removeImage(docId, pageIndex, imageIndex) {
+export async function removeImage(docId, pageIndex, imageIndex, version) {
     const res = await fetch(`${API_BASE}/api/remove-image`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ doc_id: docId, page_index: pageIndex, image_index: imageIndex }),
+        body: JSON.stringify({ doc_id: docId, page_index: pageIndex, image_index: imageIndex, version }),
     });
+    if (res.status === 409) throw await conflictError(res);
     if (!res.ok) throw new Error("Error al eliminar imagen");
     return res.json();
 }
 
+// 409: el documento cambió desde la versión editada; .conflict y .version (la actual)
+async function conflictError(res) {
+    const body = await res.json();
+    return Object.assign(new Error(body.error), { conflict: true, version: body.version });
+}
+
 export { API_BASE };